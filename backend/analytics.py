@@ -0,0 +1,229 @@
+"""Daily economy rollups: coins issued and spent, payment revenue and the USDT liability.
+
+``analytics_daily`` holds one document per day, keyed by the day's start::
+
+    {_id: day, until, coins: {kind: delta}, earned, net_coins, outstanding_coins,
+     payments_approved, revenue_usdt, withdrawals_requested, withdrawals_requested_usdt,
+     withdrawals_approved_usdt, withdrawals_rejected_usdt, pending_withdrawal_usdt}
+
+``rollup`` only reads what happened since the open day's ``until``
+watermark. It sums the ledger entries, approved payments and withdrawals
+in that slice and adds them with one conditional ``$inc`` that also moves
+the watermark, so workers running it concurrently never count a slice
+twice. ``outstanding_coins`` and ``pending_withdrawal_usdt`` are running
+totals carried from one day to the next. Nothing here reads ``users``.
+
+The watermark trails the clock by ``ROLLUP_LAG``. Ledger entries are
+stamped when recorded but written up to a flush interval later, and the
+lag makes sure they have landed first. Outstanding coins start from the
+ledger's opening entries, so run ``python ledger.py seed`` before the
+first rollup.
+
+    python analytics.py rollup
+    python analytics.py rebuild   # drop the rollups and recompute them from the ledger
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from background import PeriodicTask
+from cli import run_with_db
+from ledger import DAY, GAME, PAYMENT, PURCHASE, REFERRAL, REFUND, SIGNUP, WITHDRAW, day_start
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_LAG = timedelta(minutes=5)
+# Ledger kinds that bring new coins into the economy
+MINTED_KINDS = (SIGNUP, GAME, REFERRAL, PAYMENT)
+ROLLUP_PROJECTION = {"until": 0}
+
+_COUNTERS = (
+    "earned", "net_coins", "outstanding_coins", "payments_approved", "revenue_usdt",
+    "withdrawals_requested", "withdrawals_requested_usdt", "withdrawals_approved_usdt",
+    "withdrawals_rejected_usdt", "pending_withdrawal_usdt",
+)
+# Carried over from the previous day instead of starting at zero
+_RUNNING_TOTALS = ("outstanding_coins", "pending_withdrawal_usdt")
+
+
+async def _slice_totals(db, start: datetime, end: datetime) -> dict:
+    """``$inc`` document for everything that happened in ``[start, end)``."""
+    window = {"$gte": start, "$lt": end}
+    inc = {}
+
+    async for kind in db.ledger.aggregate([
+        {"$match": {"t": window}},
+        {"$group": {"_id": "$k", "d": {"$sum": "$d"}, "e": {"$sum": "$e"}}},
+    ]):
+        inc[f"coins.{kind['_id']}"] = kind["d"]
+        inc["net_coins"] = inc.get("net_coins", 0) + kind["d"]
+        inc["earned"] = inc.get("earned", 0) + kind["e"]
+    inc["outstanding_coins"] = inc.get("net_coins", 0)
+
+    async for payments in db.payments.aggregate([
+        {"$match": {"status": "approved", "processed_at": window}},
+        {"$group": {"_id": None, "n": {"$sum": 1}, "usdt": {"$sum": "$amount_usdt"}}},
+    ]):
+        inc["payments_approved"] = payments["n"]
+        inc["revenue_usdt"] = payments["usdt"]
+
+    async for requested in db.withdrawals.aggregate([
+        {"$match": {"created_at": window}},
+        {"$group": {"_id": None, "n": {"$sum": 1}, "usdt": {"$sum": "$usdt_amount"}}},
+    ]):
+        inc["withdrawals_requested"] = requested["n"]
+        inc["withdrawals_requested_usdt"] = requested["usdt"]
+    pending = inc.get("withdrawals_requested_usdt", 0)
+    async for processed in db.withdrawals.aggregate([
+        {"$match": {"processed_at": window}},
+        {"$group": {"_id": "$status", "usdt": {"$sum": "$usdt_amount"}}},
+    ]):
+        if processed["_id"] in ("approved", "rejected"):
+            inc[f"withdrawals_{processed['_id']}_usdt"] = processed["usdt"]
+            pending -= processed["usdt"]
+    inc["pending_withdrawal_usdt"] = pending
+    return {field: value for field, value in inc.items() if value}
+
+
+async def _first_activity(db) -> Optional[datetime]:
+    firsts = [
+        doc[field]
+        for collection, field in ((db.ledger, "t"), (db.payments, "created_at"), (db.withdrawals, "created_at"))
+        for doc in [await collection.find_one({}, {"_id": 0, field: 1}, sort=[(field, 1)])]
+        if doc is not None
+    ]
+    return min(firsts) if firsts else None
+
+
+async def _open_day(db, day: datetime, previous: Optional[dict]) -> None:
+    doc = {"_id": day, "until": day, "coins": {}, **{field: 0 for field in _COUNTERS}}
+    if previous is not None:
+        for field in _RUNNING_TOTALS:
+            doc[field] = previous.get(field, 0)
+    try:
+        await db.analytics_daily.insert_one(doc)
+    except DuplicateKeyError:
+        # Another worker opened it
+        pass
+
+
+async def rollup(db, now: Optional[datetime] = None) -> int:
+    """Bring the rollups up to ``now - ROLLUP_LAG``; returns the number of slices added."""
+    end = (now or datetime.utcnow()) - ROLLUP_LAG
+    # BSON dates have millisecond precision; a finer watermark would never be reached
+    end = end.replace(microsecond=end.microsecond // 1000 * 1000)
+    slices = 0
+    while True:
+        latest = await db.analytics_daily.find_one({}, sort=[("_id", -1)])
+        if latest is None:
+            first = await _first_activity(db)
+            if first is None or first >= end:
+                return slices
+            await _open_day(db, day_start(first), None)
+            continue
+        day_end = latest["_id"] + DAY
+        if latest["until"] >= day_end:
+            if day_end >= end:
+                return slices
+            await _open_day(db, day_end, latest)
+            continue
+        slice_end = min(end, day_end)
+        if slice_end <= latest["until"]:
+            return slices
+        inc = await _slice_totals(db, latest["until"], slice_end)
+        update = {"$set": {"until": slice_end}}
+        if inc:
+            update["$inc"] = inc
+        # Matches only while nobody else has moved the watermark
+        result = await db.analytics_daily.update_one({"_id": latest["_id"], "until": latest["until"]}, update)
+        slices += result.modified_count
+
+
+def _minted(day: dict) -> int:
+    return sum(day.get("coins", {}).get(kind, 0) for kind in MINTED_KINDS)
+
+
+def day_summary(day: dict, usdt_per_coin: float) -> dict:
+    coins = day.get("coins", {})
+    return {
+        "day": day["_id"],
+        "coins_minted": _minted(day),
+        "coins_spent": -coins.get(PURCHASE, 0),
+        "coins_withdrawn": -coins.get(WITHDRAW, 0),
+        "coins_refunded": coins.get(REFUND, 0),
+        "coins_by_kind": coins,
+        "net_coins": day.get("net_coins", 0),
+        "outstanding_coins": day.get("outstanding_coins", 0),
+        "payments_approved": day.get("payments_approved", 0),
+        "revenue_usdt": round(day.get("revenue_usdt", 0), 6),
+        "withdrawals_requested": day.get("withdrawals_requested", 0),
+        "withdrawals_requested_usdt": round(day.get("withdrawals_requested_usdt", 0), 6),
+        "withdrawals_approved_usdt": round(day.get("withdrawals_approved_usdt", 0), 6),
+        "withdrawals_rejected_usdt": round(day.get("withdrawals_rejected_usdt", 0), 6),
+        "pending_withdrawal_usdt": round(day.get("pending_withdrawal_usdt", 0), 6),
+        "liability_usdt": round(
+            day.get("outstanding_coins", 0) * usdt_per_coin + day.get("pending_withdrawal_usdt", 0), 6
+        ),
+    }
+
+
+async def daily_stats(db, since: datetime, usdt_per_coin: float) -> list:
+    """One summary per rolled-up day from ``since`` on, oldest first."""
+    return [
+        day_summary(day, usdt_per_coin)
+        async for day in db.analytics_daily.find({"_id": {"$gte": day_start(since)}}, ROLLUP_PROJECTION).sort("_id", 1)
+    ]
+
+
+async def period_stats(db, since: datetime, usdt_per_coin: float) -> dict:
+    """Totals over the days from ``since`` on, with the running totals as of the last rollup."""
+    days = await daily_stats(db, since, usdt_per_coin)
+    latest = await db.analytics_daily.find_one({}, {"_id": 0, "until": 1}, sort=[("_id", -1)])
+    totals = {
+        field: round(sum(day[field] for day in days), 6)
+        for field in (
+            "coins_minted", "coins_spent", "coins_withdrawn", "coins_refunded", "net_coins",
+            "payments_approved", "revenue_usdt", "withdrawals_requested", "withdrawals_requested_usdt",
+            "withdrawals_approved_usdt", "withdrawals_rejected_usdt",
+        )
+    }
+    current = days[-1] if days else {}
+    return {
+        "since": day_start(since),
+        "as_of": latest["until"] if latest else None,
+        "days": len(days),
+        **totals,
+        "outstanding_coins": current.get("outstanding_coins", 0),
+        "pending_withdrawal_usdt": current.get("pending_withdrawal_usdt", 0),
+        "liability_usdt": current.get("liability_usdt", 0),
+    }
+
+
+class AnalyticsRollup(PeriodicTask):
+    """Background task that runs ``rollup`` every ``interval`` seconds."""
+
+    description = "Analytics rollup"
+
+    def __init__(self, interval: float = 60.0):
+        super().__init__(interval)
+
+    async def tick(self, db) -> None:
+        await rollup(db)
+
+
+async def _main(db, command: str) -> int:
+    if command == "rebuild":
+        await db.analytics_daily.delete_many({})
+    print(f"rolled up {await rollup(db)} slices")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Economy rollups")
+    parser.add_argument("command", choices=["rollup", "rebuild"])
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, args.command)))
@@ -0,0 +1,276 @@
+"""Plausibility checks for client-reported game results.
+
+Results are checked twice. First, each submission is checked when it
+arrives:
+
+- Hard bounds on the game itself: base coins per crystal and crystals per
+  unit of distance. A result outside them is rejected. A distance of 0
+  means the client did not report one, as app builds before distance
+  reporting do, and skips the checks that need it.
+- A rolling window of the user's recent base coins. An outlier against it
+  is credited but flagged.
+
+The window is per worker and lost on restart, so nothing that needs the
+user's previous result to be right is decided here.
+
+Every result is also stored in ``game_results`` as
+``{u, s: ship, c: base coins, x: distance, n: crystals, p: coins paid, t, f: flags}``.
+
+Second, ``scan`` scores that history offline, in batches and vectorized
+with NumPy. Besides the bounds above it checks distance against the ship's
+top speed over the time since the user's previous stored result. It marks
+users whose results look implausible as ``cheat_flagged``. It runs outside
+the API, on a schedule; withdrawal approval only reads the flag and
+refuses flagged users.
+
+    python anticheat.py scan
+"""
+import argparse
+import math
+import os
+import sys
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from pymongo import UpdateOne
+
+from catalog import SHIP_DATA
+from cli import run_with_db
+
+# Hard violations: the result is rejected
+COINS_PER_CRYSTAL = "coins_per_crystal"
+CRYSTAL_DENSITY = "crystal_density"
+HARD_FLAGS = frozenset([COINS_PER_CRYSTAL, CRYSTAL_DENSITY])
+# Soft: credited, counted against the user by the offline scan
+OUTLIER = "outlier"
+
+RESULT_PROJECTION = {"_id": 0, "u": 1, "s": 1, "c": 1, "x": 1, "n": 1, "t": 1}
+
+
+class Bounds:
+    """Gameplay limits; ``max_speed`` is distance per second before the ship's speed bonus."""
+
+    def __init__(
+        self,
+        max_coins_per_crystal: float = 10.0,
+        max_crystals_per_distance: float = 0.05,
+        crystal_slack: int = 5,
+        max_speed: float = 50.0,
+        outlier_z: float = 4.0,
+        min_history: int = 8,
+        max_outlier_ratio: float = 0.2,
+    ):
+        self.max_coins_per_crystal = max_coins_per_crystal
+        self.max_crystals_per_distance = max_crystals_per_distance
+        self.crystal_slack = crystal_slack
+        self.max_speed = max_speed
+        self.outlier_z = outlier_z
+        self.min_history = min_history
+        self.max_outlier_ratio = max_outlier_ratio
+
+    def ship_speed(self, ship_id: str) -> float:
+        return self.max_speed * (1 + SHIP_DATA.get(ship_id, SHIP_DATA["basic"])["speed"])
+
+
+def bounds_from_env(environ) -> Bounds:
+    return Bounds(
+        max_coins_per_crystal=float(environ.get('ANTICHEAT_MAX_COINS_PER_CRYSTAL', 10)),
+        max_crystals_per_distance=float(environ.get('ANTICHEAT_MAX_CRYSTALS_PER_DISTANCE', 0.05)),
+        max_speed=float(environ.get('ANTICHEAT_MAX_SPEED', 50)),
+        outlier_z=float(environ.get('ANTICHEAT_OUTLIER_Z', 4)),
+    )
+
+
+def _spread_floor(mean: float, std: float) -> float:
+    # A player who always scores about the same has a tiny std; a quarter of
+    # the mean keeps an ordinary good run from looking like an outlier
+    return max(std, 0.25 * mean, 1.0)
+
+
+class _Window:
+    """Ring buffer of a user's last base coin amounts with running sums."""
+
+    __slots__ = ("coins", "index", "count", "total", "total_sq")
+
+    def __init__(self, size: int):
+        self.coins = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def push(self, coins: float) -> None:
+        if self.count == len(self.coins):
+            old = self.coins[self.index]
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.coins[self.index] = coins
+        self.index = (self.index + 1) % len(self.coins)
+        self.total += coins
+        self.total_sq += coins * coins
+
+    def is_outlier(self, coins: float, bounds: Bounds) -> bool:
+        if self.count < bounds.min_history:
+            return False
+        mean = self.total / self.count
+        std = math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+        return coins > mean + bounds.outlier_z * _spread_floor(mean, std)
+
+
+class PlausibilityChecker:
+    """Per-submission checks; keeps a ``window``-sized ring buffer for up to ``max_users`` users."""
+
+    def __init__(self, bounds: Bounds, window: int = 32, max_users: int = 100000):
+        self.bounds = bounds
+        self.window = window
+        self.max_users = max_users
+        self.checked = 0
+        self.rejected = 0
+        self.outliers = 0
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+
+    def hard_flags(self, coins: int, distance: int, crystals: int) -> list:
+        """The hard violations of one result, without touching any user's window."""
+        bounds = self.bounds
+        flags = []
+        if coins < 0 or distance < 0 or crystals < 0 or coins > crystals * bounds.max_coins_per_crystal:
+            flags.append(COINS_PER_CRYSTAL)
+        if distance and crystals > distance * bounds.max_crystals_per_distance + bounds.crystal_slack:
+            flags.append(CRYSTAL_DENSITY)
+        return flags
+
+    def check(self, user_id: str, coins: int, distance: int, crystals: int) -> list:
+        """Return the flags of one result; accepted results are added to the user's window."""
+        bounds = self.bounds
+        flags = self.hard_flags(coins, distance, crystals)
+        self.checked += 1
+        if flags:
+            self.rejected += 1
+            return flags
+
+        window = self._windows.get(user_id)
+        if window is None:
+            window = self._windows[user_id] = _Window(self.window)
+            while len(self._windows) > self.max_users:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(user_id)
+        if window.is_outlier(coins, bounds):
+            flags.append(OUTLIER)
+            self.outliers += 1
+        window.push(coins)
+        return flags
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._windows),
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "outliers": self.outliers,
+        }
+
+
+def score_results(users, ships, coins, distance, crystals, seconds, bounds: Bounds) -> list:
+    """Score a batch of results sorted by user, then time.
+
+    Every user's results must all be in the batch. Returns one
+    ``{user_id, results, hard, outliers, score, flagged}`` per user. Unlike the
+    online check, the outlier test uses the mean and spread of the user's
+    whole history in the batch.
+    """
+    users = np.asarray(users, dtype=object)
+    coins = np.asarray(coins, dtype=np.float64)
+    distance = np.asarray(distance, dtype=np.float64)
+    crystals = np.asarray(crystals, dtype=np.float64)
+    seconds = np.asarray(seconds, dtype=np.float64)
+    ship_ids, ship_index = np.unique(np.asarray(ships, dtype=object), return_inverse=True)
+    speed = np.array([bounds.ship_speed(ship_id) for ship_id in ship_ids])[ship_index]
+
+    hard = (coins < 0) | (distance < 0) | (crystals < 0) | (coins > crystals * bounds.max_coins_per_crystal)
+    hard |= (distance > 0) & (crystals > distance * bounds.max_crystals_per_distance + bounds.crystal_slack)
+    same_user = users[1:] == users[:-1]
+    hard[1:] |= same_user & (distance[1:] > speed[1:] * np.maximum(np.diff(seconds), 0.0))
+
+    user_ids, user_index, counts = np.unique(users, return_inverse=True, return_counts=True)
+    mean = np.bincount(user_index, coins) / counts
+    std = np.sqrt(np.maximum(np.bincount(user_index, coins * coins) / counts - mean * mean, 0.0))
+    spread = np.maximum(np.maximum(std, 0.25 * mean), 1.0)
+    outlier = (counts[user_index] >= bounds.min_history) & (coins > (mean + bounds.outlier_z * spread)[user_index])
+
+    hard_counts = np.bincount(user_index, hard, minlength=len(user_ids)).astype(np.int64)
+    outlier_counts = np.bincount(user_index, outlier & ~hard, minlength=len(user_ids)).astype(np.int64)
+    scores = (hard_counts + outlier_counts) / counts
+    flagged = (hard_counts > 0) | (outlier_counts / counts > bounds.max_outlier_ratio)
+    return [
+        {
+            "user_id": user_ids[i],
+            "results": int(counts[i]),
+            "hard": int(hard_counts[i]),
+            "outliers": int(outlier_counts[i]),
+            "score": round(float(scores[i]), 4),
+            "flagged": bool(flagged[i]),
+        }
+        for i in range(len(user_ids))
+    ]
+
+
+async def scan(db, bounds: Bounds, user_ids: Optional[list] = None, batch_size: int = 100000) -> list:
+    """Score the stored results of ``user_ids`` (everyone when None) and write the verdicts.
+
+    Results are read in ``(u, t)`` order and scored in batches of about
+    ``batch_size``. A batch is only cut between two users. Every scanned
+    user gets ``cheat_flagged``/``cheat_score``, so a clean rescan clears
+    an earlier flag. Returns the per-user scores.
+    """
+    query = {"u": {"$in": user_ids}} if user_ids is not None else {}
+    cursor = db.game_results.find(query, RESULT_PROJECTION).sort([("u", 1), ("t", 1)])
+    scored = []
+    columns = ([], [], [], [], [], [])
+    now = datetime.utcnow()
+
+    async def score_batch():
+        users, ships, coins, distance, crystals, times = columns
+        seconds = np.array(times, dtype="datetime64[ms]").astype(np.int64) / 1000
+        batch = score_results(users, ships, coins, distance, crystals, seconds, bounds)
+        for column in columns:
+            column.clear()
+        operations = [
+            UpdateOne({"id": user["user_id"]}, {"$set": {
+                "cheat_flagged": user["flagged"], "cheat_score": user["score"], "cheat_scanned_at": now,
+            }})
+            for user in batch
+        ]
+        if operations:
+            await db.users.bulk_write(operations, ordered=False)
+        scored.extend(batch)
+
+    async for result in cursor:
+        if len(columns[0]) >= batch_size and result["u"] != columns[0][-1]:
+            await score_batch()
+        for column, field in zip(columns, ("u", "s", "c", "x", "n", "t")):
+            column.append(result[field])
+    if columns[0]:
+        await score_batch()
+    return scored
+
+
+async def _main(db, batch_size: int) -> int:
+    scored = await scan(db, bounds_from_env(os.environ), batch_size=batch_size)
+    flagged = [user for user in scored if user["flagged"]]
+    for user in flagged:
+        print(user)
+    print(f"scanned {len(scored)} users, flagged {len(flagged)}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Game result plausibility scan")
+    parser.add_argument("command", choices=["scan"])
+    parser.add_argument("--batch-size", type=int, default=100000)
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, args.batch_size)))
@@ -0,0 +1,113 @@
+"""Base classes for the tasks a worker runs next to the API.
+
+``PeriodicTask`` runs ``tick`` every ``interval`` seconds until stopped;
+``WriteBehindQueue`` collects items and hands them to ``_flush`` in
+batches from a background task.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs ``tick`` every ``interval`` seconds until ``stop`` cancels it.
+
+    ``start`` passes its arguments on to every ``tick``. A failing tick is
+    logged as ``"<description> failed"`` and tried again on the next one;
+    a tick that returns True is run again without waiting.
+    """
+
+    description = "Background task"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task = None
+
+    def start(self, *args) -> None:
+        self._task = asyncio.create_task(self._run(*args))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def tick(self, *args) -> Optional[bool]:
+        raise NotImplementedError
+
+    async def _run(self, *args) -> None:
+        while True:
+            try:
+                if await self.tick(*args):
+                    continue
+            except Exception:
+                logger.exception("%s failed", self.description)
+            await asyncio.sleep(self.interval)
+
+
+class WriteBehindQueue:
+    """Items queued in memory and written by a background task.
+
+    The task wakes up every ``flush_interval`` seconds, or as soon as
+    ``max_batch`` items are queued, and passes up to ``max_batch`` of them
+    to ``_flush``. While a full batch is still queued it keeps flushing
+    without waiting, so a backlog drains as fast as ``_flush`` allows.
+    ``stop`` flushes everything still queued before it returns.
+    """
+
+    def __init__(self, flush_interval: float, max_batch: int):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._collection = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def start(self, collection) -> None:
+        self._collection = collection
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still queued and stop the background task.
+
+        The final flush is shielded: cancelling ``stop`` does not cut it
+        short.
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await asyncio.shield(self._task)
+        self._task = None
+
+    def _enqueue(self, item) -> None:
+        self._queue.put_nowait(item)
+        if self._queue.qsize() >= self.max_batch:
+            self._wakeup.set()
+
+    async def _flush(self, batch: list) -> None:
+        raise NotImplementedError
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while not self._queue.empty():
+                batch = []
+                while len(batch) < self.max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                await self._flush(batch)
+                if not self._closing and self._queue.qsize() < self.max_batch:
+                    break
+            if self._closing and self._queue.empty():
+                return
@@ -0,0 +1,71 @@
+"""Guarded single-statement balance and status mutations.
+
+Every write carries its precondition in the filter (``coins >= amount``,
+``status == "pending"``), so Mongo applies the check and the change
+atomically on one document. Concurrent requests cannot overdraw a balance
+or process a payment twice, and no lock or extra read is needed. A None
+or empty result means the precondition did not hold.
+"""
+import uuid
+from datetime import datetime
+from typing import Optional
+
+BALANCE_PROJECTION = {"_id": 0, "coins": 1, "owned_ships": 1}
+
+
+async def debit_coins(users, user_id: str, amount: int, extra_filter: Optional[dict] = None,
+                      extra_update: Optional[dict] = None, session=None) -> Optional[dict]:
+    """Take ``amount`` coins from ``user_id`` only if the balance covers it.
+
+    Returns the balance fields as they were before the debit (the filter
+    may no longer match afterwards), or None if the user is missing, cannot
+    afford it, or fails ``extra_filter``.
+    """
+    update = {"$inc": {"coins": -amount}}
+    if extra_update:
+        update.update(extra_update)
+    return await users.find_one_and_update(
+        {"id": user_id, "coins": {"$gte": amount}, **(extra_filter or {})},
+        update,
+        projection=BALANCE_PROJECTION,
+        session=session
+    )
+
+
+async def credit_coins(users, user_id: str, amount: int, session=None) -> bool:
+    result = await users.update_one({"id": user_id}, {"$inc": {"coins": amount}}, session=session)
+    return result.matched_count == 1
+
+
+async def transition(collection, doc_id: str, to_status: str, now: datetime,
+                     from_status: str = "pending", session=None) -> Optional[dict]:
+    """Move one document from ``from_status`` to ``to_status``.
+
+    Returns the document as it was before the change, or None if it does
+    not exist or someone else already moved it.
+    """
+    return await collection.find_one_and_update(
+        {"id": doc_id, "status": from_status},
+        {"$set": {"status": to_status, "processed_at": now}},
+        projection={"_id": 0},
+        session=session
+    )
+
+
+async def claim(collection, doc_ids: list, to_status: str, now: datetime,
+                from_status: str = "pending", session=None) -> list:
+    """Batch form of ``transition``: returns the documents this call moved.
+
+    Each document is tagged with a fresh ``batch_id`` by a single
+    ``update_many``, so a concurrent claim of the same ids can never see
+    a document as moved by both calls.
+    """
+    if not doc_ids:
+        return []
+    batch_id = str(uuid.uuid4())
+    await collection.update_many(
+        {"id": {"$in": doc_ids}, "status": from_status},
+        {"$set": {"status": to_status, "processed_at": now, "batch_id": batch_id}},
+        session=session
+    )
+    return await collection.find({"batch_id": batch_id}, {"_id": 0}, session=session).to_list(None)
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+from pymongo.errors import BulkWriteError
+
+from background import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class BatchInserter(WriteBehindQueue):
+    """Write-behind buffer for append-only documents.
+
+    ``add`` only enqueues the document; each flush writes a batch with a
+    single unordered ``insert_many``.
+    """
+
+    def __init__(self, flush_interval: float = 0.2, max_batch: int = 1000):
+        super().__init__(flush_interval, max_batch)
+        self.flushes = 0
+        self.flushed_docs = 0
+
+    def add(self, doc: dict) -> None:
+        self._enqueue(doc)
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            await self._collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if not all(error["code"] == DUPLICATE_KEY for error in e.details["writeErrors"]):
+                await self._retry(batch)
+                return
+            # Only documents an earlier, partially applied attempt already wrote
+        except Exception:
+            await self._retry(batch)
+            return
+        self.flushes += 1
+        self.flushed_docs += len(batch)
+
+    async def _retry(self, batch: list) -> None:
+        if self._closing:
+            logger.exception("Dropping %d unflushed %s documents", len(batch), self._collection.name)
+            return
+        logger.exception("%s flush failed, retrying %d documents", self._collection.name, len(batch))
+        for doc in batch:
+            # insert_many filled in _id, so documents that did get written
+            # are rejected by the _id index on retry instead of duplicated
+            self._queue.put_nowait(doc)
+        await asyncio.sleep(self.flush_interval)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "flushes": self.flushes,
+            "flushed_docs": self.flushed_docs,
+        }
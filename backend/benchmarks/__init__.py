@@ -0,0 +1,8 @@
+"""In-process benchmarks for the API hot paths.
+
+Run from the backend directory: ``python -m benchmarks`` runs the endpoint
+mix suite (see ``benchmarks/suite.py``), ``python -m benchmarks.login_storm``
+and ``python -m benchmarks.settlement`` are focused single-path benchmarks.
+They drive the FastAPI app through httpx's ASGI transport against a
+mongomock-motor database, so no server or mongod is needed.
+"""
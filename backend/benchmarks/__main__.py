@@ -0,0 +1,102 @@
+"""Run the endpoint benchmark suite and optionally compare against a baseline.
+
+    python -m benchmarks --output bench.json
+    python -m benchmarks --scenario game_result_storm --scale 2
+    python -m benchmarks --compare baseline.json --threshold 0.15
+
+With --compare, the exit status is 1 if any endpoint's p95 grew or its
+throughput dropped by more than --threshold (a fraction) versus the baseline.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmarks.suite import SCENARIOS, run_scenario
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def run(names: list, scale: int) -> dict:
+    scenarios = {}
+    for name in names:
+        scenarios[name] = await run_scenario(name, scale)
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "backend": "mongomock",
+            "scale": scale,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Return human-readable regressions of ``current`` against ``baseline``."""
+    regressions = []
+    for name, scenario in current["scenarios"].items():
+        old_endpoints = baseline.get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for label, stats in scenario["endpoints"].items():
+            old = old_endpoints.get(label)
+            if not old or not old.get("count") or not stats.get("count"):
+                continue
+            if stats["p95_ms"] > old["p95_ms"] * (1 + threshold):
+                regressions.append(f"{name}: {label} p95 {old['p95_ms']}ms -> {stats['p95_ms']}ms")
+            if stats["throughput_rps"] < old["throughput_rps"] * (1 - threshold):
+                regressions.append(
+                    f"{name}: {label} throughput {old['throughput_rps']} -> {stats['throughput_rps']} req/s"
+                )
+    return regressions
+
+
+def print_table(result: dict) -> None:
+    for name, scenario in result["scenarios"].items():
+        print(f"\n{name} ({scenario['duration_s']}s)", file=sys.stderr)
+        for label, stats in scenario["endpoints"].items():
+            print(
+                f"  {label:<46} n={stats['count']:<6} {stats['throughput_rps']:>8} req/s  "
+                f"p50={stats['p50_ms']:<8} p95={stats['p95_ms']:<8} p99={stats['p99_ms']:<8} err={stats['errors']}",
+                file=sys.stderr
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies request counts")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.scenario or list(SCENARIOS), args.scale))
+    print_table(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
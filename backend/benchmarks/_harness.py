@@ -0,0 +1,75 @@
+import logging
+import os
+import time
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+# Benchmarks drive many requests from one client address
+for limit in ("RATE_LIMIT_LOGIN", "RATE_LIMIT_REGISTER", "RATE_LIMIT_GAME_RESULT"):
+    os.environ.setdefault(limit, "off")
+
+import server  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+app = None
+
+
+def setup_server(db_name: str = "cosmic_miner_bench"):
+    """Build a fresh app on a fresh in-memory database and return its services.
+
+    The services are also made current, so server functions can be called
+    directly from the benchmark.
+    """
+    global app
+    app = server.create_app()
+    services = app.state.services
+    services.client = AsyncMongoMockClient()
+    services.db = services.client[db_name]
+    server.use_services(services)
+    return services
+
+
+def api_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+
+def percentiles(samples_ms: list) -> dict:
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+    last = len(ordered) - 1
+
+    def pick(q: float) -> float:
+        return round(ordered[min(last, int(q * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+async def timed(coro) -> tuple:
+    started = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def register_users(client: httpx.AsyncClient, count: int, prefix: str = "bench") -> list:
+    """Register ``count`` users and return ``(email, password, token)`` tuples."""
+    users = []
+    for i in range(count):
+        email = f"{prefix}{i}@bench.example.com"
+        response = await client.post(
+            "/api/auth/register",
+            json={"email": email, "password": "bench-password", "username": f"{prefix}{i}"},
+        )
+        response.raise_for_status()
+        users.append((email, "bench-password", response.json()["access_token"]))
+    return users
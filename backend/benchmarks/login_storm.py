@@ -0,0 +1,64 @@
+"""p99 latency of /api/leaderboard while a login storm is running.
+
+    python -m benchmarks.login_storm --concurrency 32 --polls 200
+"""
+import argparse
+import asyncio
+import json
+
+from benchmarks._harness import api_client, percentiles, register_users, setup_server, timed
+
+
+async def poll_leaderboard(client, polls: int) -> list:
+    samples = []
+    for _ in range(polls):
+        response, elapsed = await timed(client.get("/api/leaderboard"))
+        response.raise_for_status()
+        samples.append(elapsed)
+    return samples
+
+
+async def login_worker(client, credentials, stop: asyncio.Event, counters: dict) -> None:
+    email, password, _ = credentials
+    while not stop.is_set():
+        response = await client.post("/api/auth/login", json={"email": email, "password": password})
+        counters[response.status_code] = counters.get(response.status_code, 0) + 1
+
+
+async def run(concurrency: int, polls: int, users: int) -> dict:
+    setup_server()
+    async with api_client() as client:
+        accounts = await register_users(client, users)
+        idle = await poll_leaderboard(client, polls)
+
+        stop = asyncio.Event()
+        counters: dict = {}
+        workers = [
+            asyncio.create_task(login_worker(client, accounts[i % len(accounts)], stop, counters))
+            for i in range(concurrency)
+        ]
+        await asyncio.sleep(0.2)
+        storm = await poll_leaderboard(client, polls)
+        stop.set()
+        await asyncio.gather(*workers)
+
+    return {
+        "benchmark": "login_storm",
+        "concurrency": concurrency,
+        "leaderboard_idle": percentiles(idle),
+        "leaderboard_during_storm": percentiles(storm),
+        "login_status_counts": {str(code): count for code, count in sorted(counters.items())},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent login loops")
+    parser.add_argument("--polls", type=int, default=200, help="leaderboard requests per phase")
+    parser.add_argument("--users", type=int, default=4, help="accounts the storm logs in as")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.concurrency, args.polls, args.users)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
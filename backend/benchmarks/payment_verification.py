@@ -0,0 +1,166 @@
+"""Submit-to-credit latency of TRC20 payments verified against a fake TRON node.
+
+    python -m benchmarks.payment_verification --payments 500 --confirm-after-ms 200
+
+The fake node is a Starlette app served in-process through httpx's ASGI
+transport. It answers ``gettransactioninfobyid`` the way a solidity node
+does: ``{}`` until a transaction is confirmed, then the receipt and the
+USDT Transfer log. Every user registers a payment wallet first. One
+payment in ten is sent to the wrong address, one in ten underpays and one
+in ten claims a transfer another user's wallet made, and none of them may
+be approved.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from benchmarks._harness import api_client, percentiles, register_users, setup_server
+from catalog import ITEMS_BY_ID
+from payment_verification import (
+    TRANSFER_TOPIC, USDT_CONTRACT, USDT_DECIMALS, PaymentVerifier, TronNode, address_hex, base58_address
+)
+from server import TRC20_ADDRESS
+
+OTHER_ADDRESS = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+
+
+class FakeTronNode:
+    def __init__(self, confirm_after: float):
+        self.confirm_after = confirm_after
+        self.transactions: dict = {}
+        self.requests = 0
+        self.app = Starlette(routes=[
+            Route("/walletsolidity/gettransactioninfobyid", self.transaction_info, methods=["POST"]),
+        ])
+
+    def transfer(self, tx_hash: str, from_address: str, to_address: str, usdt: float) -> None:
+        sent_at = time.time()
+        self.transactions[tx_hash] = (sent_at, {
+            "id": tx_hash,
+            "blockTimeStamp": int(sent_at * 1000),
+            "contract_address": "41" + address_hex(USDT_CONTRACT),
+            "receipt": {"result": "SUCCESS"},
+            "log": [{
+                "address": address_hex(USDT_CONTRACT),
+                "topics": [
+                    TRANSFER_TOPIC, "0" * 24 + address_hex(from_address), "0" * 24 + address_hex(to_address)
+                ],
+                "data": format(round(usdt * 10 ** USDT_DECIMALS), "064x"),
+            }],
+        })
+
+    async def transaction_info(self, request):
+        self.requests += 1
+        tx_hash = (await request.json())["value"]
+        sent_at, info = self.transactions.get(tx_hash, (None, None))
+        if info is None or time.time() - sent_at < self.confirm_after:
+            return JSONResponse({})
+        return JSONResponse(info)
+
+
+async def run(payments: int, confirm_after: float, concurrency: int) -> dict:
+    services = setup_server()
+    fake = FakeTronNode(confirm_after)
+    verifier = PaymentVerifier(
+        TronNode("http://node", transport=httpx.ASGITransport(app=fake.app)),
+        TRC20_ADDRESS,
+        interval=0.05,
+        concurrency=concurrency,
+    )
+    # Immediately due again instead of backing off, to measure the pipeline rather than the retry schedule
+    verifier.max_backoff = 0
+    # Only the index under test; mongomock ignores partialFilterExpression on the others
+    await services.db.payments.create_index("tx_hash", unique=True)
+    services.ledger.start(services.db.ledger)
+
+    async with api_client() as client:
+        users = await register_users(client, min(payments, 50), prefix="payer")
+        wallets = []
+        for _, _, token in users:
+            wallets.append(base58_address(os.urandom(20).hex()))
+            response = await client.post(
+                "/api/shop/payment-wallet", json={"address": wallets[-1]},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            response.raise_for_status()
+        item = ITEMS_BY_ID["coins_1000"]
+        submitted = {}
+        expected_rejections = set()
+        for i in range(payments):
+            tx_hash = uuid.uuid4().hex + uuid.uuid4().hex
+            wallet = wallets[i % len(users)]
+            if i % 10 == 3:
+                fake.transfer(tx_hash, wallet, OTHER_ADDRESS, item.price_usdt)
+                expected_rejections.add(tx_hash)
+            elif i % 10 == 5:
+                fake.transfer(tx_hash, wallets[(i + 1) % len(users)], TRC20_ADDRESS, item.price_usdt)
+                expected_rejections.add(tx_hash)
+            elif i % 10 == 7:
+                fake.transfer(tx_hash, wallet, TRC20_ADDRESS, item.price_usdt / 2)
+                expected_rejections.add(tx_hash)
+            else:
+                fake.transfer(tx_hash, wallet, TRC20_ADDRESS, item.price_usdt)
+            response = await client.post(
+                "/api/shop/submit-payment",
+                json={"tx_hash": tx_hash, "amount_usdt": item.price_usdt, "item_id": item.id},
+                headers={"Authorization": f"Bearer {users[i % len(users)][2]}"},
+            )
+            response.raise_for_status()
+            submitted[response.json()["payment_id"]] = (tx_hash, time.perf_counter())
+        duplicate = await client.post(
+            "/api/shop/submit-payment",
+            json={"tx_hash": next(iter(submitted.values()))[0], "amount_usdt": item.price_usdt, "item_id": item.id},
+            headers={"Authorization": f"Bearer {users[0][2]}"},
+        )
+
+    latencies = []
+    started = time.perf_counter()
+    settled: set = set()
+    while len(settled) < len(submitted) and time.perf_counter() - started < 60:
+        await verifier.run_once(services.db, services.client, services.ledger)
+        async for payment in services.db.payments.find(
+            {"id": {"$nin": list(settled)}, "$or": [{"status": "approved"}, {"verification": {"$exists": True}}]},
+            {"_id": 0, "id": 1, "status": 1},
+        ):
+            settled.add(payment["id"])
+            if payment["status"] == "approved":
+                latencies.append((time.perf_counter() - submitted[payment["id"]][1]) * 1000)
+        await asyncio.sleep(0.01)
+    await services.ledger.stop()
+    await verifier.node.aclose()
+
+    wrongly_approved = await services.db.payments.count_documents({
+        "status": "approved", "tx_hash": {"$in": list(expected_rejections)}
+    })
+    return {
+        "benchmark": "payment_verification",
+        "payments": payments,
+        "confirm_after_ms": confirm_after * 1000,
+        "node_requests": fake.requests,
+        "approved": len(latencies),
+        "left_for_admin": len(settled) - len(latencies),
+        "wrongly_approved": wrongly_approved,
+        "duplicate_tx_hash_status": duplicate.status_code,
+        "submit_to_credit": percentiles(latencies),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--confirm-after-ms", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.payments, args.confirm_after_ms / 1000, args.concurrency)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
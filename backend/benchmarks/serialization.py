@@ -0,0 +1,107 @@
+"""Bytes and CPU per response: plain dicts through jsonable_encoder vs response models with orjson.
+
+    python -m benchmarks.serialization --iterations 20000
+
+"before" is what FastAPI did for these handlers before response models:
+jsonable_encoder over the returned dict, rendered by the stdlib-json
+JSONResponse. "after" is the current path: the route's response model
+validated and serialized by pydantic-core, rendered by ORJSONResponse.
+The login row compares the BSON Mongo sends for the full user document
+against the projected one.
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import bson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+import server
+from benchmarks import _harness
+from benchmarks._harness import setup_server
+
+
+def sample_payloads(leaderboard) -> dict:
+    now = datetime.utcnow()
+    boosts = [
+        {"id": "boost_2x_1h", "name": "2x Boost (1 Saat)", "multiplier": 2.0,
+         "activated_at": now, "expires_at": now + timedelta(hours=1)},
+        {"id": "boost_10x_30m", "name": "10x Mega Boost (30dk)", "multiplier": 10.0,
+         "activated_at": now, "expires_at": now + timedelta(minutes=30)},
+    ]
+    me = {
+        "id": "0c52a012-fcff-4c4d-935b-671d18b0bacb", "email": "pilot@example.com", "username": "pilot",
+        "coins": 123456, "total_earned": 654321, "ship_level": 3,
+        "owned_ships": ["basic", "ship_silver", "ship_gold"], "active_ship": "ship_gold",
+        "active_boosts": boosts, "is_admin": False, "referral_code": "ADAD9A99", "referral_count": 12,
+    }
+    game_result = {"coins_earned": 200, "base_coins": 10, "multiplier": 20.0, "total_coins": 123656, "total_earned": 654521}
+    leaderboard.clear()
+    for i in range(60):
+        leaderboard.upsert(f"user-{i}", 100000 - i * 137, f"pilot{i}", "ship_gold" if i % 3 else "basic")
+    return {"/api/auth/me": me, "/api/game/result": game_result, "/api/leaderboard": {"leaderboard": leaderboard.top()}}
+
+
+def cpu_per_call(fn, iterations: int) -> float:
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+async def async_cpu_per_call(fn, iterations: int) -> float:
+    started = time.process_time()
+    for _ in range(iterations):
+        await fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+async def run(iterations: int) -> dict:
+    services = setup_server()
+    routes = {route.path: route for route in _harness.app.routes if isinstance(route, APIRoute)}
+    results = {}
+    for path, payload in sample_payloads(services.leaderboard).items():
+        route = routes[path]
+
+        def before():
+            return JSONResponse(jsonable_encoder(payload)).body
+
+        if path == "/api/leaderboard":
+            # Served from the pre-rendered snapshot, only rebuilt when the top list changes
+            async def after():
+                return services.leaderboard.snapshot()
+        else:
+            async def after():
+                content = await serialize_response(field=route.response_field, response_content=payload, is_coroutine=True)
+                return ORJSONResponse(content).body
+
+        results[path] = {
+            "before": {"bytes": len(before()), "cpu_us": round(cpu_per_call(before, iterations), 2)},
+            "after": {"bytes": len(await after()), "cpu_us": round(await async_cpu_per_call(after, iterations), 2)},
+        }
+
+    full_user = {
+        **server.User(email="pilot@example.com", username="pilot", password_hash="$2b$12$" + "x" * 53).dict(),
+        "_id": bson.ObjectId(),
+    }
+    projected = {field: full_user[field] for field, keep in server.LOGIN_PROJECTION.items() if keep and field in full_user}
+    results["/api/auth/login (mongo document)"] = {
+        "before": {"bytes": len(bson.encode(full_user))},
+        "after": {"bytes": len(bson.encode(projected))},
+    }
+    return {"benchmark": "serialization", "iterations": iterations, "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.iterations)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Settled game results per second: two round-trips vs one find_one_and_update.
+
+    python -m benchmarks.settlement --games 5000
+    python -m benchmarks.settlement --mongo-url mongodb://localhost:27017
+
+mongomock has no network hop, so by default this mostly measures operator
+overhead; the round-trip saving only shows up against a real mongod.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks._harness import setup_server
+
+
+async def legacy_settle(db, user: dict, final_coins: int, now: datetime) -> dict:
+    """The pre-find_one_and_update settlement: rewrite boosts, then read back."""
+    valid_boosts = [b for b in user.get("active_boosts", []) if b["expires_at"] > now]
+    await db.users.update_one(
+        {"id": user["id"]},
+        {"$inc": {"coins": final_coins, "total_earned": final_coins}, "$set": {"active_boosts": valid_boosts}},
+    )
+    return await db.users.find_one({"id": user["id"]})
+
+
+async def current_settle(db, user: dict, final_coins: int, now: datetime) -> dict:
+    import server
+
+    return await server.settle_game_result(user["id"], final_coins)
+
+
+async def seed_users(db, count: int) -> list:
+    now = datetime.utcnow()
+    users = []
+    for i in range(count):
+        users.append({
+            "id": str(uuid.uuid4()),
+            "email": f"settle{i}@bench.example.com",
+            "username": f"settle{i}",
+            "password_hash": "x" * 60,
+            "coins": 100,
+            "total_earned": 100,
+            "active_ship": "basic",
+            "owned_ships": ["basic"],
+            "active_boosts": [
+                {"id": "boost_2x_1h", "name": "2x", "multiplier": 2.0, "expires_at": now + timedelta(hours=1)},
+                {"id": "boost_5x_1h", "name": "5x", "multiplier": 5.0, "expires_at": now - timedelta(hours=1)},
+            ],
+            "boost_multiplier": 2.0,
+            "boost_until": now + timedelta(hours=1),
+        })
+    await db.users.delete_many({})
+    await db.users.insert_many([dict(u) for u in users])
+    return users
+
+
+async def measure(settle, db, users: list, games: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with sem:
+            await settle(db, users[i % len(users)], 10, datetime.utcnow())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(games)))
+    elapsed = time.perf_counter() - started
+    return {"games": games, "seconds": round(elapsed, 3), "games_per_second": round(games / elapsed, 1)}
+
+
+async def run(games: int, users: int, concurrency: int, mongo_url: str) -> dict:
+    services = setup_server()
+    if mongo_url:
+        services.db = AsyncIOMotorClient(mongo_url)[f"cosmic_miner_bench_{uuid.uuid4().hex[:8]}"]
+    db = services.db
+    try:
+        results = {}
+        for name, settle in (("update_then_find", legacy_settle), ("find_one_and_update", current_settle)):
+            seeded = await seed_users(db, users)
+            results[name] = await measure(settle, db, seeded, games, concurrency)
+    finally:
+        if mongo_url:
+            await db.client.drop_database(db.name)
+
+    return {
+        "benchmark": "settlement",
+        "backend": "mongod" if mongo_url else "mongomock",
+        "concurrency": concurrency,
+        "results": results,
+        "speedup": round(
+            results["find_one_and_update"]["games_per_second"] / results["update_then_find"]["games_per_second"], 2
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--mongo-url", default="", help="benchmark against a real mongod instead of mongomock")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.games, args.users, args.concurrency, args.mongo_url)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
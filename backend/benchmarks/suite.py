@@ -0,0 +1,180 @@
+"""Endpoint mix scenarios for the benchmark runner (see benchmarks/__main__.py)."""
+import asyncio
+import random
+import time
+
+from benchmarks._harness import api_client, percentiles, register_users, setup_server
+from catalog import ITEMS_BY_ID
+
+
+class Recorder:
+    """Collects latencies and error counts per ``METHOD route`` label.
+
+    Throughput is measured over each label's own active window (first
+    request sent to last response received), so scenario setup such as
+    registering accounts does not dilute it.
+    """
+
+    def __init__(self):
+        self.samples: dict = {}
+        self.errors: dict = {}
+        self.windows: dict = {}
+
+    async def request(self, client, method: str, url: str, label: str = None, ok=(200,), **kwargs):
+        label = f"{method} {label or url}"
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        finished = time.perf_counter()
+        self.samples.setdefault(label, []).append((finished - started) * 1000)
+        first, _ = self.windows.get(label, (started, finished))
+        self.windows[label] = (min(first, started), finished)
+        if response.status_code not in ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            stats = percentiles(samples)
+            first, last = self.windows[label]
+            stats["throughput_rps"] = round(len(samples) / (last - first), 1) if last > first else 0.0
+            stats["errors"] = self.errors.get(label, 0)
+            endpoints[label] = stats
+        return {"duration_s": round(duration, 3), "endpoints": endpoints}
+
+
+async def gather_bounded(concurrency: int, coroutines) -> list:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(coro):
+        async with sem:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+
+def auth_headers(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def game_result(coins: int) -> dict:
+    # Shaped like the app's submission: 10 coins per crystal, distance not reported
+    return {"coins_earned": coins, "distance": 0, "crystals_collected": -(-coins // 10)}
+
+
+async def auth_burst(client, rec: Recorder, scale: int) -> None:
+    """Concurrent signups followed by concurrent logins for the same accounts."""
+    count = 4 * scale
+    await gather_bounded(16, (
+        rec.request(client, "POST", "/api/auth/register", json={
+            "email": f"burst{i}@bench.example.com", "password": "bench-password", "username": f"burst{i}"
+        })
+        for i in range(count)
+    ))
+    await gather_bounded(16, (
+        rec.request(client, "POST", "/api/auth/login", json={
+            "email": f"burst{i % count}@bench.example.com", "password": "bench-password"
+        })
+        for i in range(2 * count)
+    ))
+
+
+async def game_result_storm(client, rec: Recorder, scale: int) -> None:
+    users = await register_users(client, 2 * scale, prefix="storm")
+    await gather_bounded(64, (
+        rec.request(
+            client, "POST", "/api/game/result",
+            json=game_result(random.randint(10, 500)),
+            headers=auth_headers(users[i % len(users)][2])
+        )
+        for i in range(200 * scale)
+    ))
+
+
+async def leaderboard_polling(client, rec: Recorder, scale: int) -> None:
+    users = await register_users(client, 2 * scale, prefix="poll")
+    await gather_bounded(32, (
+        rec.request(client, "GET", "/api/leaderboard") if i % 4 else
+        rec.request(client, "GET", "/api/leaderboard/me", headers=auth_headers(users[i % len(users)][2]))
+        for i in range(400 * scale)
+    ))
+
+
+async def shop_browsing(client, rec: Recorder, scale: int) -> None:
+    etag = (await client.get("/api/shop/items")).headers.get("etag", "")
+    await gather_bounded(32, (
+        rec.request(client, "GET", "/api/shop/items", label="/api/shop/items (cold)") if i % 2 else
+        rec.request(client, "GET", "/api/shop/items", label="/api/shop/items (etag)", ok=(200, 304),
+                    headers={"If-None-Match": etag})
+        for i in range(400 * scale)
+    ))
+
+
+async def admin_approvals(client, rec: Recorder, scale: int) -> None:
+    import server
+
+    (_, _, admin_token), (_, _, buyer_token) = await register_users(client, 2, prefix="admin")
+    await server.services.db.users.update_one({"username": "admin0"}, {"$set": {"is_admin": True}})
+    server.services.session_cache.clear()
+    admin, buyer = auth_headers(admin_token), auth_headers(buyer_token)
+
+    # Coins, boosts and a ship, so approvals exercise every kind of credit update
+    items = [ITEMS_BY_ID[item_id] for item_id in ("coins_1000", "boost_2x_1h", "coins_1000", "ship_diamond")]
+
+    async def submit(i: int) -> str:
+        item = items[i % len(items)]
+        response = await rec.request(client, "POST", "/api/shop/submit-payment", headers=buyer, json={
+            "tx_hash": f"bench-{i}-{random.random()}", "amount_usdt": item.price_usdt, "item_id": item.id
+        })
+        return response.json()["payment_id"]
+
+    single = await gather_bounded(16, (submit(i) for i in range(20 * scale)))
+    await gather_bounded(8, (
+        rec.request(client, "POST", f"/api/admin/approve-payment/{payment_id}",
+                    label="/api/admin/approve-payment/{id}", headers=admin)
+        for payment_id in single
+    ))
+
+    batched = await gather_bounded(16, (submit(i) for i in range(100 * scale)))
+    for start in range(0, len(batched), 50):
+        await rec.request(client, "POST", "/api/admin/approve-payments", headers=admin,
+                          json={"ids": batched[start:start + 50]})
+    await rec.request(client, "GET", "/api/admin/payments", headers=admin)
+
+
+async def mixed(client, rec: Recorder, scale: int) -> None:
+    """Weighted mix resembling production: mostly gameplay and polling."""
+    users = await register_users(client, 2 * scale, prefix="mix")
+    weighted = (
+        [("POST", "/api/game/result")] * 40 + [("GET", "/api/leaderboard")] * 25 +
+        [("GET", "/api/auth/me")] * 15 + [("GET", "/api/game/ship-data")] * 10 + [("GET", "/api/shop/items")] * 10
+    )
+    rng = random.Random(42)
+
+    def one(i: int):
+        method, url = rng.choice(weighted)
+        headers = auth_headers(users[i % len(users)][2])
+        body = game_result(rng.randint(10, 500)) if method == "POST" else None
+        return rec.request(client, method, url, headers=headers, json=body)
+
+    await gather_bounded(64, (one(i) for i in range(500 * scale)))
+
+
+SCENARIOS = {
+    "auth_burst": auth_burst,
+    "game_result_storm": game_result_storm,
+    "leaderboard_polling": leaderboard_polling,
+    "shop_browsing": shop_browsing,
+    "admin_approvals": admin_approvals,
+    "mixed": mixed,
+}
+
+
+async def run_scenario(name: str, scale: int) -> dict:
+    setup_server(f"cosmic_miner_bench_{name}")
+    rec = Recorder()
+    async with api_client() as client:
+        started = time.perf_counter()
+        await SCENARIOS[name](client, rec, scale)
+        duration = time.perf_counter() - started
+    return rec.report(duration)
@@ -0,0 +1,129 @@
+"""Boost expiry engine.
+
+Besides the ``active_boosts`` list, every user carries ``boost_multiplier``
+(the product of all active boosts) and ``boost_until`` (the earliest expiry
+among them, i.e. the moment that product stops being valid). Request
+handlers read just those two fields. BoostSweeper periodically
+recomputes users whose ``boost_until`` has passed, so expired boosts are
+dropped in bulk instead of on every request.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+from pymongo import UpdateOne
+
+from background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def _as_datetime(value):
+    # Boosts written before native datetimes stored ISO strings
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def boost_expiry(boost: dict) -> datetime:
+    return _as_datetime(boost["expires_at"])
+
+
+def boost_multiplier_at(boosts: list, at: datetime) -> float:
+    """Product of the boosts in ``boosts`` that were running at ``at``.
+
+    Boosts the sweeper has already pruned are gone from the list, so a
+    time before their expiry no longer gets them.
+    """
+    multiplier = 1.0
+    for boost in boosts:
+        activated_at = _as_datetime(boost.get("activated_at"))
+        if (activated_at is None or activated_at <= at) and boost_expiry(boost) > at:
+            multiplier *= boost.get("multiplier", 1.0)
+    return multiplier
+
+
+def summarize_boosts(boosts: list, now: datetime) -> tuple:
+    """Return ``(active_boosts, multiplier, until)`` for ``boosts`` at ``now``."""
+    active = []
+    multiplier = 1.0
+    until: Optional[datetime] = None
+    for boost in boosts:
+        expires_at = boost_expiry(boost)
+        if expires_at > now:
+            active.append({**boost, "expires_at": expires_at})
+            multiplier *= boost.get("multiplier", 1.0)
+            until = expires_at if until is None or expires_at < until else until
+    return active, multiplier, until
+
+
+def boost_fields(boosts: list, now: datetime) -> dict:
+    """``$set`` payload that stores ``boosts`` pruned, with their precomputed summary."""
+    active, multiplier, until = summarize_boosts(boosts, now)
+    return {"active_boosts": active, "boost_multiplier": multiplier, "boost_until": until}
+
+
+def effective_boost(user: dict, now: datetime) -> tuple:
+    """Return ``(multiplier, refresh)`` for ``user`` at ``now``.
+
+    ``refresh`` is None on the fast path. If the stored summary is stale
+    (the sweeper has not reached this user yet, or the document predates
+    the summary fields), it is the ``$set`` payload that repairs it.
+    """
+    until = user.get("boost_until")
+    if until is not None and until > now:
+        return user.get("boost_multiplier", 1.0), None
+    if not user.get("active_boosts"):
+        return 1.0, None
+    refresh = boost_fields(user["active_boosts"], now)
+    return refresh["boost_multiplier"], refresh
+
+
+class BoostSweeper(PeriodicTask):
+    """Background task that expires boosts in bulk.
+
+    Every ``interval`` seconds it loads the users whose ``boost_until`` has
+    passed and rewrites their pruned boosts and summary with one
+    ``bulk_write``. ``on_swept`` receives the ids of the users it changed.
+    """
+
+    description = "Boost sweep"
+
+    def __init__(self, interval: float = 30.0, batch_size: int = 1000,
+                 on_swept: Optional[Callable[[list], None]] = None):
+        super().__init__(interval)
+        self.batch_size = batch_size
+        self.on_swept = on_swept
+        self.swept = 0
+        self._converted = False
+
+    async def tick(self, collection) -> None:
+        if not self._converted:
+            # Documents from before the summary fields existed are converted once;
+            # credits fold new boosts into boost_multiplier and need it present
+            await self.sweep(collection, {"boost_until": {"$exists": False}})
+            self._converted = True
+        await self.sweep(collection, {"boost_until": {"$lte": datetime.utcnow()}})
+
+    async def sweep(self, collection, query: dict) -> int:
+        swept = 0
+        while True:
+            now = datetime.utcnow()
+            users = await collection.find(
+                query, {"_id": 0, "id": 1, "active_boosts": 1, "boost_until": 1}
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not users:
+                break
+            await collection.bulk_write([
+                UpdateOne(
+                    # Skip users whose boosts changed since they were read
+                    {"id": user["id"], "boost_until": user.get("boost_until")},
+                    {"$set": boost_fields(user.get("active_boosts", []), now)}
+                )
+                for user in users
+            ], ordered=False)
+            swept += len(users)
+            if self.on_swept is not None:
+                self.on_swept([user["id"] for user in users])
+            if len(users) < self.batch_size:
+                break
+        self.swept += swept
+        return swept
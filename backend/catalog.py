@@ -0,0 +1,86 @@
+"""Shop and ship catalog.
+
+Everything here is fixed at import time: item lookups go through
+ITEMS_BY_ID, gameplay stats through SHIP_DATA, and the /shop/items body is
+rendered once by render_shop_body.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class ShopItem(BaseModel):
+    id: str
+    name: str
+    description: str
+    type: str  # ship, boost, upgrade
+    price_coins: Optional[int] = None
+    price_usdt: Optional[float] = None
+    coin_multiplier: float = 1.0
+    speed_bonus: float = 0
+    image: str = ""
+    rarity: str = "common"  # common, rare, epic, legendary
+
+
+# Herkesin başlangıçta sahip olduğu gemi, mağazada satılmaz
+BASIC_SHIP = ShopItem(id="basic", name="Basic Shuttle", description="Başlangıç gemisi", type="ship", image="🛸")
+
+SHOP_ITEMS = [
+    # Coin ile alınabilir gemiler
+    ShopItem(id="ship_silver", name="Silver Cruiser", description="%50 daha fazla coin topla", type="ship", price_coins=500, coin_multiplier=1.5, rarity="common", image="🚀"),
+    ShopItem(id="ship_gold", name="Gold Voyager", description="2x coin topla", type="ship", price_coins=2000, coin_multiplier=2.0, speed_bonus=0.1, rarity="rare", image="✨"),
+    
+    # USDT ile alınabilir premium gemiler
+    ShopItem(id="ship_diamond", name="Diamond Striker", description="3x coin + Hız bonusu", type="ship", price_usdt=5.0, coin_multiplier=3.0, speed_bonus=0.2, rarity="epic", image="💎"),
+    ShopItem(id="ship_cosmic", name="Cosmic Destroyer", description="5x coin + Max hız", type="ship", price_usdt=15.0, coin_multiplier=5.0, speed_bonus=0.5, rarity="legendary", image="🌟"),
+    ShopItem(id="ship_phoenix", name="Phoenix Inferno", description="10x coin + Kalkan", type="ship", price_usdt=50.0, coin_multiplier=10.0, speed_bonus=0.3, rarity="legendary", image="🔥"),
+    
+    # Boostlar - USDT
+    ShopItem(id="boost_2x_1h", name="2x Boost (1 Saat)", description="1 saat boyunca 2x coin", type="boost", price_usdt=1.0, coin_multiplier=2.0, rarity="rare", image="⚡"),
+    ShopItem(id="boost_5x_1h", name="5x Boost (1 Saat)", description="1 saat boyunca 5x coin", type="boost", price_usdt=3.0, coin_multiplier=5.0, rarity="epic", image="💫"),
+    ShopItem(id="boost_10x_30m", name="10x Mega Boost (30dk)", description="30 dakika 10x coin", type="boost", price_usdt=5.0, coin_multiplier=10.0, rarity="legendary", image="🌈"),
+    
+    # Coin paketi - USDT
+    ShopItem(id="coins_1000", name="1000 Coin Paketi", description="1000 oyun coini", type="coins", price_usdt=2.0, rarity="common", image="💰"),
+    ShopItem(id="coins_5000", name="5000 Coin Paketi", description="5000 oyun coini + %10 bonus", type="coins", price_usdt=8.0, rarity="rare", image="💰"),
+    ShopItem(id="coins_15000", name="15000 Coin Paketi", description="15000 oyun coini + %25 bonus", type="coins", price_usdt=20.0, rarity="epic", image="💰"),
+]
+
+ITEMS_BY_ID = {item.id: item for item in SHOP_ITEMS}
+
+SHIP_DATA = {
+    ship.id: {"name": ship.name, "multiplier": ship.coin_multiplier, "speed": ship.speed_bonus, "image": ship.image}
+    for ship in [BASIC_SHIP] + [item for item in SHOP_ITEMS if item.type == "ship"]
+}
+
+BOOST_DURATION_MINUTES = {
+    "boost_2x_1h": 60,
+    "boost_5x_1h": 60,
+    "boost_10x_30m": 30,
+}
+
+COIN_PACKAGE_AMOUNTS = {
+    "coins_1000": 1000,
+    "coins_5000": 5500,  # +10% bonus
+    "coins_15000": 18750,  # +25% bonus
+}
+
+
+def render_shop_body(trc20_address: str) -> tuple:
+    """Serialize the /shop/items response once; returns ``(body, etag)``."""
+    body = json.dumps(
+        {"items": [item.dict() for item in SHOP_ITEMS], "trc20_address": trc20_address},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
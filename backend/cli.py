@@ -0,0 +1,21 @@
+"""Shared entry point for the maintenance commands (ledger.py, indexes.py, ...)."""
+import asyncio
+import os
+from pathlib import Path
+from typing import Awaitable, Callable
+
+
+def run_with_db(main: Callable[..., Awaitable[int]]) -> int:
+    """Run ``main(db)`` against the database configured in .env and return its exit code."""
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run() -> int:
+        load_dotenv(Path(__file__).parent / '.env')
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            return await main(client[os.environ.get('DB_NAME', 'cosmic_miner')])
+        finally:
+            client.close()
+
+    return asyncio.run(run())
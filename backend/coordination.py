@@ -0,0 +1,225 @@
+"""Cross-worker coordination: peer broadcast and shared token buckets.
+
+Every worker keeps its own session cache and leaderboard. When one worker
+changes them, it publishes the change so its peers can apply it too.
+Messages go to the *other* workers only; the publishing worker has
+already applied the change locally. ``publish`` never blocks. Messages
+are queued and sent by a background task, one batch per channel and
+flush.
+
+InMemoryCoordinator is for a single process: there are no peers, and
+token buckets live in a dict. RedisCoordinator uses Redis pub/sub and
+keeps token buckets in Redis hashes updated by a Lua script, so every
+worker draws from the same bucket. Any server that speaks the Redis
+protocol works, including fakeredis in tests.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Callable, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryCoordinator:
+    def __init__(self, idle_eviction_interval: float = 60.0):
+        self.idle_eviction_interval = idle_eviction_interval
+        self._handlers: dict = {}
+        # key -> [tokens, last refill (monotonic), seconds until the bucket is full again]
+        self._buckets: dict = {}
+        self._task = None
+
+    def subscribe(self, channel: str, handler: Callable) -> None:
+        """Call ``handler(message)`` for every message a peer publishes on ``channel``."""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel: str, message) -> None:
+        pass
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._evict_idle_buckets())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def take_token(self, key: str, rate: float, burst: int, cost: int = 1) -> tuple:
+        """Token bucket check; returns ``(allowed, retry_after_seconds)``."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(burst)
+        else:
+            tokens = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = [tokens, now, (burst - tokens) / rate]
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def evict_idle(self) -> int:
+        """Drop buckets that have refilled completely; they behave like absent ones."""
+        now = time.monotonic()
+        idle = [key for key, (_, updated, refill) in self._buckets.items() if now - updated >= refill]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+    async def _evict_idle_buckets(self) -> None:
+        while True:
+            await asyncio.sleep(self.idle_eviction_interval)
+            self.evict_idle()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "buckets": len(self._buckets)}
+
+
+# KEYS[1] bucket; ARGV rate, burst, cost, now (seconds). Returns {allowed, retry_after_ms}.
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 't', 'u')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, retry_after}
+"""
+
+
+class RedisCoordinator:
+    """Coordinator backed by a Redis-protocol server.
+
+    Idle buckets need no sweeping: each one expires as soon as it would
+    have refilled completely.
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = "cosmic:", flush_interval: float = 0.005):
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.redis = client
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.node_id = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+        self._handlers: dict = {}
+        self._outbox: dict = {}
+        self._wakeup = asyncio.Event()
+        self._take_token = client.register_script(_TAKE_TOKEN_SCRIPT)
+        self._pubsub = None
+        self._tasks: list = []
+
+    def subscribe(self, channel: str, handler: Callable) -> None:
+        """Call ``handler(message)`` for every message a peer publishes on ``channel``.
+
+        Register handlers before ``start``.
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel: str, message) -> None:
+        self._outbox.setdefault(channel, []).append(message)
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        if self._handlers:
+            await self._pubsub.subscribe(*(self.prefix + channel for channel in self._handlers))
+        self._tasks = [asyncio.create_task(self._send()), asyncio.create_task(self._receive())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self._flush()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self.redis.aclose()
+
+    async def _send(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Coordinator publish failed")
+
+    async def _flush(self) -> None:
+        if not self._outbox:
+            return
+        outbox, self._outbox = self._outbox, {}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for channel, messages in outbox.items():
+                pipe.publish(self.prefix + channel, orjson.dumps({"o": self.node_id, "m": messages}))
+                self.published += len(messages)
+            await pipe.execute()
+
+    async def _receive(self) -> None:
+        if not self._handlers:
+            return
+        while True:
+            try:
+                async for raw in self._pubsub.listen():
+                    if raw["type"] != "message":
+                        continue
+                    payload = orjson.loads(raw["data"])
+                    if payload["o"] == self.node_id:
+                        continue
+                    channel = raw["channel"].decode()[len(self.prefix):]
+                    for message in payload["m"]:
+                        self.received += 1
+                        for handler in self._handlers.get(channel, ()):
+                            handler(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Coordinator subscription failed, resubscribing")
+                await asyncio.sleep(1)
+
+    async def take_token(self, key: str, rate: float, burst: int, cost: int = 1) -> tuple:
+        """Token bucket check shared by every worker; returns ``(allowed, retry_after_seconds)``."""
+        allowed, retry_after_ms = await self._take_token(
+            keys=[f"{self.prefix}bucket:{key}"], args=[rate, burst, cost, time.time()]
+        )
+        return bool(allowed), retry_after_ms / 1000
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "node_id": self.node_id, "published": self.published, "received": self.received}
+
+
+def create_coordinator(url: Optional[str]):
+    """RedisCoordinator for a ``redis://`` URL, InMemoryCoordinator when unset."""
+    if url:
+        return RedisCoordinator(url)
+    return InMemoryCoordinator()
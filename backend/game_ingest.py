@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from pymongo import UpdateOne
+
+from background import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+
+class GameResultIngestor(WriteBehindQueue):
+    """Write-behind buffer for game result credits.
+
+    ``submit`` only enqueues ``(user_id, coins)``; each flush coalesces a
+    batch into one ``$inc`` per user and writes it with a single unordered
+    ``bulk_write``. ``on_flushed`` receives the ids of the users each
+    successful flush wrote.
+    """
+
+    def __init__(self, flush_interval: float = 0.05, max_batch: int = 500,
+                 on_flushed: Optional[Callable[[list], None]] = None):
+        super().__init__(flush_interval, max_batch)
+        self.on_flushed = on_flushed
+        self.flushes = 0
+        self.flushed_results = 0
+        self._pending: dict = {}
+        self._inflight: set = set()
+
+    def submit(self, user_id: str, coins: int) -> None:
+        self._pending[user_id] = self._pending.get(user_id, 0) + coins
+        self._enqueue((user_id, coins))
+
+    def pending_for(self, user_id: str) -> int:
+        """Coins credited to ``user_id`` that Mongo may not reflect yet."""
+        return self._pending.get(user_id, 0)
+
+    @property
+    def generation(self) -> int:
+        """Advances each time a flush moves credits out of ``pending_for``.
+
+        A document read while it changed may predate the flush, so the
+        pending credits no longer make up for it.
+        """
+        return self.flushes
+
+    def is_inflight(self, user_id: str) -> bool:
+        """True while a bulk write for ``user_id`` is outstanding.
+
+        A document read in that window may or may not include the delta, so
+        callers should not cache it.
+        """
+        return user_id in self._inflight
+
+    async def _flush(self, batch: list) -> None:
+        deltas: dict = {}
+        for user_id, coins in batch:
+            deltas[user_id] = deltas.get(user_id, 0) + coins
+
+        operations = [
+            UpdateOne({"id": user_id}, {"$inc": {"coins": coins, "total_earned": coins}})
+            for user_id, coins in deltas.items()
+        ]
+
+        self._inflight.update(deltas)
+        try:
+            await self._collection.bulk_write(operations, ordered=False)
+        except Exception:
+            if self._closing:
+                logger.exception("Dropping %d unflushed game results for %d users", len(batch), len(deltas))
+            else:
+                logger.exception("Game result flush failed, retrying %d users", len(deltas))
+                for user_id, coins in deltas.items():
+                    self._queue.put_nowait((user_id, coins))
+                await asyncio.sleep(self.flush_interval)
+                return
+        finally:
+            self._inflight.difference_update(deltas)
+
+        for user_id, coins in deltas.items():
+            remaining = self._pending.get(user_id, 0) - coins
+            if remaining:
+                self._pending[user_id] = remaining
+            else:
+                self._pending.pop(user_id, None)
+        self.flushes += 1
+        self.flushed_results += len(batch)
+        if self.on_flushed is not None:
+            self.on_flushed(list(deltas))
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "pending_users": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_results": self.flushed_results,
+        }
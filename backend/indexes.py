@@ -0,0 +1,278 @@
+"""Index declarations for every collection and a COLLSCAN check for the API's queries.
+
+    python indexes.py            # create indexes, then explain every query shape
+    python indexes.py --no-create
+
+Exits non-zero if any query shape in QUERY_SHAPES is still planned as a
+collection scan.
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from cli import run_with_db
+from leaderboard import LEADERBOARD_SORT
+from pagination import KEYSET_SORT
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel(
+            [("referral_code", ASCENDING)],
+            name="referral_code_unique",
+            unique=True,
+            partialFilterExpression={"referral_code": {"$type": "string"}},
+        ),
+        IndexModel(
+            [("referred_by", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="referred_by_created_at_id",
+        ),
+        # Leaderboard top list and rank counts, ties broken by id
+        IndexModel([("total_earned", DESCENDING), ("id", ASCENDING)], name="total_earned_desc_id"),
+        IndexModel(
+            [("boost_until", ASCENDING)],
+            name="boost_until",
+            partialFilterExpression={"boost_until": {"$type": "date"}},
+        ),
+        # One payer per wallet, so a transfer proves which user paid
+        IndexModel(
+            [("tron_wallet", ASCENDING)],
+            name="tron_wallet_unique",
+            unique=True,
+            partialFilterExpression={"tron_wallet": {"$type": "string"}},
+        ),
+    ],
+    "ledger": [
+        IndexModel([("u", ASCENDING), ("t", ASCENDING)], name="u_t"),
+        IndexModel([("t", ASCENDING)], name="t"),
+    ],
+    "game_results": [
+        IndexModel([("u", ASCENDING), ("t", ASCENDING)], name="u_t"),
+    ],
+    "ledger_snapshots": [
+        IndexModel([("u", ASCENDING), ("day", ASCENDING)], name="u_day_unique", unique=True),
+    ],
+    "payments": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="status_created_at_id"),
+        IndexModel([("batch_id", ASCENDING)], name="batch_id", sparse=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            name="user_id_idempotency_key_unique",
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}},
+        ),
+        IndexModel([("tx_hash", ASCENDING)], name="tx_hash"),
+        # Pending payments may share a tx_hash, an approved one holds it.
+        # Older payments must be normalized first: python payment_verification.py normalize
+        IndexModel(
+            [("tx_hash", ASCENDING), ("status", ASCENDING)],
+            name="tx_hash_approved_unique",
+            unique=True,
+            partialFilterExpression={"status": "approved"},
+        ),
+        IndexModel(
+            [("verify_next_at", ASCENDING)],
+            name="verify_next_at",
+            partialFilterExpression={"verify_next_at": {"$type": "date"}},
+        ),
+        IndexModel([("processed_at", ASCENDING)], name="processed_at"),
+    ],
+    "withdrawals": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="status_created_at_id"),
+        IndexModel([("batch_id", ASCENDING)], name="batch_id", sparse=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("idempotency_key", ASCENDING)],
+            name="user_id_idempotency_key_unique",
+            unique=True,
+            partialFilterExpression={"idempotency_key": {"$type": "string"}},
+        ),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("processed_at", ASCENDING)], name="processed_at"),
+    ],
+}
+
+# Superseded by a wider index above; dropped where an older deploy created them
+OBSOLETE_INDEXES = {
+    "users": ["referred_by"],
+}
+
+_SAMPLE_TIME = datetime(2024, 1, 1)
+
+# One entry per distinct filter/sort the request handlers send. The boost
+# sweeper's one-off conversion of legacy documents scans users once at
+# startup on purpose and is not listed, nor are the offline ledger.py
+# seed/verify/rebuild commands.
+QUERY_SHAPES = [
+    {"name": "auth lookup", "collection": "users", "filter": {"id": "x"}},
+    {"name": "login / register email check", "collection": "users", "filter": {"email": "x@example.com"}},
+    {"name": "register username check", "collection": "users", "filter": {"username": "x"}},
+    {"name": "register referral code", "collection": "users", "filter": {"referral_code": "ABCDEF12"}},
+    {"name": "invited users", "collection": "users", "filter": {"referred_by": "x"}, "sort": KEYSET_SORT},
+    {
+        "name": "invited users (next page)",
+        "collection": "users",
+        "filter": {"referred_by": "x", "$or": [
+            {"created_at": {"$gt": _SAMPLE_TIME}},
+            {"created_at": _SAMPLE_TIME, "id": {"$gt": "x"}},
+        ]},
+        "sort": KEYSET_SORT,
+    },
+    {"name": "leaderboard top list", "collection": "users", "filter": {}, "sort": LEADERBOARD_SORT, "limit": 50},
+    {
+        "name": "leaderboard rank",
+        "collection": "users",
+        "filter": {"$or": [{"total_earned": {"$gt": 100}}, {"total_earned": 100, "id": {"$lt": "x"}}]},
+    },
+    {"name": "boost sweep", "collection": "users", "filter": {"boost_until": {"$lte": _SAMPLE_TIME}}},
+    {"name": "ledger entries of a user", "collection": "ledger", "filter": {"u": "x", "t": {"$gte": _SAMPLE_TIME}}},
+    {"name": "ledger day to compact", "collection": "ledger", "filter": {"t": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}}},
+    {
+        "name": "ledger snapshots of a user",
+        "collection": "ledger_snapshots",
+        "filter": {"u": "x", "day": {"$lt": _SAMPLE_TIME}},
+        "sort": [("day", DESCENDING)],
+    },
+    {
+        "name": "latest ledger snapshots",
+        "collection": "ledger_snapshots",
+        "filter": {"u": {"$in": ["x", "y"]}, "day": {"$lt": _SAMPLE_TIME}},
+        "sort": [("u", ASCENDING), ("day", DESCENDING)],
+    },
+    {
+        "name": "game results of a user",
+        "collection": "game_results",
+        "filter": {"u": {"$in": ["x", "y"]}},
+        "sort": [("u", ASCENDING), ("t", ASCENDING)],
+    },
+    {"name": "payment by id", "collection": "payments", "filter": {"id": "x"}},
+    {
+        "name": "payment by tx_hash",
+        "collection": "payments",
+        "filter": {"tx_hash": "x", "$or": [{"status": "approved"}, {"status": "pending", "user_id": "x"}]},
+    },
+    {
+        "name": "approved payments by tx_hash",
+        "collection": "payments",
+        "filter": {"tx_hash": {"$in": ["x", "y"]}, "status": "approved"},
+    },
+    {"name": "payment by idempotency key", "collection": "payments", "filter": {"user_id": "x", "idempotency_key": "k"}},
+    {
+        "name": "payments due for verification",
+        "collection": "payments",
+        "filter": {"status": "pending", "verify_next_at": {"$lte": _SAMPLE_TIME}},
+        "sort": [("verify_next_at", ASCENDING)],
+    },
+    {
+        "name": "payments approved in a rollup slice",
+        "collection": "payments",
+        "filter": {"status": "approved", "processed_at": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+    },
+    {"name": "claimed payments", "collection": "payments", "filter": {"batch_id": "x"}},
+    {"name": "pending payments", "collection": "payments", "filter": {"status": "pending"}, "sort": KEYSET_SORT},
+    {
+        "name": "pending payments (next page)",
+        "collection": "payments",
+        "filter": {"status": "pending", "$or": [
+            {"created_at": {"$gt": _SAMPLE_TIME}},
+            {"created_at": _SAMPLE_TIME, "id": {"$gt": "x"}},
+        ]},
+        "sort": KEYSET_SORT,
+    },
+    {"name": "withdrawal by id", "collection": "withdrawals", "filter": {"id": "x"}},
+    {"name": "withdrawal by idempotency key", "collection": "withdrawals", "filter": {"user_id": "x", "idempotency_key": "k"}},
+    {
+        "name": "withdrawals requested in a rollup slice",
+        "collection": "withdrawals",
+        "filter": {"created_at": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+    },
+    {
+        "name": "withdrawals processed in a rollup slice",
+        "collection": "withdrawals",
+        "filter": {"processed_at": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+    },
+    {"name": "claimed withdrawals", "collection": "withdrawals", "filter": {"batch_id": "x"}},
+    {"name": "pending withdrawals", "collection": "withdrawals", "filter": {"status": "pending"}, "sort": KEYSET_SORT},
+    {
+        "name": "pending withdrawals (next page)",
+        "collection": "withdrawals",
+        "filter": {"status": "pending", "$or": [
+            {"created_at": {"$gt": _SAMPLE_TIME}},
+            {"created_at": _SAMPLE_TIME, "id": {"$gt": "x"}},
+        ]},
+        "sort": KEYSET_SORT,
+    },
+]
+
+
+async def ensure_indexes(db) -> None:
+    """Create every declared index; a no-op for indexes that already exist.
+
+    An index that cannot be built, such as a unique index over existing
+    duplicates, is logged and skipped so the worker still starts.
+    """
+    for collection, models in INDEXES.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s.%s: %s", collection, model.document["name"], e)
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+
+
+def _plan_stages(plan) -> list:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def explain_query_shapes(db) -> list:
+    """Return ``(shape, stages)`` for each query shape's winning plan."""
+    results = []
+    for shape in QUERY_SHAPES:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        if shape.get("limit"):
+            cursor = cursor.limit(shape["limit"])
+        explained = await cursor.explain()
+        results.append((shape, _plan_stages(explained["queryPlanner"]["winningPlan"])))
+    return results
+
+
+async def _main(db, create: bool) -> int:
+    if create:
+        await ensure_indexes(db)
+    failures = 0
+    for shape, stages in await explain_query_shapes(db):
+        scan = "COLLSCAN" in stages
+        failures += scan
+        print(f"{'FAIL' if scan else 'ok  '}  {shape['collection']:<12} {shape['name']:<32} {' <- '.join(stages)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create indexes and check query plans for COLLSCANs")
+    parser.add_argument("--no-create", action="store_true", help="only explain, do not create indexes")
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, create=not args.no_create)))
@@ -0,0 +1,136 @@
+from bisect import bisect_left, insort
+from typing import Callable, Optional
+
+import orjson
+from pymongo import ASCENDING, DESCENDING
+
+LEADERBOARD_PROJECTION = {"_id": 0, "id": 1, "username": 1, "total_earned": 1, "active_ship": 1}
+# Served by the users.total_earned_desc_id index, like the rank count below
+LEADERBOARD_SORT = [("total_earned", DESCENDING), ("id", ASCENDING)]
+
+
+class Leaderboard:
+    """The top ``size`` users by ``total_earned``, kept in memory.
+
+    ``_order`` is a sorted list of at most ``size`` ``(-total_earned,
+    user_id)`` keys. Once it is full, its last key is the threshold: totals
+    behind it are ignored, so memory and every update stay bounded by
+    ``size`` however many users there are. The serialized top list is
+    cached and only rebuilt after a change to it.
+
+    Ranks past the top list are counted in Mongo (``rank``). Writers always
+    pass absolute totals, so a user can enter the list from anywhere and a
+    replayed or reordered change is harmless. ``total_earned`` never
+    decreases, so no user falls out of the list without a write that
+    replaces them; ``seed`` reloads it from Mongo.
+
+    ``upsert``/``set_ship`` also pass the change to ``on_change`` as an
+    ``[operation, *args]`` list; other workers replay it with ``apply``.
+    """
+
+    def __init__(self, ship_image: Callable[[str], str], size: int = 50,
+                 on_change: Optional[Callable[[list], None]] = None):
+        self.size = size
+        self.ship_image = ship_image
+        self.on_change = on_change
+        self._users: dict = {}
+        self._order: list = []
+        self._snapshot: Optional[bytes] = None
+        # Bumped whenever the top list changes
+        self.version = 0
+
+    def clear(self) -> None:
+        self._users.clear()
+        self._order.clear()
+        self._top_changed()
+
+    async def seed(self, collection) -> None:
+        self.clear()
+        cursor = collection.find({}, LEADERBOARD_PROJECTION).sort(LEADERBOARD_SORT).limit(self.size)
+        async for user in cursor:
+            total = user.get("total_earned", 0)
+            self._users[user["id"]] = [total, user["username"], user.get("active_ship", "basic")]
+            self._order.append((-total, user["id"]))
+        self._order.sort()
+        self._top_changed()
+
+    def upsert(self, user_id: str, total_earned: int, username: str, active_ship: str = "basic") -> None:
+        self._upsert(user_id, total_earned, username, active_ship)
+        self._changed(["upsert", user_id, total_earned, username, active_ship])
+
+    def set_ship(self, user_id: str, active_ship: str) -> None:
+        self._set_ship(user_id, active_ship)
+        self._changed(["set_ship", user_id, active_ship])
+
+    def apply(self, change: list) -> None:
+        """Replay a change another worker made, without passing it on again."""
+        operation, *args = change
+        if operation == "upsert":
+            self._upsert(*args)
+        elif operation == "set_ship":
+            self._set_ship(*args)
+
+    def _changed(self, change: list) -> None:
+        if self.on_change is not None:
+            self.on_change(change)
+
+    def _upsert(self, user_id: str, total_earned: int, username: str, active_ship: str) -> None:
+        key = (-total_earned, user_id)
+        entry = self._users.get(user_id)
+        if entry is None:
+            if len(self._order) >= self.size and key > self._order[-1]:
+                return
+            self._users[user_id] = [total_earned, username, active_ship]
+        elif entry == [total_earned, username, active_ship]:
+            return
+        else:
+            # Totals only grow, so a change that arrives late does not undo a newer one
+            total_earned = max(total_earned, entry[0])
+            key = (-total_earned, user_id)
+            del self._order[bisect_left(self._order, (-entry[0], user_id))]
+            entry[:] = [total_earned, username, active_ship]
+        insort(self._order, key)
+        if len(self._order) > self.size:
+            _, dropped = self._order.pop()
+            del self._users[dropped]
+        self._top_changed()
+
+    def _set_ship(self, user_id: str, active_ship: str) -> None:
+        entry = self._users.get(user_id)
+        if entry is None or entry[2] == active_ship:
+            return
+        entry[2] = active_ship
+        self._top_changed()
+
+    async def rank(self, collection, user_id: str, total_earned: int) -> int:
+        """1-based position of ``user_id``; outside the top list, users ahead are counted in Mongo."""
+        entry = self._users.get(user_id)
+        if entry is not None:
+            return bisect_left(self._order, (-entry[0], user_id)) + 1
+        ahead = await collection.count_documents({"$or": [
+            {"total_earned": {"$gt": total_earned}},
+            {"total_earned": total_earned, "id": {"$lt": user_id}},
+        ]})
+        return ahead + 1
+
+    def top(self) -> list:
+        leaderboard = []
+        for i, (_, user_id) in enumerate(self._order):
+            total, username, active_ship = self._users[user_id]
+            leaderboard.append({
+                "rank": i + 1,
+                "username": username,
+                "total_earned": total,
+                "ship_image": self.ship_image(active_ship)
+            })
+        return leaderboard
+
+    def snapshot(self) -> bytes:
+        """JSON body for ``/leaderboard``, rebuilt only when the top list changed."""
+        if self._snapshot is None:
+            self._snapshot = orjson.dumps({"leaderboard": self.top()})
+        return self._snapshot
+
+    def _top_changed(self) -> None:
+        self._snapshot = None
+        self.version += 1
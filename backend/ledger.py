@@ -0,0 +1,287 @@
+"""Append-only coin ledger with daily snapshot compaction.
+
+Every change to a user's ``coins`` or ``total_earned`` is also recorded as
+a compact entry in ``ledger``::
+
+    {"u": user_id, "d": coins delta, "e": total_earned delta, "k": kind, "r": ref, "t": time}
+
+LedgerWriter buffers entries and writes them with ``insert_many`` alongside
+the user updates. LedgerCompactor rolls every finished day into
+``ledger_snapshots``. Each snapshot holds one user-day: the day's deltas
+plus the running ``c``/``te`` balances at the end of the day. Balance-as-of
+and earnings history then read one snapshot per day instead of every entry.
+
+    python ledger.py seed       # one-off opening balances for existing users
+    python ledger.py compact
+    python ledger.py verify     # compare users against the ledger
+    python ledger.py rebuild    # list the drift rebuilding would correct
+    python ledger.py rebuild --apply [--user ID ...]   # rewrite coins/total_earned from the ledger
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import UpdateOne
+
+from background import PeriodicTask
+from batch_insert import BatchInserter
+from cli import run_with_db
+
+logger = logging.getLogger(__name__)
+
+# Entry kinds
+OPENING = "opening"
+SIGNUP = "signup"
+GAME = "game"
+PURCHASE = "purchase"
+PAYMENT = "payment"
+REFERRAL = "referral"
+WITHDRAW = "withdraw"
+REFUND = "refund"
+
+DAY = timedelta(days=1)
+# Entries are stamped when recorded but written up to a flush interval later;
+# a day is only compacted once this much time has passed after it ended
+COMPACTION_GRACE = timedelta(minutes=5)
+COMPACTION_STATE_ID = "compaction"
+OPENING_STATE_ID = "opening"
+
+
+def day_start(at: datetime) -> datetime:
+    return datetime(at.year, at.month, at.day)
+
+
+class LedgerWriter(BatchInserter):
+    def record(self, user_id: str, coins: int, kind: str, earned: int = 0, ref: Optional[str] = None) -> None:
+        entry = {"u": user_id, "d": coins, "e": earned, "k": kind, "t": datetime.utcnow()}
+        if ref is not None:
+            entry["r"] = ref
+        self.add(entry)
+
+
+async def _latest_snapshots(db, user_ids: Optional[list], before: Optional[datetime] = None) -> dict:
+    """Map user id -> its most recent snapshot (optionally before ``before``)."""
+    match = {}
+    if user_ids is not None:
+        match["u"] = {"$in": user_ids}
+    if before is not None:
+        match["day"] = {"$lt": before}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"u": 1, "day": -1}},
+        {"$group": {"_id": "$u", "c": {"$first": "$c"}, "te": {"$first": "$te"}}},
+    ]
+    return {s["_id"]: s for s in await db.ledger_snapshots.aggregate(pipeline).to_list(None)}
+
+
+async def _entry_totals(db, match: dict) -> dict:
+    """Map user id -> summed ``(coins, earned)`` over the entries matching ``match``."""
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": "$u", "d": {"$sum": "$d"}, "e": {"$sum": "$e"}}},
+    ]
+    return {t["_id"]: (t["d"], t["e"]) for t in await db.ledger.aggregate(pipeline).to_list(None)}
+
+
+async def compacted_until(db) -> Optional[datetime]:
+    """Start of the first day that has not been rolled into snapshots yet."""
+    state = await db.ledger_state.find_one({"_id": COMPACTION_STATE_ID})
+    return state["until"] if state else None
+
+
+async def compact(db, now: Optional[datetime] = None, retention_days: int = 0) -> int:
+    """Roll every finished day into snapshots; returns the number of days compacted.
+
+    Snapshots are upserted with ``$set`` from the day's entries, so running
+    two compactors at once writes the same documents twice instead of
+    double counting. With ``retention_days`` set, compacted entries older
+    than that are deleted afterwards.
+    """
+    now = now or datetime.utcnow()
+    end = day_start(now - COMPACTION_GRACE)
+    day = await compacted_until(db)
+    if day is None:
+        first = await db.ledger.find_one({}, {"_id": 0, "t": 1}, sort=[("t", 1)])
+        if first is None:
+            return 0
+        day = day_start(first["t"])
+
+    compacted = 0
+    while day < end:
+        next_day = day + DAY
+        totals = await _entry_totals(db, {"t": {"$gte": day, "$lt": next_day}})
+        if totals:
+            previous = await _latest_snapshots(db, list(totals), before=day)
+            operations = []
+            for user_id, (coins, earned) in totals.items():
+                prev = previous.get(user_id, {"c": 0, "te": 0})
+                operations.append(UpdateOne(
+                    {"u": user_id, "day": day},
+                    {"$set": {"d": coins, "e": earned, "c": prev["c"] + coins, "te": prev["te"] + earned}},
+                    upsert=True
+                ))
+            for i in range(0, len(operations), 1000):
+                await db.ledger_snapshots.bulk_write(operations[i:i + 1000], ordered=False)
+        await db.ledger_state.update_one(
+            {"_id": COMPACTION_STATE_ID}, {"$set": {"until": next_day}}, upsert=True
+        )
+        day = next_day
+        compacted += 1
+
+    if retention_days:
+        await db.ledger.delete_many({"t": {"$lt": min(day, day_start(now) - timedelta(days=retention_days))}})
+    return compacted
+
+
+async def balance_at(db, user_id: str, at: datetime) -> dict:
+    """``coins``/``total_earned`` of ``user_id`` as of ``at``.
+
+    Reads the last snapshot before ``at``'s day plus that day's entries.
+    Once retention has deleted those entries, the result is the balance at
+    the start of the day.
+    """
+    snapshot = await db.ledger_snapshots.find_one(
+        {"u": user_id, "day": {"$lt": day_start(at)}}, {"_id": 0, "day": 1, "c": 1, "te": 1}, sort=[("day", -1)]
+    )
+    match = {"u": user_id, "t": {"$lt": at}}
+    if snapshot is not None:
+        match["t"]["$gte"] = snapshot["day"] + DAY
+    coins, earned = (await _entry_totals(db, match)).get(user_id, (0, 0))
+    if snapshot is not None:
+        coins += snapshot["c"]
+        earned += snapshot["te"]
+    return {"coins": coins, "total_earned": earned}
+
+
+async def earnings_history(db, user_id: str, since: datetime) -> list:
+    """Per-day ``coins``/``earned`` deltas of ``user_id`` from ``since`` on, oldest first."""
+    days = {
+        s["day"]: {"day": s["day"], "coins": s["d"], "earned": s["e"]}
+        for s in await db.ledger_snapshots.find(
+            {"u": user_id, "day": {"$gte": day_start(since)}}, {"_id": 0, "day": 1, "d": 1, "e": 1}
+        ).sort("day", 1).to_list(None)
+    }
+    # The days not compacted yet come straight from their entries
+    uncompacted = max(day_start(since), await compacted_until(db) or datetime.min)
+    async for entry in db.ledger.find({"u": user_id, "t": {"$gte": uncompacted}}, {"_id": 0, "d": 1, "e": 1, "t": 1}):
+        row = days.setdefault(day_start(entry["t"]), {"day": day_start(entry["t"]), "coins": 0, "earned": 0})
+        row["coins"] += entry["d"]
+        row["earned"] += entry["e"]
+    return [days[day] for day in sorted(days)]
+
+
+async def ledger_balances(db) -> dict:
+    """Map user id -> ``(coins, total_earned)`` derived purely from the ledger."""
+    balances = {user_id: (s["c"], s["te"]) for user_id, s in (await _latest_snapshots(db, None)).items()}
+    until = await compacted_until(db)
+    for user_id, (coins, earned) in (await _entry_totals(db, {"t": {"$gte": until}} if until else {})).items():
+        prev_coins, prev_earned = balances.get(user_id, (0, 0))
+        balances[user_id] = (prev_coins + coins, prev_earned + earned)
+    return balances
+
+
+async def find_mismatches(db) -> list:
+    """Users whose stored balances disagree with the ledger."""
+    balances = await ledger_balances(db)
+    mismatches = []
+    async for user in db.users.find({}, {"_id": 0, "id": 1, "coins": 1, "total_earned": 1}):
+        coins, earned = balances.get(user["id"], (0, 0))
+        if (user.get("coins", 0), user.get("total_earned", 0)) != (coins, earned):
+            mismatches.append({
+                "id": user["id"],
+                "coins": user.get("coins", 0), "ledger_coins": coins,
+                "total_earned": user.get("total_earned", 0), "ledger_total_earned": earned,
+            })
+    return mismatches
+
+
+async def rebuild_balances(db, apply: bool = False, user_ids: Optional[list] = None) -> list:
+    """Mismatched users (``find_mismatches``), rewritten from the ledger when ``apply``.
+
+    Entries reach the ledger through LedgerWriter's write-behind buffer, so
+    a crash loses the last ones; rebuilding those users would take back
+    coins they did receive. List the drift first and apply it only to the
+    users it is right for (``user_ids``, everyone when None), with the API
+    stopped so nothing is still buffered.
+    """
+    if await db.ledger_state.find_one({"_id": OPENING_STATE_ID}) is None:
+        raise RuntimeError("Opening balances were never seeded; rebuilding would reset pre-ledger coins")
+    mismatches = [m for m in await find_mismatches(db) if user_ids is None or m["id"] in user_ids]
+    if apply:
+        operations = [
+            UpdateOne({"id": m["id"]}, {"$set": {"coins": m["ledger_coins"], "total_earned": m["ledger_total_earned"]}})
+            for m in mismatches
+        ]
+        for i in range(0, len(operations), 1000):
+            await db.users.bulk_write(operations[i:i + 1000], ordered=False)
+    return mismatches
+
+
+async def seed_opening_balances(db) -> int:
+    """Record one ``opening`` entry per user covering coins earned before the ledger existed.
+
+    The entry is the stored balance minus whatever the ledger already holds
+    for the user. It runs once per database.
+    """
+    if await db.ledger_state.find_one({"_id": OPENING_STATE_ID}) is not None:
+        raise RuntimeError("Opening balances were already seeded")
+    balances = await ledger_balances(db)
+    now = datetime.utcnow()
+    entries = []
+    async for user in db.users.find({}, {"_id": 0, "id": 1, "coins": 1, "total_earned": 1}):
+        coins, earned = balances.get(user["id"], (0, 0))
+        coins = user.get("coins", 0) - coins
+        earned = user.get("total_earned", 0) - earned
+        if coins or earned:
+            entries.append({"u": user["id"], "d": coins, "e": earned, "k": OPENING, "t": now})
+    for i in range(0, len(entries), 1000):
+        await db.ledger.insert_many(entries[i:i + 1000], ordered=False)
+    await db.ledger_state.insert_one({"_id": OPENING_STATE_ID, "at": now})
+    return len(entries)
+
+
+class LedgerCompactor(PeriodicTask):
+    """Background task that runs ``compact`` every ``interval`` seconds."""
+
+    description = "Ledger compaction"
+
+    def __init__(self, interval: float = 3600.0, retention_days: int = 0):
+        super().__init__(interval)
+        self.retention_days = retention_days
+
+    async def tick(self, db) -> None:
+        await compact(db, retention_days=self.retention_days)
+
+
+async def _main(db, command: str, apply: bool = False, user_ids: Optional[list] = None) -> int:
+    if command == "seed":
+        print(f"seeded {await seed_opening_balances(db)} opening entries")
+    elif command == "compact":
+        print(f"compacted {await compact(db, retention_days=int(os.environ.get('LEDGER_RETENTION_DAYS', 0)))} days")
+    elif command == "verify":
+        mismatches = await find_mismatches(db)
+        for m in mismatches:
+            print(m)
+        print(f"{len(mismatches)} users disagree with the ledger")
+        return 1 if mismatches else 0
+    elif command == "rebuild":
+        mismatches = await rebuild_balances(db, apply=apply, user_ids=user_ids)
+        for m in mismatches:
+            print(m)
+        if apply:
+            print(f"rebuilt {len(mismatches)} users")
+        else:
+            print(f"{len(mismatches)} users would be rebuilt; pass --apply to write them")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coin ledger maintenance")
+    parser.add_argument("command", choices=["seed", "compact", "verify", "rebuild"])
+    parser.add_argument("--apply", action="store_true", help="rebuild: write the listed balances")
+    parser.add_argument("--user", action="append", dest="user_ids", help="rebuild: only this user (repeatable)")
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, args.command, args.apply, args.user_ids)))
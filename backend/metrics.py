@@ -0,0 +1,238 @@
+"""Request timing, Mongo round-trip accounting and a Prometheus text exporter.
+
+MetricsMiddleware opens a RequestStats for every HTTP request and keeps it
+in a ContextVar. Motor runs pymongo on executor threads with a copy of the
+caller's context, so MongoCommandListener can charge each command to the
+route that issued it. Commands issued outside a request are charged to
+the "background" route.
+"""
+import collections
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DB_CALL_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+
+
+class RequestStats:
+    __slots__ = ("scope", "db_calls", "db_seconds", "auth_cache_hits", "auth_db_lookups")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.db_calls = 0
+        self.db_seconds = 0.0
+        self.auth_cache_hits = 0
+        self.auth_db_lookups = 0
+
+    @property
+    def route(self) -> str:
+        """Path template of the matched route; the router fills it into the shared scope."""
+        if self.scope is None:
+            return "background"
+        return getattr(self.scope.get("route"), "path", None) or "unmatched"
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("cosmic_request_stats", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+def _labels(labels: tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.request_latency: dict = {}
+        self.request_db_calls: dict = {}
+        self.requests: collections.Counter = collections.Counter()
+        self.mongo_commands: collections.Counter = collections.Counter()
+        self.mongo_seconds: collections.Counter = collections.Counter()
+        self.auth_lookups: collections.Counter = collections.Counter()
+        self._callbacks: list = []
+        self._background = RequestStats()
+        self._lock = threading.Lock()
+
+    def register_callback(self, name: str, kind: str, help_text: str, fn: Callable[[], float]) -> None:
+        """Export a value computed at scrape time (e.g. cache hit counters)."""
+        self._callbacks.append((name, kind, help_text, fn))
+
+    def current(self) -> RequestStats:
+        return _current_request.get() or self._background
+
+    def record_auth_lookup(self, cache_hit: bool) -> None:
+        stats = self.current()
+        if cache_hit:
+            stats.auth_cache_hits += 1
+        else:
+            stats.auth_db_lookups += 1
+
+    def record_mongo_command(self, command: str, seconds: float) -> None:
+        # Called from Motor's executor threads
+        stats = self.current()
+        route = stats.route
+        with self._lock:
+            stats.db_calls += 1
+            stats.db_seconds += seconds
+            self.mongo_commands[(("route", route), ("command", command))] += 1
+            self.mongo_seconds[(("route", route),)] += seconds
+
+    def record_request(self, method: str, stats: RequestStats, status: int, seconds: float) -> None:
+        key = (("method", method), ("route", stats.route))
+        self.request_latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        self.request_db_calls.setdefault(key, Histogram(DB_CALL_BUCKETS)).observe(stats.db_calls)
+        self.requests[key + (("status", str(status)),)] += 1
+        if stats.auth_cache_hits:
+            self.auth_lookups[(("route", stats.route), ("source", "cache"))] += stats.auth_cache_hits
+        if stats.auth_db_lookups:
+            self.auth_lookups[(("route", stats.route), ("source", "mongo"))] += stats.auth_db_lookups
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histograms(name: str, help_text: str, series: dict) -> None:
+            header(name, "histogram", help_text)
+            for key, hist in sorted(series.items()):
+                labels = _labels(key)
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.total}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+        def counters(name: str, help_text: str, series: dict) -> None:
+            header(name, "counter", help_text)
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{{{_labels(key)}}} {value}")
+
+        histograms("cosmic_http_request_duration_seconds", "HTTP request latency by route.", self.request_latency)
+        histograms("cosmic_http_request_mongo_calls", "Mongo round-trips per HTTP request.", self.request_db_calls)
+        counters("cosmic_http_requests_total", "HTTP requests by route and status.", self.requests)
+        counters("cosmic_mongo_commands_total", "Mongo commands by issuing route.", self.mongo_commands)
+        counters("cosmic_mongo_command_seconds_total", "Time spent in Mongo commands by route.", self.mongo_seconds)
+        counters("cosmic_auth_lookups_total", "get_current_user lookups by source.", self.auth_lookups)
+        for name, kind, help_text, fn in self._callbacks:
+            header(name, kind, help_text)
+            lines.append(f"{name} {fn()}")
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.registry.record_mongo_command(event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event) -> None:
+        self.registry.record_mongo_command(event.command_name, event.duration_micros / 1e6)
+
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler for the event loop thread.
+
+    A daemon thread snapshots the loop thread's stack every ``interval``
+    seconds into a bounded ring. When a request takes longer than
+    ``threshold`` seconds, the samples taken during it are aggregated and the
+    hottest stacks are logged.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005, max_samples: int = 20000):
+        self.threshold = threshold
+        self.interval = interval
+        self._samples: collections.deque = collections.deque(maxlen=max_samples)
+        self._thread_id = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Call from the event loop thread."""
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and len(stack) < 12:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self._samples.append((time.perf_counter(), tuple(stack)))
+
+    def report(self, method: str, route: str, started: float, finished: float) -> None:
+        if finished - started < self.threshold:
+            return
+        hot = collections.Counter(stack for at, stack in list(self._samples) if started <= at <= finished)
+        total = sum(hot.values())
+        lines = [f"Slow request {method} {route}: {(finished - started) * 1000:.1f} ms, {total} samples"]
+        for stack, count in hot.most_common(5):
+            lines.append(f"  {count / total:6.1%}  " + " <- ".join(stack))
+        logger.warning("\n".join(lines))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streaming responses are timed to their last byte."""
+
+    def __init__(self, app, registry: MetricsRegistry, profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.registry = registry
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = _current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = time.perf_counter()
+            _current_request.reset(token)
+            self.registry.record_request(scope["method"], stats, status_code, finished - started)
+            if self.profiler is not None:
+                self.profiler.report(scope["method"], stats.route, started, finished)
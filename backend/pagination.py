@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+KEYSET_SORT = [("created_at", 1), ("id", 1)]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"].isoformat(), doc["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of ``encode_cursor``; raises ValueError on anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(created_at), str(doc_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+async def keyset_page(collection, query: dict, projection: dict, limit: int, cursor: Optional[str] = None) -> tuple:
+    """Return ``(docs, next_cursor)`` ordered by ``(created_at, id)``.
+
+    ``projection`` must include ``created_at`` and ``id``; ``next_cursor``
+    is None on the last page.
+    """
+    query = dict(query)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": last_id}},
+        ]
+    docs = await collection.find(query, projection).sort(KEYSET_SORT).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1])
+    return docs, None
+
+
+async def stream_ndjson(cursor):
+    """Yield one JSON line per document as the Motor cursor produces them."""
+    async for doc in cursor:
+        yield (json.dumps(doc, default=_json_default, ensure_ascii=False) + "\n").encode("utf-8")
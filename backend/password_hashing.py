@@ -0,0 +1,50 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PasswordPoolSaturated(Exception):
+    """Raised when more hashing jobs are queued than the pool accepts."""
+
+
+class PasswordHasher:
+    """Runs passlib hash/verify calls on a bounded thread pool.
+
+    bcrypt releases the GIL while it works, so threads are enough to keep
+    the event loop free. ``max_pending`` caps running plus queued jobs;
+    callers past that limit get ``PasswordPoolSaturated`` immediately.
+    """
+
+    def __init__(self, context, max_workers: int = 4, max_pending: int = 64):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
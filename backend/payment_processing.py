@@ -0,0 +1,239 @@
+"""Crediting and batch processing for admin payment/withdrawal approvals."""
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from balances import claim
+from catalog import BOOST_DURATION_MINUTES, COIN_PACKAGE_AMOUNTS, ITEMS_BY_ID
+from ledger import PAYMENT, REFUND
+
+logger = logging.getLogger(__name__)
+
+# Per-item outcomes reported by the batch endpoints
+APPROVED = "approved"
+REJECTED = "rejected"
+NOT_FOUND = "not_found"
+ALREADY_PROCESSED = "already_processed"
+ITEM_NOT_FOUND = "item_not_found"
+USER_NOT_FOUND = "user_not_found"
+TX_HASH_USED = "tx_hash_used"
+
+ILLEGAL_OPERATION = 20  # transactions on a standalone mongod
+
+
+def build_credit_update(items: list, now: datetime) -> list:
+    """Mongo update pipeline that credits ``items`` (ShopItem list) to a user.
+
+    Every stage commutes with concurrent credits and purchases, so the
+    update is applied without reading the user first. New boosts fold into
+    the current summary: the multiplier is multiplied in, and ``boost_until``
+    takes the earlier expiry. The aggregation ``$min`` skips a null
+    ``boost_until``, which users without boosts and swept users carry, so
+    they get the new boost's expiry. If the summary is stale, ``$min``
+    leaves ``boost_until`` in the past, so readers rebuild it from the list
+    and the sweeper rewrites it.
+    """
+    new_ships = []
+    boosts = []
+    coins = 0
+
+    for item in items:
+        if item.type == "ship":
+            if item.id not in new_ships:
+                new_ships.append(item.id)
+        elif item.type == "boost":
+            # Add boost with expiration
+            duration_minutes = BOOST_DURATION_MINUTES.get(item.id, 30)
+            boosts.append({
+                "id": item.id,
+                "name": item.name,
+                "multiplier": item.coin_multiplier,
+                "activated_at": now,
+                "expires_at": now + timedelta(minutes=duration_minutes)
+            })
+        elif item.type == "coins":
+            coins += COIN_PACKAGE_AMOUNTS.get(item.id, 0)
+
+    fields = {}
+    if new_ships:
+        owned = {"$ifNull": ["$owned_ships", []]}
+        # Appended in order, skipping ships the user already owns
+        fields["owned_ships"] = {"$concatArrays": [owned, {"$filter": {
+            "input": {"$literal": new_ships}, "cond": {"$not": {"$in": ["$$this", owned]}}
+        }}]}
+    if boosts:
+        multiplier = 1.0
+        for boost in boosts:
+            multiplier *= boost["multiplier"]
+        fields["active_boosts"] = {"$concatArrays": [{"$ifNull": ["$active_boosts", []]}, {"$literal": boosts}]}
+        fields["boost_multiplier"] = {"$multiply": [{"$ifNull": ["$boost_multiplier", 1.0]}, multiplier]}
+        fields["boost_until"] = {"$min": ["$boost_until", min(boost["expires_at"] for boost in boosts)]}
+    if coins:
+        fields["coins"] = {"$add": [{"$ifNull": ["$coins", 0]}, coins]}
+    return [{"$set": fields}] if fields else []
+
+
+async def run_in_transaction(client, callback):
+    """Run ``callback(session)`` in a retried transaction.
+
+    Deployments without replica-set transactions (a standalone mongod or
+    an in-memory stand-in) run the callback once without a session instead.
+    """
+    try:
+        async with await client.start_session() as session:
+            return await session.with_transaction(callback)
+    except NotImplementedError:
+        pass
+    except OperationFailure as e:
+        if e.code != ILLEGAL_OPERATION:
+            raise
+    return await callback(None)
+
+
+async def approve_payments(db, client, payment_ids: list, ledger) -> tuple:
+    """Approve pending payments; returns ``(results, credited_user_ids)``."""
+
+    async def settle(session):
+        now = datetime.utcnow()
+        payments = {
+            p["id"]: p
+            for p in await db.payments.find(
+                {"id": {"$in": payment_ids}},
+                {"_id": 0, "id": 1, "user_id": 1, "item_id": 1, "status": 1, "tx_hash": 1},
+                session=session
+            ).to_list(None)
+        }
+        # Pending payments may share a tx_hash (transfers are public), only one is approved
+        tx_hashes = [p["tx_hash"] for p in payments.values() if p.get("tx_hash")]
+        used_hashes = {
+            p["tx_hash"]
+            for p in await db.payments.find(
+                {"tx_hash": {"$in": tx_hashes}, "status": APPROVED}, {"_id": 0, "tx_hash": 1}, session=session
+            ).to_list(None)
+        } if tx_hashes else set()
+        user_ids = list({p["user_id"] for p in payments.values()})
+        known_users = {
+            u["id"]
+            for u in await db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1}, session=session).to_list(None)
+        }
+
+        outcomes = {}
+        candidates = []
+        for payment_id in dict.fromkeys(payment_ids):
+            payment = payments.get(payment_id)
+            if payment is None:
+                outcomes[payment_id] = NOT_FOUND
+            elif payment["status"] != "pending":
+                outcomes[payment_id] = ALREADY_PROCESSED
+            elif payment["item_id"] not in ITEMS_BY_ID:
+                outcomes[payment_id] = ITEM_NOT_FOUND
+            elif payment["user_id"] not in known_users:
+                outcomes[payment_id] = USER_NOT_FOUND
+            elif payment.get("tx_hash") in used_hashes:
+                outcomes[payment_id] = TX_HASH_USED
+            else:
+                candidates.append(payment_id)
+                if payment.get("tx_hash"):
+                    used_hashes.add(payment["tx_hash"])
+
+        # Only payments this call moved out of "pending" are credited. An
+        # approval of the same tx_hash racing this one fails the claim on the
+        # tx_hash_approved_unique index, which aborts the transaction.
+        items_by_user: dict = {}
+        coin_credits = []
+        for payment in await claim(db.payments, candidates, APPROVED, now, session=session):
+            outcomes[payment["id"]] = APPROVED
+            items_by_user.setdefault(payment["user_id"], []).append(ITEMS_BY_ID[payment["item_id"]])
+            if payment["item_id"] in COIN_PACKAGE_AMOUNTS:
+                coin_credits.append((payment["user_id"], COIN_PACKAGE_AMOUNTS[payment["item_id"]], payment["id"]))
+        if len(outcomes) < len(set(payment_ids)):
+            # Read as pending above, then claimed by a concurrent approval or rejection
+            await _explain_unclaimed(db.payments, payment_ids, outcomes, session)
+
+        user_ops = []
+        for user_id, items in items_by_user.items():
+            update = build_credit_update(items, now)
+            if update:
+                user_ops.append(UpdateOne({"id": user_id}, update))
+        if user_ops:
+            await db.users.bulk_write(user_ops, ordered=False, session=session)
+        return _results(payment_ids, outcomes), list(items_by_user), coin_credits
+
+    results, credited_user_ids, coin_credits = await run_in_transaction(client, settle)
+    # Recorded only once the transaction (and any retries of it) committed
+    for user_id, coins, payment_id in coin_credits:
+        ledger.record(user_id, coins, PAYMENT, ref=payment_id)
+    return results, credited_user_ids
+
+
+async def reject_payments(db, client, payment_ids: list) -> list:
+
+    async def settle(session):
+        outcomes = {payment["id"]: REJECTED for payment in await claim(
+            db.payments, payment_ids, REJECTED, datetime.utcnow(), session=session
+        )}
+        if len(outcomes) < len(set(payment_ids)):
+            await _explain_unclaimed(db.payments, payment_ids, outcomes, session)
+        return _results(payment_ids, outcomes)
+
+    return await run_in_transaction(client, settle)
+
+
+async def process_withdrawals(db, client, withdrawal_ids: list, approve: bool, ledger) -> tuple:
+    """Approve or reject pending withdrawals, refunding coins on rejection.
+
+    Returns ``(results, refunded_user_ids)``.
+    """
+    new_status = APPROVED if approve else REJECTED
+
+    async def settle(session):
+        outcomes = {}
+        refunds: dict = {}
+        refunded = []
+        for withdrawal in await claim(db.withdrawals, withdrawal_ids, new_status, datetime.utcnow(), session=session):
+            outcomes[withdrawal["id"]] = new_status
+            if not approve:
+                user_id = withdrawal["user_id"]
+                refunds[user_id] = refunds.get(user_id, 0) + withdrawal["coins_amount"]
+                refunded.append((user_id, withdrawal["coins_amount"], withdrawal["id"]))
+        if len(outcomes) < len(set(withdrawal_ids)):
+            await _explain_unclaimed(db.withdrawals, withdrawal_ids, outcomes, session)
+
+        if refunds:
+            await db.users.bulk_write(
+                [UpdateOne({"id": user_id}, {"$inc": {"coins": coins}}) for user_id, coins in refunds.items()],
+                ordered=False,
+                session=session
+            )
+        return _results(withdrawal_ids, outcomes), list(refunds), refunded
+
+    results, refunded_user_ids, refunded = await run_in_transaction(client, settle)
+    for user_id, coins, withdrawal_id in refunded:
+        ledger.record(user_id, coins, REFUND, ref=withdrawal_id)
+    return results, refunded_user_ids
+
+
+async def _explain_unclaimed(collection, doc_ids: list, outcomes: dict, session) -> None:
+    """Fill in NOT_FOUND / ALREADY_PROCESSED for ids a claim did not move."""
+    unclaimed = [doc_id for doc_id in doc_ids if doc_id not in outcomes]
+    found = {
+        doc["id"]
+        for doc in await collection.find({"id": {"$in": unclaimed}}, {"_id": 0, "id": 1}, session=session).to_list(None)
+    }
+    for doc_id in unclaimed:
+        outcomes[doc_id] = ALREADY_PROCESSED if doc_id in found else NOT_FOUND
+
+
+def _results(doc_ids: list, outcomes: dict) -> list:
+    # A repeated id is processed once; its later occurrences report already_processed
+    results = []
+    seen = set()
+    for doc_id in doc_ids:
+        status = outcomes[doc_id]
+        if doc_id in seen and status in (APPROVED, REJECTED):
+            status = ALREADY_PROCESSED
+        seen.add(doc_id)
+        results.append({"id": doc_id, "status": status})
+    return results
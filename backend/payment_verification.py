@@ -0,0 +1,328 @@
+"""Automatic approval of USDT (TRC20) payments checked against a TRON node.
+
+``submit_payment`` schedules each payment for verification by setting
+``verify_next_at``. PaymentVerifier takes the due payments in batches and
+looks their ``tx_hash`` up on the node's solidity API, which only knows
+confirmed transactions. Lookups run concurrently, up to a fixed limit,
+over one pooled HTTP client. A payment is approved through
+``approve_payments`` when the transaction is a successful USDT transfer
+that meets four conditions:
+
+- it pays ``TRC20_ADDRESS``;
+- it is sent from the wallet the user registered (``tron_wallet``), and
+  was made after the user registered it;
+- it is for at least the item's price;
+- it was made no earlier than ``MAX_TX_AGE`` before the payment was
+  submitted.
+
+Incoming transfers to ``TRC20_ADDRESS`` are public, so the sender check is
+what stops a user from claiming someone else's ``tx_hash``. A wallet can
+only be registered by one user, and a transfer made before the
+registration does not count. A transfer that does not qualify, or a
+payment from a user without a wallet, gets a ``verification`` reason and
+stays pending for an admin. A transaction the node does not know yet is
+retried with backoff until ``max_attempts``.
+
+Only an approved payment holds its ``tx_hash``: other users' pending claims
+of the same transfer do not block the payer, and ``approve_payments``
+never approves a second payment for it.
+
+    python payment_verification.py normalize    # normalize stored tx_hash values, then list duplicates
+    python payment_verification.py duplicates   # approved payments sharing a tx_hash
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import httpx
+from pymongo import UpdateOne
+
+from background import PeriodicTask
+from catalog import ITEMS_BY_ID
+from cli import run_with_db
+from payment_processing import APPROVED, approve_payments
+
+logger = logging.getLogger(__name__)
+
+USDT_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+USDT_DECIMALS = 6
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+# A transfer made this long before the payment was submitted is not accepted for it
+MAX_TX_AGE = timedelta(hours=24)
+
+# Why a payment was left for an admin
+INVALID_TX_HASH = "invalid_tx_hash"
+TX_FAILED = "tx_failed"
+NO_TRANSFER = "no_usdt_transfer_to_address"
+NO_PAYER_WALLET = "no_payer_wallet"
+PAYER_MISMATCH = "sender_is_not_payer_wallet"
+WALLET_REGISTERED_LATER = "wallet_registered_after_tx"
+AMOUNT_TOO_LOW = "amount_too_low"
+TX_TOO_OLD = "tx_too_old"
+UNCONFIRMED = "unconfirmed"
+
+PAYMENT_VERIFY_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "tx_hash": 1, "item_id": 1, "created_at": 1, "verify_attempts": 1
+}
+PAYER_WALLET_PROJECTION = {"_id": 0, "id": 1, "tron_wallet": 1, "tron_wallet_since": 1}
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def normalize_tx_hash(tx_hash: str) -> str:
+    tx_hash = tx_hash.strip().lower()
+    return tx_hash[2:] if tx_hash.startswith("0x") else tx_hash
+
+
+def _checksum(payload: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+
+
+def address_hex(address: str) -> str:
+    """20-byte hex of a base58check TRON address, as it appears in event logs."""
+    number = 0
+    for char in address:
+        if char not in _BASE58_ALPHABET:
+            raise ValueError(f"Not a TRON address: {address}")
+        number = number * 58 + _BASE58_ALPHABET.index(char)
+    try:
+        raw = number.to_bytes(25, "big")
+    except OverflowError:
+        raise ValueError(f"Not a TRON address: {address}")
+    payload, checksum = raw[:21], raw[21:]
+    if raw[0] != 0x41 or _checksum(payload) != checksum:
+        raise ValueError(f"Not a TRON address: {address}")
+    return payload[1:].hex()
+
+
+def base58_address(hex_address: str) -> str:
+    """Inverse of ``address_hex``."""
+    payload = bytes.fromhex("41" + hex_address)
+    number = int.from_bytes(payload + _checksum(payload), "big")
+    chars = []
+    while number:
+        number, digit = divmod(number, 58)
+        chars.append(_BASE58_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def check_transfer(info: dict, recipient_hex: str, contract_hex: str, sender_hex: str, min_units: int,
+                   not_before_ms: int) -> Optional[str]:
+    """None if ``info`` (gettransactioninfobyid) pays ``recipient_hex`` enough from ``sender_hex``, else why not."""
+    if info.get("receipt", {}).get("result") != "SUCCESS":
+        return TX_FAILED
+    paid = 0
+    other_sender = False
+    for log in info.get("log", []):
+        topics = log.get("topics", [])
+        if (
+            log.get("address", "").lower()[-40:] == contract_hex
+            and len(topics) == 3
+            and topics[0].lower() == TRANSFER_TOPIC
+            and topics[2].lower()[-40:] == recipient_hex
+        ):
+            if topics[1].lower()[-40:] == sender_hex:
+                paid += int(log.get("data") or "0", 16)
+            else:
+                other_sender = True
+    if not paid:
+        return PAYER_MISMATCH if other_sender else NO_TRANSFER
+    if paid < min_units:
+        return AMOUNT_TOO_LOW
+    if info.get("blockTimeStamp", 0) < not_before_ms:
+        return TX_TOO_OLD
+    return None
+
+
+def _epoch_ms(at: datetime) -> int:
+    return int((at - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+class TronNode:
+    """Minimal client for a TRON full node / TronGrid HTTP API."""
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, max_connections: int = 20,
+                 timeout: float = 10.0, transport=None):
+        headers = {"TRON-PRO-API-KEY": api_key} if api_key else {}
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def transaction_info(self, tx_hash: str) -> Optional[dict]:
+        """Confirmed transaction info, or None while the node does not know it."""
+        response = await self.http.post("/walletsolidity/gettransactioninfobyid", json={"value": tx_hash})
+        response.raise_for_status()
+        return response.json() or None
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+
+class PaymentVerifier(PeriodicTask):
+    """Background task verifying due payments every ``interval`` seconds.
+
+    ``on_approved`` receives the ids of the users whose payments were
+    approved in a pass.
+    """
+
+    def __init__(
+        self,
+        node: TronNode,
+        recipient: str,
+        interval: float = 5.0,
+        batch_size: int = 100,
+        concurrency: int = 10,
+        max_attempts: int = 30,
+        max_backoff: float = 600.0,
+        on_approved: Optional[Callable[[list], None]] = None,
+    ):
+        super().__init__(interval)
+        self.node = node
+        self.recipient_hex = address_hex(recipient)
+        self.contract_hex = address_hex(USDT_CONTRACT)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.on_approved = on_approved
+        self.approved = 0
+        self.flagged = 0
+
+    async def stop(self) -> None:
+        await super().stop()
+        await self.node.aclose()
+
+    async def tick(self, db, client, ledger) -> bool:
+        # A full batch means more are due; go again without waiting
+        return await self.run_once(db, client, ledger) == self.batch_size
+
+    async def run_once(self, db, client, ledger) -> int:
+        """Verify one batch of due payments; returns how many were looked at."""
+        now = datetime.utcnow()
+        payments = await db.payments.find(
+            {"status": "pending", "verify_next_at": {"$lte": now}}, PAYMENT_VERIFY_PROJECTION
+        ).sort("verify_next_at", 1).limit(self.batch_size).to_list(None)
+        if not payments:
+            return 0
+
+        wallets = {
+            user["id"]: user
+            for user in await db.users.find(
+                {"id": {"$in": list({payment["user_id"] for payment in payments})}}, PAYER_WALLET_PROJECTION
+            ).to_list(None)
+        }
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def verify(payment: dict):
+            async with semaphore:
+                try:
+                    return payment, await self._verify(payment, wallets.get(payment["user_id"], {}))
+                except Exception as e:
+                    logger.warning("Verifying payment %s failed: %s", payment["id"], e)
+                    return payment, UNCONFIRMED
+
+        outcomes = await asyncio.gather(*(verify(payment) for payment in payments))
+
+        verified = [payment["id"] for payment, outcome in outcomes if outcome is None]
+        if verified:
+            results, credited_user_ids = await approve_payments(db, client, verified, ledger)
+            self.approved += sum(r["status"] == APPROVED for r in results)
+            if credited_user_ids and self.on_approved is not None:
+                self.on_approved(credited_user_ids)
+            # Paid, but approve_payments could not credit it (unknown item or user)
+            not_credited = {r["id"]: r["status"] for r in results if r["status"] != APPROVED}
+            outcomes = [(payment, not_credited.get(payment["id"], outcome)) for payment, outcome in outcomes]
+
+        for payment, outcome in outcomes:
+            if outcome is None:
+                continue
+            attempts = payment.get("verify_attempts", 0) + 1
+            if outcome == UNCONFIRMED and attempts < self.max_attempts:
+                backoff = min(self.interval * 2 ** attempts, self.max_backoff)
+                update = {"$set": {"verify_attempts": attempts, "verify_next_at": now + timedelta(seconds=backoff)}}
+            else:
+                # Out of the queue; an admin decides through approve_payment/reject_payment
+                self.flagged += 1
+                update = {"$set": {"verify_attempts": attempts, "verification": outcome}, "$unset": {"verify_next_at": ""}}
+            await db.payments.update_one({"id": payment["id"], "status": "pending"}, update)
+        return len(payments)
+
+    async def _verify(self, payment: dict, payer: dict) -> Optional[str]:
+        tx_hash = payment["tx_hash"]
+        if len(tx_hash) != 64 or any(c not in "0123456789abcdef" for c in tx_hash):
+            return INVALID_TX_HASH
+        if not payer.get("tron_wallet"):
+            return NO_PAYER_WALLET
+        info = await self.node.transaction_info(tx_hash)
+        if info is None:
+            return UNCONFIRMED
+        item = ITEMS_BY_ID.get(payment["item_id"])
+        if item is None or item.price_usdt is None:
+            # approve_payments reports it; nothing to compare against here
+            return None
+        not_before = payment["created_at"] - MAX_TX_AGE
+        reason = check_transfer(
+            info,
+            self.recipient_hex,
+            self.contract_hex,
+            address_hex(payer["tron_wallet"]),
+            min_units=round(item.price_usdt * 10 ** USDT_DECIMALS),
+            not_before_ms=_epoch_ms(not_before),
+        )
+        if reason is None and info.get("blockTimeStamp", 0) < _epoch_ms(payer["tron_wallet_since"]):
+            return WALLET_REGISTERED_LATER
+        return reason
+
+    def stats(self) -> dict:
+        return {"approved": self.approved, "flagged": self.flagged}
+
+
+async def find_duplicate_tx_hashes(db) -> list:
+    """Approved payments sharing a tx_hash; tx_hash_approved_unique cannot be built over them."""
+    pipeline = [
+        {"$match": {"status": APPROVED}},
+        {"$group": {"_id": "$tx_hash", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    return await db.payments.aggregate(pipeline).to_list(None)
+
+
+async def normalize_stored_tx_hashes(db, batch_size: int = 1000) -> int:
+    """Rewrite tx_hash values stored before they were normalized; returns how many changed."""
+    changed = 0
+    updates = []
+    cursor = db.payments.find({"tx_hash": {"$regex": "[A-Z\\s]|^0x"}}, {"_id": 0, "id": 1, "tx_hash": 1})
+    async for payment in cursor:
+        updates.append(UpdateOne({"id": payment["id"]}, {"$set": {"tx_hash": normalize_tx_hash(payment["tx_hash"])}}))
+        if len(updates) == batch_size:
+            changed += (await db.payments.bulk_write(updates, ordered=False)).modified_count
+            updates = []
+    if updates:
+        changed += (await db.payments.bulk_write(updates, ordered=False)).modified_count
+    return changed
+
+
+async def _main(db, command: str) -> int:
+    if command == "normalize":
+        print(f"{await normalize_stored_tx_hashes(db)} tx_hash values normalized")
+    duplicates = await find_duplicate_tx_hashes(db)
+    for duplicate in duplicates:
+        print(duplicate["_id"], duplicate["ids"])
+    print(f"{len(duplicates)} tx_hash values are used by more than one approved payment")
+    return 1 if duplicates else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TRC20 payment verification maintenance")
+    parser.add_argument("command", choices=["normalize", "duplicates"])
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, args.command)))
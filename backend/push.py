@@ -0,0 +1,159 @@
+"""WebSocket fan-out of balance and leaderboard changes.
+
+Each connection gets a bounded queue of pre-serialized messages, drained
+by the connection's own handler. Publishing only does ``put_nowait``, so it
+never waits on a client. A client whose queue is full is dropped rather
+than buffered: it reconnects and reloads its state over HTTP.
+
+The leaderboard is not pushed on every change. After ``start`` the hub
+polls its ``version`` every ``leaderboard_interval`` seconds and
+broadcasts the top list once if it changed, so a burst of game results costs a single
+serialization per interval.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+import orjson
+
+from background import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# WebSocket close codes
+NORMAL_CLOSURE = 1000
+POLICY_VIOLATION = 1008
+TRY_AGAIN_LATER = 1013
+
+
+class PushConnection:
+    __slots__ = ("user_id", "queue", "dropped")
+
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.dropped = False
+
+    def offer(self, message: str) -> bool:
+        """Queue ``message``; False once the connection has fallen too far behind."""
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            self.close()
+            return False
+
+    def close(self) -> None:
+        """Tell the sender to stop; messages still queued are discarded."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class PushHub(PeriodicTask):
+    description = "Leaderboard broadcast"
+
+    def __init__(self, queue_size: int = 64, max_connections_per_user: int = 5, leaderboard_interval: float = 1.0):
+        super().__init__(leaderboard_interval)
+        self.queue_size = queue_size
+        self.max_connections_per_user = max_connections_per_user
+        self.dropped = 0
+        self.sent = 0
+        self._connections: dict = {}
+        self._count = 0
+        self._leaderboard_version = None
+
+    def connect(self, user_id: str, greeting: Optional[dict] = None) -> PushConnection:
+        """Register a connection, closing the user's oldest one past the per-user limit."""
+        connections = self._connections.setdefault(user_id, [])
+        while len(connections) >= self.max_connections_per_user:
+            self._count -= 1
+            connections.pop(0).close()
+        connection = PushConnection(user_id, self.queue_size)
+        if greeting is not None:
+            connection.offer(orjson.dumps(greeting).decode())
+        connections.append(connection)
+        self._count += 1
+        return connection
+
+    def disconnect(self, connection: PushConnection) -> None:
+        connections = self._connections.get(connection.user_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            self._count -= 1
+            if not connections:
+                del self._connections[connection.user_id]
+
+    async def serve(self, websocket, connection: PushConnection) -> None:
+        """Send queued messages until the client leaves or falls behind."""
+        receiver = asyncio.create_task(self._drain_incoming(websocket, connection))
+        try:
+            while True:
+                message = await connection.queue.get()
+                if message is None:
+                    if not receiver.done():
+                        await websocket.close(code=TRY_AGAIN_LATER if connection.dropped else NORMAL_CLOSURE)
+                    return
+                await websocket.send_text(message)
+                self.sent += 1
+        except Exception:
+            # The client went away mid-send
+            return
+        finally:
+            receiver.cancel()
+            self.disconnect(connection)
+            if connection.dropped:
+                self.dropped += 1
+
+    async def _drain_incoming(self, websocket, connection: PushConnection) -> None:
+        # Clients have nothing to say; reading only notices the disconnect
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        except Exception:
+            pass
+        connection.close()
+
+    def send(self, user_id: str, payload: dict) -> None:
+        """Push ``payload`` to every connection ``user_id`` has on this worker."""
+        connections = self._connections.get(user_id)
+        if not connections:
+            return
+        message = orjson.dumps(payload).decode()
+        for connection in list(connections):
+            if not connection.offer(message):
+                self.disconnect(connection)
+
+    def broadcast(self, payload: dict) -> None:
+        message = orjson.dumps(payload).decode()
+        for connections in list(self._connections.values()):
+            for connection in list(connections):
+                if not connection.offer(message):
+                    self.disconnect(connection)
+
+    def start(self, leaderboard) -> None:
+        self._leaderboard_version = leaderboard.version
+        super().start(leaderboard)
+
+    async def stop(self) -> None:
+        await super().stop()
+        for connections in list(self._connections.values()):
+            for connection in connections:
+                connection.close()
+
+    async def tick(self, leaderboard) -> None:
+        if leaderboard.version == self._leaderboard_version or not self._count:
+            return
+        self._leaderboard_version = leaderboard.version
+        self.broadcast({"type": "leaderboard", "leaderboard": leaderboard.top()})
+
+    def __len__(self) -> int:
+        return self._count
+
+    def stats(self) -> dict:
+        return {"connections": self._count, "users": len(self._connections), "sent": self.sent, "dropped": self.dropped}
@@ -0,0 +1,49 @@
+"""Token-bucket rate limits on top of the coordinator.
+
+A limit is written ``"COUNT/SECONDS"``: a burst of up to COUNT requests,
+refilled at COUNT per SECONDS. Buckets live in the coordinator, which
+keeps one small entry per active key and drops it once it has refilled.
+With Redis the buckets are shared by all workers.
+"""
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def parse_limit(spec: Optional[str]) -> Optional[tuple]:
+    """``"30/60"`` -> ``(rate per second, burst)``; empty, ``"0"`` or ``"off"`` disables the limit."""
+    if not spec or spec.strip().lower() in ("0", "off"):
+        return None
+    count, _, seconds = spec.partition("/")
+    burst = int(count)
+    return burst / float(seconds or 1), burst
+
+
+class RateLimiter:
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+        self.rejected = 0
+
+    async def check(self, name: str, key: str, limit: Optional[tuple], cost: int = 1) -> None:
+        """Take ``cost`` tokens from ``name``'s bucket for ``key`` or raise RateLimitExceeded.
+
+        Fails open: if the coordinator is unreachable the request is let through.
+        """
+        if limit is None:
+            return
+        rate, burst = limit
+        try:
+            allowed, retry_after = await self.coordinator.take_token(f"{name}:{key}", rate, burst, cost)
+        except Exception:
+            logger.exception("Rate limit check for %s failed, allowing the request", name)
+            return
+        if not allowed:
+            self.rejected += 1
+            raise RateLimitExceeded(retry_after)
@@ -0,0 +1,170 @@
+"""Referral aggregates and the invitee graph.
+
+Every inviter carries three counters on its user document:
+
+- ``referral_count``: direct invitees.
+- ``referral_bonus_earned``: bonus coins received for inviting them.
+- ``referral_network_earned``: the sum of their ``total_earned``.
+
+The first two are incremented when an invitee registers. The third
+changes whenever an invitee earns, so ReferralStats coalesces those
+deltas per inviter and flushes them as ``$inc``'s in one ``bulk_write``,
+each batch tagged so a retry is not counted twice.
+
+    python referrals.py rebuild   # recompute every inviter's counters from scratch
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import uuid
+from typing import Callable, Optional
+
+from pymongo import UpdateOne
+
+from background import WriteBehindQueue
+from cli import run_with_db
+
+logger = logging.getLogger(__name__)
+
+INVITEE_PROJECTION = {"_id": 0, "id": 1, "username": 1, "created_at": 1, "total_earned": 1}
+MAX_TREE_DEPTH = 5
+
+
+class ReferralStats(WriteBehindQueue):
+    """Write-behind buffer for ``referral_network_earned``.
+
+    ``add`` only enqueues the inviter's delta; each flush coalesces a batch
+    into one ``$inc`` per inviter, writes them with a single unordered
+    ``bulk_write`` and passes the inviter ids it wrote to ``on_flushed``.
+
+    Each flush is a batch with its own id, recorded in the inviter's
+    ``referral_flushes`` (the last FLUSH_IDS_KEPT) by the same update that
+    applies the delta. A failed batch is queued again unchanged, so
+    inviters it already reached skip it instead of counting it twice.
+    """
+
+    FLUSH_IDS_KEPT = 20
+
+    def __init__(self, flush_interval: float = 1.0, max_batch: int = 1000,
+                 on_flushed: Optional[Callable[[list], None]] = None):
+        super().__init__(flush_interval, max_batch)
+        self.on_flushed = on_flushed
+        self.flushes = 0
+
+    def add(self, inviter_id: str, earned: int) -> None:
+        if earned:
+            # (batch id, deltas); the id is assigned when the delta is first flushed
+            self._enqueue((None, {inviter_id: earned}))
+
+    async def _flush(self, batch: list) -> None:
+        fresh: dict = {}
+        batches = []
+        for batch_id, deltas in batch:
+            if batch_id is not None:
+                batches.append((batch_id, deltas))
+                continue
+            for inviter_id, earned in deltas.items():
+                fresh[inviter_id] = fresh.get(inviter_id, 0) + earned
+        if fresh:
+            batches.append((uuid.uuid4().hex, fresh))
+
+        for batch_id, deltas in batches:
+            try:
+                await self._write(batch_id, deltas)
+            except Exception:
+                if self._closing:
+                    logger.exception("Dropping referral earnings for %d inviters", len(deltas))
+                    continue
+                logger.exception("Referral stats flush failed, retrying %d inviters", len(deltas))
+                self._queue.put_nowait((batch_id, deltas))
+                await asyncio.sleep(self.flush_interval)
+                continue
+            self.flushes += 1
+            if self.on_flushed is not None:
+                self.on_flushed(list(deltas))
+
+    async def _write(self, batch_id: str, deltas: dict) -> None:
+        await self._collection.bulk_write([
+            UpdateOne({"id": inviter_id, "referral_flushes": {"$ne": batch_id}}, {
+                "$inc": {"referral_network_earned": earned},
+                "$push": {"referral_flushes": {"$each": [batch_id], "$slice": -self.FLUSH_IDS_KEPT}},
+            })
+            for inviter_id, earned in deltas.items()
+        ], ordered=False)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "flushes": self.flushes}
+
+
+async def referral_levels(users, user_id: str, depth: int) -> list:
+    """Invitee count and earnings per level of ``user_id``'s referral tree.
+
+    One ``$graphLookup`` walks the ``referred_by`` index down to ``depth``
+    levels instead of one query per invitee.
+    """
+    pipeline = [
+        {"$match": {"id": user_id}},
+        {"$graphLookup": {
+            "from": users.name,
+            "startWith": "$id",
+            "connectFromField": "id",
+            "connectToField": "referred_by",
+            "as": "network",
+            "maxDepth": depth - 1,
+            "depthField": "level",
+        }},
+        {"$unwind": "$network"},
+        {"$group": {
+            "_id": "$network.level",
+            "count": {"$sum": 1},
+            "total_earned": {"$sum": "$network.total_earned"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    return [
+        {"level": level["_id"] + 1, "count": level["count"], "total_earned": level["total_earned"]}
+        for level in await users.aggregate(pipeline).to_list(None)
+    ]
+
+
+async def rebuild_referral_stats(users, bonus_per_invite: int) -> int:
+    """Recompute every inviter's counters; returns the number of users written.
+
+    Bonuses paid before ``referral_bonus_earned`` existed are assumed to be
+    ``bonus_per_invite`` each. Run it with the API stopped; increments made
+    while it runs are overwritten.
+    """
+    pipeline = [
+        {"$match": {"referred_by": {"$type": "string"}}},
+        {"$group": {"_id": "$referred_by", "count": {"$sum": 1}, "earned": {"$sum": "$total_earned"}}},
+    ]
+    operations = [
+        UpdateOne({"id": inviter["_id"]}, {
+            "$set": {"referral_count": inviter["count"], "referral_network_earned": inviter["earned"]},
+            "$max": {"referral_bonus_earned": inviter["count"] * bonus_per_invite},
+        })
+        for inviter in await users.aggregate(pipeline).to_list(None)
+    ]
+    for i in range(0, len(operations), 1000):
+        await users.bulk_write(operations[i:i + 1000], ordered=False)
+    # Everyone else starts from zero
+    result = await users.update_many(
+        {"referral_network_earned": {"$exists": False}},
+        {"$set": {"referral_count": 0, "referral_bonus_earned": 0, "referral_network_earned": 0}}
+    )
+    return len(operations) + result.modified_count
+
+
+async def _main(db, bonus_per_invite: int) -> int:
+    print(f"rebuilt referral stats for {await rebuild_referral_stats(db.users, bonus_per_invite)} users")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Referral statistics maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--bonus-per-invite", type=int, default=200,
+                        help="bonus paid per invite before it was tracked (REFERRAL_BONUS_INVITER)")
+    args = parser.parse_args()
+    sys.exit(run_with_db(lambda db: _main(db, args.bonus_per_invite)))
@@ -0,0 +1,52 @@
+"""Run the API with several uvicorn worker processes.
+
+    python serve.py --workers 4 --port 8001
+
+Every worker opens its own Motor connection pool, so the pool size is
+divided between them: ``--mongo-pool-size`` (``MONGO_TOTAL_POOL_SIZE``) is
+the budget for the whole deployment and each worker gets an equal share as
+``MONGO_MAX_POOL_SIZE``. Workers keep their own session cache and
+leaderboard and stay in sync through ``COORDINATION_URL`` (a Redis URL),
+which is required for more than one worker.
+
+Behind a load balancer every connection comes from the balancer, so the
+per-IP rate limits would share one bucket. ``--forwarded-allow-ips``
+(``FORWARDED_ALLOW_IPS``) lists the proxies whose ``X-Forwarded-For`` is
+trusted; for connections from them uvicorn reports the forwarded client
+address. Only list addresses that nothing but the proxies can connect from.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+
+def main() -> int:
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Run the Cosmic Miner API with N workers")
+    parser.add_argument("--host", default=os.environ.get('HOST', "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', 8001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', 1)))
+    parser.add_argument("--mongo-pool-size", type=int, default=int(os.environ.get('MONGO_TOTAL_POOL_SIZE', 100)),
+                        help="Mongo connections shared by all workers")
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get('FORWARDED_ALLOW_IPS', "127.0.0.1"),
+                        help="Comma separated proxy addresses whose X-Forwarded-For is trusted")
+    args = parser.parse_args()
+
+    if args.workers > 1 and not os.environ.get('COORDINATION_URL'):
+        print("COORDINATION_URL must point at Redis when running more than one worker", file=sys.stderr)
+        return 2
+    # Read by server.py in each worker process
+    os.environ['MONGO_MAX_POOL_SIZE'] = str(max(1, args.mongo_pool_size // args.workers))
+
+    uvicorn.run("server:create_app", factory=True, host=args.host, port=args.port, workers=args.workers,
+                proxy_headers=True, forwarded_allow_ips=args.forwarded_allow_ips,
+                app_dir=str(Path(__file__).parent))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
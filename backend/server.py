@@ -1,25 +1,66 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import (
+    FastAPI, APIRouter, BackgroundTasks, HTTPException, Depends, Header, Query, Request, Response, WebSocket, status
+)
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import HTTPConnection
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import math
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 import jwt
 from passlib.context import CryptContext
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from analytics import AnalyticsRollup, daily_stats, period_stats
+from anticheat import HARD_FLAGS, PlausibilityChecker, bounds_from_env
+from balances import credit_coins, debit_coins, transition
+from batch_insert import BatchInserter
+from boosts import BoostSweeper, boost_multiplier_at, effective_boost
+from catalog import (
+    COIN_PACKAGE_AMOUNTS,
+    ITEMS_BY_ID,
+    SHIP_DATA,
+    etag_matches,
+    render_shop_body,
+)
+from coordination import RedisCoordinator, create_coordinator
+from game_ingest import GameResultIngestor
+from indexes import ensure_indexes
+from leaderboard import LEADERBOARD_PROJECTION, Leaderboard
+from referrals import INVITEE_PROJECTION, MAX_TREE_DEPTH, ReferralStats, referral_levels
+from ledger import (
+    GAME, PAYMENT, PURCHASE, REFERRAL, REFUND, SIGNUP, WITHDRAW, LedgerCompactor, LedgerWriter, balance_at,
+    earnings_history
+)
+from metrics import MetricsMiddleware, MetricsRegistry, MongoCommandListener, SlowRequestProfiler
+from pagination import KEYSET_SORT, keyset_page, stream_ndjson
+from payment_processing import approve_payments, build_credit_update, process_withdrawals, reject_payments
+from password_hashing import PasswordHasher, PasswordPoolSaturated
+from payment_verification import PaymentVerifier, TronNode, address_hex, normalize_tx_hash
+from push import POLICY_VIOLATION, PushHub
+from rate_limit import RateLimiter, RateLimitExceeded, parse_limit
+from session_cache import UserSessionCache, USER_SESSION_PROJECTION
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'cosmic_miner')]
+# MongoDB connection settings. The pool is per worker process, see serve.py
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+# Connections opened before the worker reports ready
+MONGO_WARM_CONNECTIONS = min(int(os.environ.get('MONGO_WARM_CONNECTIONS', 10)), MONGO_MAX_POOL_SIZE)
 
 # JWT Settings
 SECRET_KEY = os.environ.get('SECRET_KEY', 'cosmic-miner-secret-key-2024')
@@ -30,9 +71,245 @@ ACCESS_TOKEN_EXPIRE_DAYS = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+# Peer workers: session cache invalidations, leaderboard changes and pushes
+# are broadcast through Redis when COORDINATION_URL is set; a single process
+# needs nothing beyond memory
+SESSION_CHANNEL = "session.invalidate"
+LEADERBOARD_CHANNEL = "leaderboard"
+PUSH_CHANNEL = "push"
+
+PUSH_CREDIT_PROJECTION = {"_id": 0, "coins": 1, "owned_ships": 1, "active_boosts": 1}
+
+# Token-bucket limits ("COUNT/SECONDS", "off" disables), checked before any
+# Mongo or bcrypt work; buckets are shared through the coordinator
+LOGIN_RATE_LIMIT = parse_limit(os.environ.get('RATE_LIMIT_LOGIN', '20/60'))
+REGISTER_RATE_LIMIT = parse_limit(os.environ.get('RATE_LIMIT_REGISTER', '10/600'))
+GAME_RESULT_RATE_LIMIT = parse_limit(os.environ.get('RATE_LIMIT_GAME_RESULT', '60/60'))
+# Entries per /game/results:batch call; each one takes a game_result token
+GAME_RESULT_BATCH_MAX = int(os.environ.get('GAME_RESULT_BATCH_MAX', 50))
+# Queued results played longer ago than this are rejected
+GAME_RESULT_MAX_AGE = timedelta(hours=float(os.environ.get('GAME_RESULT_MAX_AGE_HOURS', 72)))
+
+# Game result ingestion: "direct" settles every result immediately,
+# "batched" queues them and flushes coalesced $inc's with bulk_write
+GAME_RESULT_INGEST_MODE = os.environ.get('GAME_RESULT_INGEST_MODE', 'direct')
+if GAME_RESULT_INGEST_MODE not in ("direct", "batched"):
+    raise ValueError(f"Unknown GAME_RESULT_INGEST_MODE: {GAME_RESULT_INGEST_MODE}")
+
+# Game results are checked against these bounds and the user's recent
+# results, then kept in game_results for the offline anti-cheat scan
+anticheat_bounds = bounds_from_env(os.environ)
+
 # TRC20 Payment Address
 TRC20_ADDRESS = "TP92d2cyjwXNdFuJN9P8WeQ2jDWW7rvJMA"
 
+class AppServices:
+    """What one app instance owns: the Mongo client, the caches and the background tasks.
+
+    create_app() builds one per app, so two apps in a process share no
+    state and each starts its own tasks. Building it does no I/O; Mongo
+    connects in the lifespan (connect_mongo), and tests may assign
+    client/db before startup.
+    """
+
+    def __init__(self):
+        # Request/Mongo instrumentation, exported on /metrics
+        self.metrics_registry = MetricsRegistry()
+        self.slow_request_profiler = SlowRequestProfiler(
+            threshold=float(os.environ['SLOW_REQUEST_PROFILE_MS']) / 1000
+        ) if os.environ.get('SLOW_REQUEST_PROFILE_MS') else None
+        self.client = None
+        self.db = None
+
+        self.password_hasher = PasswordHasher(
+            pwd_context,
+            max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 4)),
+            max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64)),
+        )
+        self.coordinator = create_coordinator(os.environ.get('COORDINATION_URL'))
+
+        # WebSocket clients get balance/leaderboard changes pushed instead of polling;
+        # user messages reach the worker holding the socket through the coordinator
+        self.push_hub = PushHub(
+            queue_size=int(os.environ.get('PUSH_QUEUE_SIZE', 64)),
+            max_connections_per_user=int(os.environ.get('PUSH_MAX_CONNECTIONS_PER_USER', 5)),
+            leaderboard_interval=float(os.environ.get('PUSH_LEADERBOARD_INTERVAL_SECONDS', 1)),
+        )
+        self.coordinator.subscribe(PUSH_CHANNEL, lambda message: self.push_hub.send(*message))
+        self.rate_limiter = RateLimiter(self.coordinator)
+
+        # Auth fast path: get_current_user serves these projections without a Mongo round-trip
+        self.session_cache = UserSessionCache(
+            max_size=int(os.environ.get('SESSION_CACHE_MAX_SIZE', 10000)),
+            ttl_seconds=float(os.environ.get('SESSION_CACHE_TTL_SECONDS', 30)),
+            on_change=lambda user_id: self.coordinator.publish(SESSION_CHANNEL, user_id),
+        )
+        self.coordinator.subscribe(SESSION_CHANNEL, self.session_cache.discard)
+
+        self.game_result_ingestor = GameResultIngestor(
+            flush_interval=float(os.environ.get('GAME_RESULT_FLUSH_INTERVAL_MS', 50)) / 1000,
+            max_batch=int(os.environ.get('GAME_RESULT_FLUSH_MAX_OPS', 500)),
+            # Peers cached these users without this worker's pending credits
+            on_flushed=lambda user_ids: [self.coordinator.publish(SESSION_CHANNEL, user_id) for user_id in user_ids],
+        ) if GAME_RESULT_INGEST_MODE == "batched" else None
+
+        # Expired boosts are pruned in bulk by a background sweeper
+        self.boost_sweeper = BoostSweeper(
+            interval=float(os.environ.get('BOOST_SWEEP_INTERVAL_SECONDS', 30)),
+            on_swept=lambda user_ids: [self.session_cache.invalidate(user_id) for user_id in user_ids],
+        )
+
+        # Coin ledger: entries are buffered and inserted in batches, finished
+        # days are rolled into per-user snapshots by a background compactor
+        self.ledger = LedgerWriter(
+            flush_interval=float(os.environ.get('LEDGER_FLUSH_INTERVAL_MS', 200)) / 1000,
+            max_batch=int(os.environ.get('LEDGER_FLUSH_MAX_DOCS', 1000)),
+        )
+        self.ledger_compactor = LedgerCompactor(
+            interval=float(os.environ.get('LEDGER_COMPACT_INTERVAL_SECONDS', 3600)),
+            retention_days=int(os.environ.get('LEDGER_RETENTION_DAYS', 0)),
+        )
+        # Daily economy totals for /admin/stats, summed from the ledger, payments and
+        # withdrawals a slice at a time
+        self.analytics_rollup = AnalyticsRollup(
+            interval=float(os.environ.get('ANALYTICS_ROLLUP_INTERVAL_SECONDS', 60))
+        )
+
+        self.plausibility = PlausibilityChecker(
+            anticheat_bounds,
+            window=int(os.environ.get('ANTICHEAT_WINDOW', 32)),
+            max_users=int(os.environ.get('ANTICHEAT_MAX_USERS', 100000)),
+        )
+        self.game_result_log = BatchInserter(
+            flush_interval=float(os.environ.get('GAME_RESULT_LOG_FLUSH_INTERVAL_MS', 1000)) / 1000
+        )
+
+        # Invitee earnings roll up into their inviter's referral_network_earned
+        self.referral_stats = ReferralStats(
+            flush_interval=float(os.environ.get('REFERRAL_STATS_FLUSH_INTERVAL_SECONDS', 1)),
+            # Cached sessions of these inviters carry the old referral_network_earned
+            on_flushed=lambda user_ids: [self.session_cache.invalidate(user_id) for user_id in user_ids],
+        )
+
+        # Submitted payments are checked against a TRON node and approved
+        # automatically when TRON_NODE_URL is set; otherwise an admin approves them
+        self.payment_verifier = PaymentVerifier(
+            TronNode(
+                os.environ['TRON_NODE_URL'],
+                api_key=os.environ.get('TRON_API_KEY'),
+                max_connections=int(os.environ.get('TRON_NODE_MAX_CONNECTIONS', 20)),
+            ),
+            TRC20_ADDRESS,
+            interval=float(os.environ.get('PAYMENT_VERIFY_INTERVAL_SECONDS', 5)),
+            batch_size=int(os.environ.get('PAYMENT_VERIFY_BATCH_SIZE', 100)),
+            concurrency=int(os.environ.get('PAYMENT_VERIFY_CONCURRENCY', 10)),
+            on_approved=lambda user_ids: [payment_credited(user_id) for user_id in user_ids],
+        ) if os.environ.get('TRON_NODE_URL') else None
+
+        # Seeded on startup, then kept current by every write that changes total_earned
+        self.leaderboard = Leaderboard(
+            ship_image=lambda ship_id: SHIP_DATA.get(ship_id, SHIP_DATA["basic"])["image"],
+            size=50,
+            on_change=lambda change: self.coordinator.publish(LEADERBOARD_CHANNEL, change),
+        )
+        self.coordinator.subscribe(LEADERBOARD_CHANNEL, self.leaderboard.apply)
+        self._register_metrics()
+
+    def connect_mongo(self) -> None:
+        if self.db is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            os.environ['MONGO_URL'],
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            event_listeners=[MongoCommandListener(self.metrics_registry)],
+        )
+        self.db = self.client[os.environ.get('DB_NAME', 'cosmic_miner')]
+
+    def _register_metrics(self) -> None:
+        registry = self.metrics_registry
+        registry.register_callback(
+            "cosmic_session_cache_hits_total", "counter", "Session cache hits.", lambda: self.session_cache.hits)
+        registry.register_callback(
+            "cosmic_session_cache_misses_total", "counter", "Session cache misses.", lambda: self.session_cache.misses)
+        registry.register_callback(
+            "cosmic_session_cache_size", "gauge", "Cached user sessions.", lambda: len(self.session_cache))
+        registry.register_callback(
+            "cosmic_password_pool_pending", "gauge", "Queued or running bcrypt jobs.",
+            lambda: self.password_hasher.pending)
+        registry.register_callback(
+            "cosmic_password_pool_rejected_total", "counter", "bcrypt jobs rejected with 503.",
+            lambda: self.password_hasher.rejected)
+        registry.register_callback(
+            "cosmic_referral_stats_queued", "gauge", "Referral earnings waiting to be flushed.",
+            lambda: self.referral_stats.stats()["queued"])
+        registry.register_callback(
+            "cosmic_ledger_entries_queued", "gauge", "Ledger entries waiting to be flushed.",
+            lambda: self.ledger.stats()["queued"])
+        if self.game_result_ingestor is not None:
+            registry.register_callback(
+                "cosmic_game_results_queued", "gauge", "Game results waiting to be flushed.",
+                lambda: self.game_result_ingestor.stats()["queued"])
+        registry.register_callback(
+            "cosmic_game_results_rejected_total", "counter", "Game results rejected as implausible.",
+            lambda: self.plausibility.rejected)
+        registry.register_callback(
+            "cosmic_game_results_outliers_total", "counter", "Game results flagged as outliers.",
+            lambda: self.plausibility.outliers)
+        registry.register_callback(
+            "cosmic_push_connections", "gauge", "Open push WebSocket connections.", lambda: len(self.push_hub))
+        registry.register_callback(
+            "cosmic_push_dropped_total", "counter", "Push connections dropped for falling behind.",
+            lambda: self.push_hub.dropped)
+        registry.register_callback(
+            "cosmic_rate_limited_total", "counter", "Requests rejected with 429.", lambda: self.rate_limiter.rejected)
+        if isinstance(self.coordinator, RedisCoordinator):
+            registry.register_callback(
+                "cosmic_coordination_published_total", "counter", "Messages broadcast to peer workers.",
+                lambda: self.coordinator.published)
+            registry.register_callback(
+                "cosmic_coordination_received_total", "counter", "Messages applied from peer workers.",
+                lambda: self.coordinator.received)
+
+_current_services: ContextVar = ContextVar("services")
+
+class _CurrentServices:
+    """``services.x`` is the ``x`` of the app serving the current request or running its lifespan."""
+
+    def __getattr__(self, name: str):
+        return getattr(_current_services.get(), name)
+
+services = _CurrentServices()
+
+def use_services(app_services: AppServices) -> None:
+    """Make ``app_services`` current in this context, for code called outside a request."""
+    _current_services.set(app_services)
+
+class ServicesMiddleware:
+    """Makes the app's services current for its lifespan, requests and WebSockets.
+
+    Tasks started from there copy the context, so they keep them.
+    """
+
+    def __init__(self, app, app_services: AppServices):
+        self.app = app
+        self.app_services = app_services
+
+    async def __call__(self, scope, receive, send):
+        token = _current_services.set(self.app_services)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_services.reset(token)
+
+def push(user_id: str, payload: dict) -> None:
+    services.push_hub.send(user_id, payload)
+    services.coordinator.publish(PUSH_CHANNEL, [user_id, payload])
+
+async def warm_mongo_pool(connections: int) -> None:
+    # Concurrent pings each check out a connection, so the pool opens this many
+    await asyncio.gather(*(services.db.command("ping") for _ in range(connections)))
+
 # Game Settings
 WELCOME_BONUS = 100  # Hoşgeldin bonusu
 WITHDRAW_THRESHOLD = 10000  # Para çekme eşiği
@@ -40,7 +317,6 @@ USDT_PER_COIN = 0.001  # 1000 coin = 1 USDT
 REFERRAL_BONUS_INVITER = 200  # Davet edene verilen bonus
 REFERRAL_BONUS_INVITED = 50  # Davet edilene ekstra bonus
 
-app = FastAPI(title="Cosmic Miner API")
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -66,10 +342,16 @@ class User(BaseModel):
     owned_ships: List[str] = ["basic"]
     active_ship: str = "basic"
     active_boosts: List[dict] = []
+    boost_multiplier: float = 1.0  # Aktif boostların çarpımı...
+    boost_until: Optional[datetime] = None  # ...bu zamana kadar geçerli
     is_admin: bool = False
     referral_code: str = Field(default_factory=lambda: str(uuid.uuid4())[:8].upper())
     referred_by: Optional[str] = None
     referral_count: int = 0
+    referral_bonus_earned: int = 0  # Davetlerden kazanılan bonus
+    referral_network_earned: int = 0  # Davet edilenlerin toplam kazancı
+    tron_wallet: Optional[str] = None  # USDT ödemelerinin gönderildiği cüzdan...
+    tron_wallet_since: Optional[datetime] = None  # ...bu zamandan sonraki transferler için
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class TokenResponse(BaseModel):
@@ -82,17 +364,65 @@ class GameResult(BaseModel):
     distance: int
     crystals_collected: int
 
-class ShopItem(BaseModel):
+class QueuedGameResult(GameResult):
+    # Generated by the client so a retried batch is not credited twice
+    id: str = Field(..., min_length=1, max_length=64)
+    played_at: datetime
+
+class GameResultBatch(BaseModel):
+    results: List[QueuedGameResult] = Field(..., min_length=1, max_length=GAME_RESULT_BATCH_MAX)
+
+# Response models for the hot endpoints: FastAPI validates and serializes
+# them in pydantic-core instead of walking plain dicts with jsonable_encoder
+class ActiveBoost(BaseModel):
     id: str
     name: str
-    description: str
-    type: str  # ship, boost, upgrade
-    price_coins: Optional[int] = None
-    price_usdt: Optional[float] = None
-    coin_multiplier: float = 1.0
-    speed_bonus: float = 0
-    image: str = ""
-    rarity: str = "common"  # common, rare, epic, legendary
+    multiplier: float
+    activated_at: Optional[datetime] = None
+    expires_at: datetime
+
+class MeResponse(BaseModel):
+    id: str
+    email: str
+    username: str
+    coins: int
+    total_earned: int
+    ship_level: int
+    owned_ships: List[str]
+    active_ship: str
+    active_boosts: List[ActiveBoost]
+    is_admin: bool
+    referral_code: str
+    referral_count: int
+
+class GameResultResponse(BaseModel):
+    coins_earned: int
+    base_coins: int
+    multiplier: float
+    total_coins: int
+    total_earned: int
+
+class GameResultBatchEntry(BaseModel):
+    id: str
+    status: str  # credited, rejected, duplicate
+    coins_earned: int = 0
+    base_coins: int
+    multiplier: Optional[float] = None
+
+class GameResultBatchResponse(BaseModel):
+    results: List[GameResultBatchEntry]
+    coins_earned: int
+    total_coins: int
+    total_earned: int
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    username: str
+    total_earned: int
+    ship_image: str
+
+class LeaderboardResponse(BaseModel):
+    leaderboard: List[LeaderboardEntry]
 
 class PaymentRequest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -105,12 +435,18 @@ class PaymentRequest(BaseModel):
     status: str = "pending"  # pending, approved, rejected
     created_at: datetime = Field(default_factory=datetime.utcnow)
     processed_at: Optional[datetime] = None
+    idempotency_key: Optional[str] = None
+    # Picked up by the payment verifier from then on
+    verify_next_at: datetime = Field(default_factory=datetime.utcnow)
 
 class PaymentSubmit(BaseModel):
     tx_hash: str
     amount_usdt: float
     item_id: str
 
+class PaymentWallet(BaseModel):
+    address: str = Field(..., min_length=34, max_length=34)
+
 class WithdrawRequest(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -121,50 +457,33 @@ class WithdrawRequest(BaseModel):
     status: str = "pending"
     created_at: datetime = Field(default_factory=datetime.utcnow)
     processed_at: Optional[datetime] = None
+    idempotency_key: Optional[str] = None
 
 class WithdrawSubmit(BaseModel):
     coins_amount: int
     wallet_address: str
 
-# ============ SHOP ITEMS ============
-
-SHOP_ITEMS = [
-    # Coin ile alınabilir gemiler
-    ShopItem(id="ship_silver", name="Silver Cruiser", description="%50 daha fazla coin topla", type="ship", price_coins=500, coin_multiplier=1.5, rarity="common", image="🚀"),
-    ShopItem(id="ship_gold", name="Gold Voyager", description="2x coin topla", type="ship", price_coins=2000, coin_multiplier=2.0, rarity="rare", image="✨"),
-    
-    # USDT ile alınabilir premium gemiler
-    ShopItem(id="ship_diamond", name="Diamond Striker", description="3x coin + Hız bonusu", type="ship", price_usdt=5.0, coin_multiplier=3.0, speed_bonus=0.2, rarity="epic", image="💎"),
-    ShopItem(id="ship_cosmic", name="Cosmic Destroyer", description="5x coin + Max hız", type="ship", price_usdt=15.0, coin_multiplier=5.0, speed_bonus=0.5, rarity="legendary", image="🌟"),
-    ShopItem(id="ship_phoenix", name="Phoenix Inferno", description="10x coin + Kalkan", type="ship", price_usdt=50.0, coin_multiplier=10.0, speed_bonus=0.3, rarity="legendary", image="🔥"),
-    
-    # Boostlar - USDT
-    ShopItem(id="boost_2x_1h", name="2x Boost (1 Saat)", description="1 saat boyunca 2x coin", type="boost", price_usdt=1.0, coin_multiplier=2.0, rarity="rare", image="⚡"),
-    ShopItem(id="boost_5x_1h", name="5x Boost (1 Saat)", description="1 saat boyunca 5x coin", type="boost", price_usdt=3.0, coin_multiplier=5.0, rarity="epic", image="💫"),
-    ShopItem(id="boost_10x_30m", name="10x Mega Boost (30dk)", description="30 dakika 10x coin", type="boost", price_usdt=5.0, coin_multiplier=10.0, rarity="legendary", image="🌈"),
-    
-    # Coin paketi - USDT
-    ShopItem(id="coins_1000", name="1000 Coin Paketi", description="1000 oyun coini", type="coins", price_usdt=2.0, rarity="common", image="💰"),
-    ShopItem(id="coins_5000", name="5000 Coin Paketi", description="5000 oyun coini + %10 bonus", type="coins", price_usdt=8.0, rarity="rare", image="💰"),
-    ShopItem(id="coins_15000", name="15000 Coin Paketi", description="15000 oyun coini + %25 bonus", type="coins", price_usdt=20.0, rarity="epic", image="💰"),
-]
-
-SHIP_DATA = {
-    "basic": {"name": "Basic Shuttle", "multiplier": 1.0, "speed": 0, "image": "🛸"},
-    "ship_silver": {"name": "Silver Cruiser", "multiplier": 1.5, "speed": 0, "image": "🚀"},
-    "ship_gold": {"name": "Gold Voyager", "multiplier": 2.0, "speed": 0.1, "image": "✨"},
-    "ship_diamond": {"name": "Diamond Striker", "multiplier": 3.0, "speed": 0.2, "image": "💎"},
-    "ship_cosmic": {"name": "Cosmic Destroyer", "multiplier": 5.0, "speed": 0.5, "image": "🌟"},
-    "ship_phoenix": {"name": "Phoenix Inferno", "multiplier": 10.0, "speed": 0.3, "image": "🔥"},
-}
+class BatchIds(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=500)
+
+# ============ CATALOG ============
+
+# The catalog never changes at runtime, so the shop body and its ETag are built once
+SHOP_ITEMS_BODY, SHOP_ITEMS_ETAG = render_shop_body(TRC20_ADDRESS)
 
 # ============ AUTH HELPERS ============
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    try:
+        return await services.password_hasher.hash(password)
+    except PasswordPoolSaturated:
+        raise HTTPException(status_code=503, detail="Sunucu meşgul, lütfen tekrar deneyin", headers={"Retry-After": "1"})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await services.password_hasher.verify(plain_password, hashed_password)
+    except PasswordPoolSaturated:
+        raise HTTPException(status_code=503, detail="Sunucu meşgul, lütfen tekrar deneyin", headers={"Retry-After": "1"})
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -172,6 +491,45 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+SESSION_READ_ATTEMPTS = 3
+
+async def load_session_user(user_id: str) -> Optional[dict]:
+    """The cached session projection of ``user_id``, read from Mongo on a miss.
+
+    With the batched ingestor, a read that a flush finished during is
+    retried; only a read no flush overlapped is cached.
+    """
+    user = services.session_cache.get(user_id)
+    services.metrics_registry.record_auth_lookup(cache_hit=user is not None)
+    if user is not None:
+        return user
+    
+    ingestor = services.game_result_ingestor
+    if ingestor is None:
+        user = await services.db.users.find_one({"id": user_id}, USER_SESSION_PROJECTION)
+        if user is not None:
+            services.session_cache.put(user_id, user)
+        return user
+
+    for _ in range(SESSION_READ_ATTEMPTS):
+        generation = ingestor.generation
+        user = await services.db.users.find_one({"id": user_id}, USER_SESSION_PROJECTION)
+        if user is None:
+            return None
+        # Include results still waiting in the write-behind queue
+        pending = ingestor.pending_for(user_id)
+        user["coins"] += pending
+        user["total_earned"] += pending
+        if ingestor.generation == generation:
+            break
+        # A flush finished during the read; the document may predate it
+    else:
+        # Flushes kept landing mid-read; serve the last read without caching it
+        return user
+    if not ingestor.is_inflight(user_id):
+        services.session_cache.put(user_id, user)
+    return user
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
@@ -180,7 +538,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
         
-        user = await db.users.find_one({"id": user_id})
+        user = await load_session_user(user_id)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -189,50 +547,135 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def client_ip(request: Request) -> str:
+    # The forwarded client address when the peer is a trusted proxy (serve.py --forwarded-allow-ips)
+    return request.client.host if request.client else "unknown"
+
+def decode_user_id(token: str) -> Optional[str]:
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("user_id")
+    except jwt.InvalidTokenError:
+        return None
+
+def token_user_id(connection: HTTPConnection) -> Optional[str]:
+    """User id from the bearer token, checked without touching Mongo."""
+    scheme, _, token = connection.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return decode_user_id(token)
+
+async def enforce_rate_limit(name: str, key: str, limit: Optional[tuple], cost: int = 1) -> None:
+    try:
+        await services.rate_limiter.check(name, key, limit, cost)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Çok fazla istek, lütfen biraz bekleyin",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+
+def rate_limited(name: str, limit: Optional[tuple], per_user: bool = False):
+    """Dependency enforcing ``limit`` per client IP, or per authenticated user."""
+    async def check_rate_limit(request: Request):
+        key = (per_user and token_user_id(request)) or client_ip(request)
+        await enforce_rate_limit(name, key, limit)
+    return check_rate_limit
+
 # ============ AUTH ENDPOINTS ============
 
-@api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user_data: UserCreate):
-    # Check if email exists
-    existing = await db.users.find_one({"email": user_data.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email zaten kayıtlı")
-    
-    # Check username
-    existing_username = await db.users.find_one({"username": user_data.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Kullanıcı adı zaten alınmış")
+REGISTER_INSERT_ATTEMPTS = 3
+
+def duplicate_key_field(error: DuplicateKeyError) -> Optional[str]:
+    """Name of the field whose unique index rejected an insert."""
+    key_pattern = (error.details or {}).get("keyPattern")
+    if key_pattern:
+        return next(iter(key_pattern))
+    # Servers before 4.4 only name the index in the message
+    for field in ("email", "username", "referral_code", "id"):
+        if f"index: {field}_unique" in str(error):
+            return field
+    return None
+
+async def credit_inviter(inviter: dict, invitee_id: str, invitee_bonus: int) -> None:
+    inviter_after = await services.db.users.find_one_and_update(
+        {"id": inviter["id"]},
+        {
+            "$inc": {
+                "coins": REFERRAL_BONUS_INVITER,
+                "total_earned": REFERRAL_BONUS_INVITER,
+                "referral_count": 1,
+                "referral_bonus_earned": REFERRAL_BONUS_INVITER
+            }
+        },
+        projection=LEADERBOARD_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    services.session_cache.invalidate(inviter["id"])
+    services.ledger.record(
+        inviter["id"], REFERRAL_BONUS_INVITER, REFERRAL, earned=REFERRAL_BONUS_INVITER, ref=invitee_id
+    )
+    if inviter_after is not None:
+        services.leaderboard.upsert(
+            inviter["id"], inviter_after["total_earned"], inviter_after["username"],
+            inviter_after.get("active_ship", "basic")
+        )
+    services.referral_stats.add(inviter["id"], invitee_bonus)
+    if inviter.get("referred_by"):
+        services.referral_stats.add(inviter["referred_by"], REFERRAL_BONUS_INVITER)
+
+async def find_inviter(referral_code: Optional[str]) -> Optional[dict]:
+    if not referral_code:
+        return None
+    return await services.db.users.find_one(
+        {"referral_code": referral_code.upper()}, {"_id": 0, "id": 1, "referred_by": 1}
+    )
+
+@api_router.post("/auth/register", response_model=TokenResponse,
+                 dependencies=[Depends(rate_limited("register", REGISTER_RATE_LIMIT))])
+async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
+    # bcrypt runs on the hashing pool while Mongo resolves the referral code;
+    # email/username uniqueness is left to the unique indexes on insert
+    password_hash, referred_by_user = await asyncio.gather(
+        hash_password(user_data.password), find_inviter(user_data.referral_code)
+    )
     
     # Referral bonus hesapla
     bonus_coins = WELCOME_BONUS
-    referred_by_user = None
-    
-    # Davet kodu varsa kontrol et
-    if user_data.referral_code:
-        referred_by_user = await db.users.find_one({"referral_code": user_data.referral_code.upper()})
-        if referred_by_user:
-            bonus_coins += REFERRAL_BONUS_INVITED  # Davet edilene ekstra bonus
+    if referred_by_user:
+        bonus_coins += REFERRAL_BONUS_INVITED  # Davet edilene ekstra bonus
     
     # Create user with welcome bonus
     user = User(
         email=user_data.email,
         username=user_data.username,
-        password_hash=hash_password(user_data.password),
+        password_hash=password_hash,
         coins=bonus_coins,
         total_earned=bonus_coins,
         referred_by=referred_by_user["id"] if referred_by_user else None
     )
     
-    await db.users.insert_one(user.dict())
-    
-    # Davet edene bonus ver
+    for attempt in range(REGISTER_INSERT_ATTEMPTS):
+        try:
+            await services.db.users.insert_one(user.dict())
+            break
+        except DuplicateKeyError as e:
+            field = duplicate_key_field(e)
+            if field == "email":
+                raise HTTPException(status_code=400, detail="Email zaten kayıtlı")
+            if field == "username":
+                raise HTTPException(status_code=400, detail="Kullanıcı adı zaten alınmış")
+            if attempt == REGISTER_INSERT_ATTEMPTS - 1 or field not in ("referral_code", "id"):
+                raise
+            # Generated referral code or id collided, draw new ones
+            user.id = str(uuid.uuid4())
+            user.referral_code = str(uuid.uuid4())[:8].upper()
+    
+    services.ledger.record(user.id, bonus_coins, SIGNUP, earned=bonus_coins)
+    services.leaderboard.upsert(user.id, user.total_earned, user.username, user.active_ship)
+    
+    # Davet edene bonus ver (yanıt gönderildikten sonra)
     if referred_by_user:
-        await db.users.update_one(
-            {"id": referred_by_user["id"]},
-            {
-                "$inc": {"coins": REFERRAL_BONUS_INVITER, "total_earned": REFERRAL_BONUS_INVITER, "referral_count": 1}
-            }
-        )
+        background_tasks.add_task(credit_inviter, referred_by_user, user.id, bonus_coins)
     
     token = create_access_token({"user_id": user.id})
     
@@ -250,13 +693,19 @@ async def register(user_data: UserCreate):
     
     return TokenResponse(access_token=token, user=user_response)
 
-@api_router.post("/auth/login", response_model=TokenResponse)
+LOGIN_PROJECTION = {
+    "_id": 0, "id": 1, "email": 1, "username": 1, "password_hash": 1, "coins": 1, "total_earned": 1,
+    "ship_level": 1, "owned_ships": 1, "active_ship": 1, "is_admin": 1
+}
+
+@api_router.post("/auth/login", response_model=TokenResponse,
+                 dependencies=[Depends(rate_limited("login", LOGIN_RATE_LIMIT))])
 async def login(user_data: UserLogin):
-    user = await db.users.find_one({"email": user_data.email})
+    user = await services.db.users.find_one({"email": user_data.email}, LOGIN_PROJECTION)
     if not user:
         raise HTTPException(status_code=401, detail="Email veya şifre hatalı")
     
-    if not verify_password(user_data.password, user["password_hash"]):
+    if not await verify_password(user_data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Email veya şifre hatalı")
     
     token = create_access_token({"user_id": user["id"]})
@@ -275,7 +724,7 @@ async def login(user_data: UserLogin):
     
     return TokenResponse(access_token=token, user=user_response)
 
-@api_router.get("/auth/me")
+@api_router.get("/auth/me", response_model=MeResponse)
 async def get_me(current_user: dict = Depends(get_current_user)):
     return {
         "id": current_user["id"],
@@ -302,16 +751,26 @@ async def get_referral_info(current_user: dict = Depends(get_current_user)):
         "referral_count": current_user.get("referral_count", 0),
         "bonus_per_invite": REFERRAL_BONUS_INVITER,
         "bonus_for_invited": REFERRAL_BONUS_INVITED,
-        "total_earned_from_referrals": current_user.get("referral_count", 0) * REFERRAL_BONUS_INVITER
+        # Documents from before the counter existed were always paid the current bonus
+        "total_earned_from_referrals": current_user.get(
+            "referral_bonus_earned", current_user.get("referral_count", 0) * REFERRAL_BONUS_INVITER
+        ),
+        "invited_users_total_earned": current_user.get("referral_network_earned", 0)
     }
 
 @api_router.get("/referral/invited-users")
-async def get_invited_users(current_user: dict = Depends(get_current_user)):
-    """Davet edilen kullanıcıları listele"""
-    invited_users = await db.users.find(
-        {"referred_by": current_user["id"]},
-        {"username": 1, "created_at": 1, "total_earned": 1}
-    ).to_list(100)
+async def get_invited_users(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Davet edilen kullanıcıları sayfa sayfa listele"""
+    try:
+        invited_users, next_cursor = await keyset_page(
+            services.db.users, {"referred_by": current_user["id"]}, INVITEE_PROJECTION, limit, cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz cursor")
     
     return {
         "invited_users": [
@@ -322,43 +781,85 @@ async def get_invited_users(current_user: dict = Depends(get_current_user)):
             }
             for user in invited_users
         ],
-        "total_invited": len(invited_users)
+        "total_invited": current_user.get("referral_count", 0),
+        "next_cursor": next_cursor
     }
 
+@api_router.get("/referral/tree")
+async def get_referral_tree(
+    depth: int = Query(3, ge=1, le=MAX_TREE_DEPTH),
+    current_user: dict = Depends(get_current_user)
+):
+    """Davet ağını seviye seviye özetle"""
+    return {"levels": await referral_levels(services.db.users, current_user["id"], depth)}
+
 # ============ GAME ENDPOINTS ============
 
-@api_router.post("/game/result")
+GAME_RESULT_PROJECTION = {"_id": 0, "coins": 1, "total_earned": 1}
+
+async def settle_game_result(user_id: str, final_coins: int, boost_refresh: Optional[dict] = None) -> Optional[dict]:
+    """Credit a game result in a single round-trip, repairing a stale boost summary if given."""
+    update = {"$inc": {"coins": final_coins, "total_earned": final_coins}}
+    if boost_refresh:
+        update["$set"] = boost_refresh
+    updated_user = await services.db.users.find_one_and_update(
+        {"id": user_id},
+        update,
+        projection=GAME_RESULT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_user is not None:
+        services.session_cache.update(user_id, {**updated_user, **(boost_refresh or {})})
+    return updated_user
+
+@api_router.post("/game/result", response_model=GameResultResponse,
+                 dependencies=[Depends(rate_limited("game_result", GAME_RESULT_RATE_LIMIT, per_user=True))])
 async def submit_game_result(result: GameResult, current_user: dict = Depends(get_current_user)):
     # Get ship multiplier
     active_ship = current_user.get("active_ship", "basic")
     ship_data = SHIP_DATA.get(active_ship, SHIP_DATA["basic"])
     multiplier = ship_data["multiplier"]
     
-    # Check active boosts
-    active_boosts = current_user.get("active_boosts", [])
     now = datetime.utcnow()
-    valid_boosts = []
-    boost_multiplier = 1.0
+    flags = services.plausibility.check(
+        current_user["id"], result.coins_earned, result.distance, result.crystals_collected
+    )
+    log_entry = {
+        "u": current_user["id"], "s": active_ship, "c": result.coins_earned, "x": result.distance,
+        "n": result.crystals_collected, "p": 0, "t": now,
+    }
+    if flags:
+        log_entry["f"] = flags
+    if HARD_FLAGS.intersection(flags):
+        services.game_result_log.add(log_entry)
+        raise HTTPException(status_code=422, detail="Geçersiz oyun sonucu")
     
-    for boost in active_boosts:
-        if datetime.fromisoformat(boost["expires_at"]) > now:
-            valid_boosts.append(boost)
-            boost_multiplier *= boost.get("multiplier", 1.0)
+    # Check active boosts
+    boost_multiplier, boost_refresh = effective_boost(current_user, now)
     
     # Calculate final coins
     final_coins = int(result.coins_earned * multiplier * boost_multiplier)
-    
-    # Update user
-    await db.users.update_one(
-        {"id": current_user["id"]},
-        {
-            "$inc": {"coins": final_coins, "total_earned": final_coins},
-            "$set": {"active_boosts": valid_boosts}
+    log_entry["p"] = final_coins
+    services.game_result_log.add(log_entry)
+    
+    if services.game_result_ingestor is not None:
+        services.game_result_ingestor.submit(current_user["id"], final_coins)
+        updated_user = {
+            "coins": current_user["coins"] + final_coins,
+            "total_earned": current_user["total_earned"] + final_coins
         }
-    )
-    
-    # Get updated user
-    updated_user = await db.users.find_one({"id": current_user["id"]})
+        services.session_cache.update(current_user["id"], updated_user)
+    else:
+        updated_user = await settle_game_result(current_user["id"], final_coins, boost_refresh)
+        if updated_user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+    services.ledger.record(current_user["id"], final_coins, GAME, earned=final_coins)
+    if current_user.get("referred_by"):
+        services.referral_stats.add(current_user["referred_by"], final_coins)
+    services.leaderboard.upsert(current_user["id"], updated_user["total_earned"], current_user["username"], active_ship)
+    push(current_user["id"], {
+        "type": "balance", "coins": updated_user["coins"], "total_earned": updated_user["total_earned"]
+    })
     
     return {
         "coins_earned": final_coins,
@@ -368,19 +869,158 @@ async def submit_game_result(result: GameResult, current_user: dict = Depends(ge
         "total_earned": updated_user["total_earned"]
     }
 
+# Client ids of the last results settled through the batch endpoint, kept on
+# the user document to recognise retries
+GAME_RESULT_IDS_KEPT = 500
+GAME_RESULT_BATCH_PROJECTION = {"_id": 0, "coins": 1, "total_earned": 1, "game_result_ids": 1}
+
+def as_utc(at: datetime) -> datetime:
+    return at.astimezone(timezone.utc).replace(tzinfo=None) if at.tzinfo is not None else at
+
+# Ship selections kept on the user document to price queued results
+SHIP_CHANGES_KEPT = 20
+
+def ship_at(user: dict, at: datetime) -> str:
+    """The ship ``user`` had selected at ``at``, going by ``ship_changes``.
+
+    Each change records the ship it replaced, so a time before the oldest
+    change gets that one. Once older changes were dropped, such a time
+    gets the basic ship.
+    """
+    changes = user.get("ship_changes") or []
+    if not changes:
+        return user.get("active_ship", "basic")
+    ship = changes[0]["from"] if len(changes) < SHIP_CHANGES_KEPT else "basic"
+    for change in changes:
+        if change["at"] > at:
+            break
+        ship = change["ship"]
+    return ship
+
+def settle_game_results_update(credits: list, boost_refresh: Optional[dict]) -> list:
+    """Update pipeline crediting ``credits`` (``(result_id, coins)`` pairs) except ids already settled.
+
+    Which ids are new is decided against the stored ``game_result_ids``
+    inside the update, so concurrent retries of a batch credit it once.
+    """
+    settled = {"$ifNull": ["$game_result_ids", []]}
+    earned = {"$add": [
+        {"$cond": [{"$in": [{"$literal": result_id}, settled]}, 0, coins]} for result_id, coins in credits
+    ]}
+    fields = {
+        "coins": {"$add": ["$coins", earned]},
+        "total_earned": {"$add": ["$total_earned", earned]},
+        "game_result_ids": {"$slice": [{"$concatArrays": [settled, {"$filter": {
+            "input": {"$literal": [result_id for result_id, _ in credits]},
+            "cond": {"$not": {"$in": ["$$this", settled]}},
+        }}]}, -GAME_RESULT_IDS_KEPT]},
+    }
+    for field, value in (boost_refresh or {}).items():
+        fields[field] = {"$literal": value}
+    return [{"$set": fields}]
+
+async def game_result_batch_rate_limited(request: Request, batch: GameResultBatch) -> GameResultBatch:
+    # Resolved before get_current_user, so a client over its limit costs no Mongo round-trip
+    key = token_user_id(request) or client_ip(request)
+    cost = min(len(batch.results), GAME_RESULT_RATE_LIMIT[1]) if GAME_RESULT_RATE_LIMIT else 1
+    await enforce_rate_limit("game_result", key, GAME_RESULT_RATE_LIMIT, cost)
+    return batch
+
+@api_router.post("/game/results:batch", response_model=GameResultBatchResponse)
+async def submit_game_results_batch(
+    batch: GameResultBatch = Depends(game_result_batch_rate_limited),
+    current_user: dict = Depends(get_current_user)
+):
+    """Çevrimdışı oynanan oyunları oynandıkları sırayla tek seferde kaydet"""
+    user_id = current_user["id"]
+    boosts = current_user.get("active_boosts", [])
+    now = datetime.utcnow()
+    
+    # Settled in the order they were played, whatever order the client queued
+    # them in, never ahead of the server clock and only within GAME_RESULT_MAX_AGE
+    settled = {}
+    entries = {}
+    for entry in sorted(batch.results, key=lambda e: as_utc(e.played_at)):
+        if entry.id in settled or entry.id in entries:
+            continue
+        played_at = min(as_utc(entry.played_at), now)
+        if played_at < now - GAME_RESULT_MAX_AGE:
+            settled[entry.id] = {"id": entry.id, "status": "rejected", "base_coins": entry.coins_earned}
+        else:
+            entries[entry.id] = (entry, played_at, ship_at(current_user, played_at))
+    credits = []
+    multipliers = []
+    for entry, played_at, ship in entries.values():
+        # The ship and boosts as they were when the game was played
+        multipliers.append(
+            SHIP_DATA.get(ship, SHIP_DATA["basic"])["multiplier"] * boost_multiplier_at(boosts, played_at)
+        )
+        rejected = services.plausibility.hard_flags(entry.coins_earned, entry.distance, entry.crystals_collected)
+        credits.append((entry.id, 0 if rejected else int(entry.coins_earned * multipliers[-1])))
+    
+    # One update for the balance, the boost summary and the settled ids; the
+    # document as it was before tells which ids an earlier attempt settled
+    _, boost_refresh = effective_boost(current_user, now)
+    before = await services.db.users.find_one_and_update(
+        {"id": user_id},
+        settle_game_results_update(credits, boost_refresh),
+        projection=GAME_RESULT_BATCH_PROJECTION,
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    seen = set(before.get("game_result_ids", []))
+    
+    total = 0
+    for (entry, played_at, ship), (_, coins), multiplier in zip(entries.values(), credits, multipliers):
+        if entry.id in seen:
+            settled[entry.id] = {"id": entry.id, "status": "duplicate", "base_coins": entry.coins_earned}
+            continue
+        flags = services.plausibility.check(user_id, entry.coins_earned, entry.distance, entry.crystals_collected)
+        log_entry = {
+            "u": user_id, "s": ship, "c": entry.coins_earned, "x": entry.distance,
+            "n": entry.crystals_collected, "p": coins, "t": played_at,
+        }
+        if flags:
+            log_entry["f"] = flags
+        services.game_result_log.add(log_entry)
+        if HARD_FLAGS.intersection(flags):
+            settled[entry.id] = {"id": entry.id, "status": "rejected", "base_coins": entry.coins_earned}
+            continue
+        total += coins
+        services.ledger.record(user_id, coins, GAME, earned=coins, ref=entry.id)
+        settled[entry.id] = {
+            "id": entry.id, "status": "credited", "coins_earned": coins, "base_coins": entry.coins_earned,
+            "multiplier": multiplier,
+        }
+    
+    balances = {"coins": before["coins"] + total, "total_earned": before["total_earned"] + total}
+    refresh_cached_balance(user_id, {**balances, **(boost_refresh or {})})
+    pending = services.game_result_ingestor.pending_for(user_id) if services.game_result_ingestor is not None else 0
+    balances = {"coins": balances["coins"] + pending, "total_earned": balances["total_earned"] + pending}
+    if total:
+        if current_user.get("referred_by"):
+            services.referral_stats.add(current_user["referred_by"], total)
+        services.leaderboard.upsert(
+            user_id, balances["total_earned"], current_user["username"], current_user.get("active_ship", "basic")
+        )
+        push(user_id, {"type": "balance", **balances})
+    
+    return {
+        # In the order the client sent them; a repeated id repeats its outcome
+        "results": [settled[entry.id] for entry in batch.results],
+        "coins_earned": total,
+        "total_coins": balances["coins"],
+        "total_earned": balances["total_earned"]
+    }
+
 @api_router.get("/game/ship-data")
 async def get_ship_data(current_user: dict = Depends(get_current_user)):
     active_ship = current_user.get("active_ship", "basic")
     ship = SHIP_DATA.get(active_ship, SHIP_DATA["basic"])
     
     # Check boosts
-    active_boosts = current_user.get("active_boosts", [])
-    now = datetime.utcnow()
-    boost_multiplier = 1.0
-    
-    for boost in active_boosts:
-        if datetime.fromisoformat(boost["expires_at"]) > now:
-            boost_multiplier *= boost.get("multiplier", 1.0)
+    boost_multiplier, _ = effective_boost(current_user, datetime.utcnow())
     
     return {
         "ship_id": active_ship,
@@ -399,82 +1039,184 @@ async def select_ship(ship_id: str, current_user: dict = Depends(get_current_use
     if ship_id not in owned_ships:
         raise HTTPException(status_code=400, detail="Bu gemiye sahip değilsiniz")
     
-    await db.users.update_one(
+    # Recorded so queued results are priced with the ship they were played with
+    change = {"ship": ship_id, "from": current_user.get("active_ship", "basic"), "at": datetime.utcnow()}
+    await services.db.users.update_one(
         {"id": current_user["id"]},
-        {"$set": {"active_ship": ship_id}}
+        {
+            "$set": {"active_ship": ship_id},
+            "$push": {"ship_changes": {"$each": [change], "$slice": -SHIP_CHANGES_KEPT}}
+        }
     )
+    services.session_cache.invalidate(current_user["id"])
+    services.leaderboard.set_ship(current_user["id"], ship_id)
     
     return {"message": "Gemi seçildi", "active_ship": ship_id}
 
 # ============ SHOP ENDPOINTS ============
 
 @api_router.get("/shop/items")
-async def get_shop_items():
-    return {"items": [item.dict() for item in SHOP_ITEMS], "trc20_address": TRC20_ADDRESS}
+async def get_shop_items(if_none_match: Optional[str] = Header(None)):
+    headers = {"ETag": SHOP_ITEMS_ETAG, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, SHOP_ITEMS_ETAG):
+        return Response(status_code=304, headers=headers)
+    return Response(content=SHOP_ITEMS_BODY, media_type="application/json", headers=headers)
+
+def refresh_cached_balance(user_id: str, fields: dict) -> None:
+    """Patch a cached session with balance fields a guarded update just returned."""
+    if services.game_result_ingestor is not None:
+        if services.game_result_ingestor.is_inflight(user_id):
+            services.session_cache.invalidate(user_id)
+            return
+        pending = services.game_result_ingestor.pending_for(user_id)
+        fields = {**fields, **{field: fields[field] + pending for field in ("coins", "total_earned") if field in fields}}
+    services.session_cache.update(user_id, fields)
 
 @api_router.post("/shop/buy-with-coins/{item_id}")
 async def buy_with_coins(item_id: str, current_user: dict = Depends(get_current_user)):
     # Find item
-    item = next((i for i in SHOP_ITEMS if i.id == item_id), None)
+    item = ITEMS_BY_ID.get(item_id)
     if not item or item.price_coins is None:
         raise HTTPException(status_code=404, detail="Item bulunamadı veya coin ile alınamaz")
     
+    owns_ship = item.type == "ship" and item_id in current_user.get("owned_ships", ["basic"])
+    if owns_ship:
+        raise HTTPException(status_code=400, detail="Bu gemiye zaten sahipsiniz")
     if current_user["coins"] < item.price_coins:
         raise HTTPException(status_code=400, detail="Yetersiz coin")
     
-    # Process purchase
-    update_data = {"$inc": {"coins": -item.price_coins}}
-    
+    # The snapshot checks above only fail fast; the guarded update decides
+    extra_filter = extra_update = None
     if item.type == "ship":
-        owned_ships = current_user.get("owned_ships", ["basic"])
-        if item_id in owned_ships:
-            raise HTTPException(status_code=400, detail="Bu gemiye zaten sahipsiniz")
-        update_data["$push"] = {"owned_ships": item_id}
+        extra_filter = {"owned_ships": {"$ne": item_id}}
+        extra_update = {"$addToSet": {"owned_ships": item_id}}
     
-    await db.users.update_one({"id": current_user["id"]}, update_data)
+    before = await debit_coins(services.db.users, current_user["id"], item.price_coins, extra_filter, extra_update)
+    if before is None:
+        services.session_cache.invalidate(current_user["id"])
+        raise HTTPException(status_code=400, detail="Yetersiz coin")
+    balance = {"coins": before["coins"] - item.price_coins}
+    if item.type == "ship":
+        balance["owned_ships"] = before.get("owned_ships", ["basic"]) + [item_id]
+    refresh_cached_balance(current_user["id"], balance)
+    services.ledger.record(current_user["id"], -item.price_coins, PURCHASE, ref=item_id)
     
     return {"message": f"{item.name} satın alındı!", "item": item.dict()}
 
+def submitted_payment(payment_id: str) -> dict:
+    return {
+        "message": (
+            "Ödeme bildirimi alındı. İşlem doğrulandığında hesabınıza eklenecek."
+            if services.payment_verifier is not None
+            else "Ödeme bildirimi alındı. Admin onayından sonra hesabınıza eklenecek."
+        ),
+        "payment_id": payment_id
+    }
+
 @api_router.post("/shop/submit-payment")
-async def submit_payment(payment: PaymentSubmit, current_user: dict = Depends(get_current_user)):
+async def submit_payment(
+    payment: PaymentSubmit,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     # Find item
-    item = next((i for i in SHOP_ITEMS if i.id == payment.item_id), None)
+    item = ITEMS_BY_ID.get(payment.item_id)
     if not item or item.price_usdt is None:
         raise HTTPException(status_code=404, detail="Item bulunamadı")
     
     if payment.amount_usdt < item.price_usdt:
         raise HTTPException(status_code=400, detail=f"Yetersiz miktar. Gereken: {item.price_usdt} USDT")
     
+    # A retried submission: answer with the payment the first attempt created
+    if idempotency_key is not None:
+        existing = await services.db.payments.find_one(
+            {"user_id": current_user["id"], "idempotency_key": idempotency_key}, {"_id": 0, "id": 1}
+        )
+        if existing is not None:
+            return submitted_payment(existing["id"])
+    
+    # Transfers to TRC20_ADDRESS are public, so another user's pending claim
+    # does not block this one; only an approved payment holds the tx_hash
+    tx_hash = normalize_tx_hash(payment.tx_hash)
+    if await services.db.payments.find_one(
+        {"tx_hash": tx_hash, "$or": [{"status": "approved"}, {"status": "pending", "user_id": current_user["id"]}]},
+        {"_id": 0, "id": 1}
+    ) is not None:
+        raise HTTPException(status_code=409, detail="Bu işlem zaten bildirilmiş")
+    
     # Create payment request
     payment_req = PaymentRequest(
         user_id=current_user["id"],
         username=current_user["username"],
-        tx_hash=payment.tx_hash,
+        tx_hash=tx_hash,
         amount_usdt=payment.amount_usdt,
         item_id=payment.item_id,
-        item_name=item.name
+        item_name=item.name,
+        idempotency_key=idempotency_key
     )
     
-    await db.payments.insert_one(payment_req.dict())
-    
-    return {
-        "message": "Ödeme bildirimi alındı. Admin onayından sonra hesabınıza eklenecek.",
-        "payment_id": payment_req.id
-    }
+    payment_id = payment_req.id
+    try:
+        await services.db.payments.insert_one(payment_req.dict())
+    except DuplicateKeyError:
+        # The same submission retried concurrently
+        existing = await services.db.payments.find_one(
+            {"user_id": current_user["id"], "idempotency_key": idempotency_key}, {"_id": 0, "id": 1}
+        ) if idempotency_key is not None else None
+        if existing is None:
+            raise
+        payment_id = existing["id"]
+    
+    return submitted_payment(payment_id)
+
+@api_router.post("/shop/payment-wallet")
+async def set_payment_wallet(wallet: PaymentWallet, current_user: dict = Depends(get_current_user)):
+    # Payments are only verified automatically when sent from this wallet,
+    # and only for transfers made after it was registered
+    try:
+        address_hex(wallet.address)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz TRON adresi")
+    try:
+        await services.db.users.update_one(
+            {"id": current_user["id"]},
+            {"$set": {"tron_wallet": wallet.address, "tron_wallet_since": datetime.utcnow()}}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Bu cüzdan başka bir hesaba kayıtlı")
+    return {"message": "Ödeme cüzdanı kaydedildi", "tron_wallet": wallet.address}
 
 # ============ WITHDRAW ENDPOINTS ============
 
+WITHDRAW_REPLAY_PROJECTION = {"_id": 0, "id": 1, "coins_amount": 1, "usdt_amount": 1}
+
+async def find_withdraw_replay(user_id: str, idempotency_key: Optional[str]) -> Optional[dict]:
+    if idempotency_key is None:
+        return None
+    return await services.db.withdrawals.find_one(
+        {"user_id": user_id, "idempotency_key": idempotency_key}, WITHDRAW_REPLAY_PROJECTION
+    )
+
+def withdraw_response(withdrawal: dict) -> dict:
+    return {
+        "message": "Para çekme talebi oluşturuldu",
+        "coins_amount": withdrawal["coins_amount"],
+        "usdt_amount": withdrawal["usdt_amount"],
+        "withdraw_id": withdrawal["id"]
+    }
+
 @api_router.post("/withdraw/request")
-async def request_withdraw(withdraw: WithdrawSubmit, current_user: dict = Depends(get_current_user)):
+async def request_withdraw(
+    withdraw: WithdrawSubmit,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
     if withdraw.coins_amount < WITHDRAW_THRESHOLD:
         raise HTTPException(
             status_code=400, 
             detail=f"Minimum para çekme: {WITHDRAW_THRESHOLD} coin. Şu an: {current_user['coins']} coin"
         )
     
-    if current_user["coins"] < withdraw.coins_amount:
-        raise HTTPException(status_code=400, detail="Yetersiz coin")
-    
     usdt_amount = withdraw.coins_amount * USDT_PER_COIN
     
     # Create withdraw request
@@ -483,23 +1225,34 @@ async def request_withdraw(withdraw: WithdrawSubmit, current_user: dict = Depend
         username=current_user["username"],
         coins_amount=withdraw.coins_amount,
         usdt_amount=usdt_amount,
-        wallet_address=withdraw.wallet_address
-    )
-    
-    # Deduct coins
-    await db.users.update_one(
-        {"id": current_user["id"]},
-        {"$inc": {"coins": -withdraw.coins_amount}}
+        wallet_address=withdraw.wallet_address,
+        idempotency_key=idempotency_key
     )
     
-    await db.withdrawals.insert_one(withdraw_req.dict())
+    # Deduct coins first: a failure before the request is recorded can only
+    # leave the user short, never pay out coins that were not taken
+    before = await debit_coins(services.db.users, current_user["id"], withdraw.coins_amount)
+    if before is None:
+        services.session_cache.invalidate(current_user["id"])
+        replay = await find_withdraw_replay(current_user["id"], idempotency_key)
+        if replay is not None:
+            return withdraw_response(replay)
+        raise HTTPException(status_code=400, detail="Yetersiz coin")
     
-    return {
-        "message": "Para çekme talebi oluşturuldu",
-        "coins_amount": withdraw.coins_amount,
-        "usdt_amount": usdt_amount,
-        "withdraw_id": withdraw_req.id
-    }
+    try:
+        await services.db.withdrawals.insert_one(withdraw_req.dict())
+    except Exception as e:
+        # The request was not recorded, give the coins back
+        await credit_coins(services.db.users, current_user["id"], withdraw.coins_amount)
+        services.session_cache.invalidate(current_user["id"])
+        replay = await find_withdraw_replay(current_user["id"], idempotency_key) if isinstance(e, DuplicateKeyError) else None
+        if replay is None:
+            raise
+        return withdraw_response(replay)
+    refresh_cached_balance(current_user["id"], {"coins": before["coins"] - withdraw.coins_amount})
+    services.ledger.record(current_user["id"], -withdraw.coins_amount, WITHDRAW, ref=withdraw_req.id)
+    
+    return withdraw_response(withdraw_req.dict())
 
 @api_router.get("/withdraw/info")
 async def get_withdraw_info(current_user: dict = Depends(get_current_user)):
@@ -513,72 +1266,89 @@ async def get_withdraw_info(current_user: dict = Depends(get_current_user)):
 
 # ============ ADMIN ENDPOINTS ============
 
+ADMIN_PAYMENT_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "username": 1, "tx_hash": 1, "amount_usdt": 1,
+    "item_id": 1, "item_name": 1, "status": 1, "created_at": 1, "verification": 1
+}
+
+ADMIN_WITHDRAWAL_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "username": 1, "coins_amount": 1, "usdt_amount": 1,
+    "wallet_address": 1, "status": 1, "created_at": 1
+}
+
+async def _admin_queue_page(collection, projection: dict, limit: int, cursor: Optional[str]) -> tuple:
+    try:
+        return await keyset_page(collection, {"status": "pending"}, projection, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz cursor")
+
+def _admin_queue_export(collection, projection: dict) -> StreamingResponse:
+    cursor = collection.find({"status": "pending"}, projection).sort(KEYSET_SORT).batch_size(500)
+    return StreamingResponse(stream_ndjson(cursor), media_type="application/x-ndjson")
+
 @api_router.get("/admin/payments")
-async def get_pending_payments(current_user: dict = Depends(get_current_user)):
+async def get_pending_payments(
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     if not current_user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    payments = await db.payments.find({"status": "pending"}).to_list(100)
-    return {"payments": payments}
+    payments, next_cursor = await _admin_queue_page(services.db.payments, ADMIN_PAYMENT_PROJECTION, limit, cursor)
+    return {"payments": payments, "next_cursor": next_cursor}
+
+@api_router.get("/admin/payments/export")
+async def export_pending_payments(current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    return _admin_queue_export(services.db.payments, ADMIN_PAYMENT_PROJECTION)
+
+async def raise_unprocessable(collection, doc_id: str, not_found: str, processed: str) -> None:
+    """Explain why a status transition did not match."""
+    if await collection.find_one({"id": doc_id}, {"_id": 0, "id": 1}) is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    raise HTTPException(status_code=400, detail=processed)
+
+def payment_credited(user_id: str) -> None:
+    services.session_cache.invalidate(user_id)
+    push(user_id, {"type": "refresh"})
 
 @api_router.post("/admin/approve-payment/{payment_id}")
 async def approve_payment(payment_id: str, current_user: dict = Depends(get_current_user)):
     if not current_user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    payment = await db.payments.find_one({"id": payment_id})
-    if not payment:
-        raise HTTPException(status_code=404, detail="Ödeme bulunamadı")
-    
-    if payment["status"] != "pending":
-        raise HTTPException(status_code=400, detail="Bu ödeme zaten işlenmiş")
+    # Claim the payment first; a concurrent approval finds it no longer pending
+    now = datetime.utcnow()
+    try:
+        payment = await transition(services.db.payments, payment_id, "approved", now)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Bu işlem başka bir ödemeyle onaylanmış")
+    if payment is None:
+        await raise_unprocessable(services.db.payments, payment_id, "Ödeme bulunamadı", "Bu ödeme zaten işlenmiş")
     
     # Find item
-    item = next((i for i in SHOP_ITEMS if i.id == payment["item_id"]), None)
-    if not item:
-        raise HTTPException(status_code=404, detail="Item bulunamadı")
-    
-    # Process based on item type
-    user = await db.users.find_one({"id": payment["user_id"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
-    
-    update_data = {}
-    
-    if item.type == "ship":
-        owned_ships = user.get("owned_ships", ["basic"])
-        if item.id not in owned_ships:
-            update_data["$push"] = {"owned_ships": item.id}
-    elif item.type == "boost":
-        # Add boost with expiration
-        duration_minutes = 60 if "1h" in item.id else 30
-        expires_at = (datetime.utcnow() + timedelta(minutes=duration_minutes)).isoformat()
-        boost = {
-            "id": item.id,
-            "name": item.name,
-            "multiplier": item.coin_multiplier,
-            "expires_at": expires_at
-        }
-        update_data["$push"] = {"active_boosts": boost}
-    elif item.type == "coins":
-        # Add coins based on package
-        coins_to_add = 0
-        if item.id == "coins_1000":
-            coins_to_add = 1000
-        elif item.id == "coins_5000":
-            coins_to_add = 5500  # +10% bonus
-        elif item.id == "coins_15000":
-            coins_to_add = 18750  # +25% bonus
-        update_data["$inc"] = {"coins": coins_to_add}
-    
-    if update_data:
-        await db.users.update_one({"id": payment["user_id"]}, update_data)
-    
-    # Update payment status
-    await db.payments.update_one(
-        {"id": payment_id},
-        {"$set": {"status": "approved", "processed_at": datetime.utcnow()}}
-    )
+    item = ITEMS_BY_ID.get(payment["item_id"])
+    user = None
+    if item:
+        # Process based on item type
+        user = await services.db.users.find_one_and_update(
+            {"id": payment["user_id"]}, build_credit_update([item], now),
+            projection=PUSH_CREDIT_PROJECTION, return_document=ReturnDocument.AFTER
+        )
+    if user is None:
+        # Nothing was credited, put the payment back in the queue
+        await services.db.payments.update_one(
+            {"id": payment_id, "status": "approved"},
+            {"$set": {"status": "pending", "processed_at": None}}
+        )
+        raise HTTPException(status_code=404, detail="Item bulunamadı" if item is None else "Kullanıcı bulunamadı")
+    services.session_cache.invalidate(payment["user_id"])
+    push(payment["user_id"], {"type": "credit", **user})
+    if item.id in COIN_PACKAGE_AMOUNTS:
+        services.ledger.record(payment["user_id"], COIN_PACKAGE_AMOUNTS[item.id], PAYMENT, ref=payment_id)
     
     return {"message": "Ödeme onaylandı", "item": item.name}
 
@@ -587,91 +1357,221 @@ async def reject_payment(payment_id: str, current_user: dict = Depends(get_curre
     if not current_user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    await db.payments.update_one(
-        {"id": payment_id},
-        {"$set": {"status": "rejected", "processed_at": datetime.utcnow()}}
-    )
+    if await transition(services.db.payments, payment_id, "rejected", datetime.utcnow()) is None:
+        await raise_unprocessable(services.db.payments, payment_id, "Ödeme bulunamadı", "Bu ödeme zaten işlenmiş")
     
     return {"message": "Ödeme reddedildi"}
 
+@api_router.post("/admin/approve-payments")
+async def approve_payments_batch(batch: BatchIds, current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    results, credited_user_ids = await approve_payments(services.db, services.client, batch.ids, services.ledger)
+    for user_id in credited_user_ids:
+        payment_credited(user_id)
+    
+    return {"results": results, "processed": sum(r["status"] == "approved" for r in results)}
+
+@api_router.post("/admin/reject-payments")
+async def reject_payments_batch(batch: BatchIds, current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    results = await reject_payments(services.db, services.client, batch.ids)
+    return {"results": results, "processed": sum(r["status"] == "rejected" for r in results)}
+
 @api_router.get("/admin/withdrawals")
-async def get_pending_withdrawals(current_user: dict = Depends(get_current_user)):
+async def get_pending_withdrawals(
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     if not current_user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    withdrawals = await db.withdrawals.find({"status": "pending"}).to_list(100)
-    return {"withdrawals": withdrawals}
+    withdrawals, next_cursor = await _admin_queue_page(
+        services.db.withdrawals, ADMIN_WITHDRAWAL_PROJECTION, limit, cursor
+    )
+    return {"withdrawals": withdrawals, "next_cursor": next_cursor}
 
-@api_router.post("/admin/process-withdrawal/{withdrawal_id}")
-async def process_withdrawal(withdrawal_id: str, approve: bool, current_user: dict = Depends(get_current_user)):
+@api_router.get("/admin/withdrawals/export")
+async def export_pending_withdrawals(current_user: dict = Depends(get_current_user)):
     if not current_user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    withdrawal = await db.withdrawals.find_one({"id": withdrawal_id})
-    if not withdrawal:
-        raise HTTPException(status_code=404, detail="Talep bulunamadı")
+    return _admin_queue_export(services.db.withdrawals, ADMIN_WITHDRAWAL_PROJECTION)
+
+async def flagged_withdrawal_ids(withdrawal_ids: list) -> set:
+    """Pending withdrawals whose owner the last offline anti-cheat scan flagged."""
+    pending = await services.db.withdrawals.find(
+        {"id": {"$in": withdrawal_ids}, "status": "pending"}, {"_id": 0, "id": 1, "user_id": 1}
+    ).to_list(None)
+    if not pending:
+        return set()
+    flagged_users = {
+        user["id"] for user in await services.db.users.find(
+            {"id": {"$in": list({w["user_id"] for w in pending})}, "cheat_flagged": True}, {"_id": 0, "id": 1}
+        ).to_list(None)
+    }
+    return {w["id"] for w in pending if w["user_id"] in flagged_users}
+
+@api_router.post("/admin/process-withdrawal/{withdrawal_id}")
+async def process_withdrawal(
+    withdrawal_id: str, approve: bool, force: bool = False, current_user: dict = Depends(get_current_user)
+):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     
-    if withdrawal["status"] != "pending":
-        raise HTTPException(status_code=400, detail="Bu talep zaten işlenmiş")
+    if approve and not force and await flagged_withdrawal_ids([withdrawal_id]):
+        raise HTTPException(status_code=409, detail="Kullanıcı hile şüphesiyle işaretli")
     
     new_status = "approved" if approve else "rejected"
+    withdrawal = await transition(services.db.withdrawals, withdrawal_id, new_status, datetime.utcnow())
+    if withdrawal is None:
+        await raise_unprocessable(
+            services.db.withdrawals, withdrawal_id, "Talep bulunamadı", "Bu talep zaten işlenmiş"
+        )
     
     # If rejected, refund coins
     if not approve:
-        await db.users.update_one(
-            {"id": withdrawal["user_id"]},
-            {"$inc": {"coins": withdrawal["coins_amount"]}}
-        )
-    
-    await db.withdrawals.update_one(
-        {"id": withdrawal_id},
-        {"$set": {"status": new_status, "processed_at": datetime.utcnow()}}
-    )
+        await credit_coins(services.db.users, withdrawal["user_id"], withdrawal["coins_amount"])
+        services.session_cache.invalidate(withdrawal["user_id"])
+        services.ledger.record(withdrawal["user_id"], withdrawal["coins_amount"], REFUND, ref=withdrawal_id)
+        push(withdrawal["user_id"], {
+            "type": "refund", "withdraw_id": withdrawal_id, "coins_amount": withdrawal["coins_amount"]
+        })
     
     return {"message": f"Talep {'onaylandı' if approve else 'reddedildi'}"}
 
+@api_router.get("/admin/session-cache")
+async def get_session_cache_stats(current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    return services.session_cache.stats()
+
+@api_router.get("/admin/password-pool")
+async def get_password_pool_stats(current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    return services.password_hasher.stats()
+
+@api_router.post("/admin/process-withdrawals")
+async def process_withdrawals_batch(
+    batch: BatchIds, approve: bool, force: bool = False, current_user: dict = Depends(get_current_user)
+):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    flagged = await flagged_withdrawal_ids(batch.ids) if approve and not force else set()
+    ids = [withdrawal_id for withdrawal_id in batch.ids if withdrawal_id not in flagged]
+    results, refunded_user_ids = await process_withdrawals(
+        services.db, services.client, ids, approve, services.ledger
+    ) if ids else ([], [])
+    results += [{"id": withdrawal_id, "status": "flagged"} for withdrawal_id in flagged]
+    for user_id in refunded_user_ids:
+        services.session_cache.invalidate(user_id)
+        push(user_id, {"type": "refresh"})
+    
+    new_status = "approved" if approve else "rejected"
+    return {"results": results, "processed": sum(r["status"] == new_status for r in results)}
+
 @api_router.post("/admin/make-admin/{user_email}")
 async def make_admin(user_email: str):
     """One-time endpoint to create admin - should be secured in production"""
-    result = await db.users.update_one(
+    user = await services.db.users.find_one_and_update(
         {"email": user_email},
-        {"$set": {"is_admin": True}}
+        {"$set": {"is_admin": True}},
+        projection={"_id": 0, "id": 1}
     )
-    if result.modified_count == 0:
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    services.session_cache.invalidate(user["id"])
     return {"message": f"{user_email} artık admin"}
 
+# ============ LEDGER ============
+
+@api_router.get("/ledger/history")
+async def get_ledger_history(days: int = Query(30, ge=1, le=365), current_user: dict = Depends(get_current_user)):
+    since = datetime.utcnow() - timedelta(days=days - 1)
+    return {"days": await earnings_history(services.db, current_user["id"], since)}
+
+@api_router.get("/admin/ledger/{user_id}")
+async def get_user_ledger(user_id: str, at: Optional[datetime] = None, current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    at = at or datetime.utcnow()
+    return {"user_id": user_id, "at": at, **await balance_at(services.db, user_id, at)}
+
+@api_router.get("/admin/stats")
+async def get_economy_stats(days: int = Query(30, ge=1, le=365), current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    since = datetime.utcnow() - timedelta(days=days - 1)
+    return await period_stats(services.db, since, USDT_PER_COIN)
+
+@api_router.get("/admin/stats/daily")
+async def get_daily_economy_stats(days: int = Query(30, ge=1, le=365), current_user: dict = Depends(get_current_user)):
+    if not current_user.get("is_admin", False):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    
+    since = datetime.utcnow() - timedelta(days=days - 1)
+    return {"days": await daily_stats(services.db, since, USDT_PER_COIN)}
+
 # ============ LEADERBOARD ============
 
-@api_router.get("/leaderboard")
+@api_router.get("/leaderboard", response_model=LeaderboardResponse)
 async def get_leaderboard():
-    users = await db.users.find(
-        {},
-        {"username": 1, "total_earned": 1, "active_ship": 1}
-    ).sort("total_earned", -1).limit(50).to_list(50)
-    
-    leaderboard = []
-    for i, user in enumerate(users):
-        ship = SHIP_DATA.get(user.get("active_ship", "basic"), SHIP_DATA["basic"])
-        leaderboard.append({
-            "rank": i + 1,
-            "username": user["username"],
-            "total_earned": user["total_earned"],
-            "ship_image": ship["image"]
-        })
+    # The pre-rendered body skips validation; the model documents its shape
+    return Response(content=services.leaderboard.snapshot(), media_type="application/json")
+
+@api_router.get("/leaderboard/me")
+async def get_my_rank(current_user: dict = Depends(get_current_user)):
+    rank = await services.leaderboard.rank(services.db.users, current_user["id"], current_user["total_earned"])
     
-    return {"leaderboard": leaderboard}
+    return {
+        "rank": rank,
+        "username": current_user["username"],
+        "total_earned": current_user["total_earned"]
+    }
 
-# Include router
-app.include_router(api_router)
+# ============ PUSH ============
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Messages: "hello" (current state on connect), "balance" after a game
+# result, "credit" after an approved payment, "refund" for a rejected
+# withdrawal, "leaderboard" when the top list changes, and "refresh" when
+# the client should reload /auth/me itself (bulk admin actions).
+@api_router.websocket("/ws")
+async def push_updates(websocket: WebSocket, token: Optional[str] = None):
+    # Browsers cannot set headers on a WebSocket, so the JWT may also come as ?token=
+    user_id = decode_user_id(token) if token else token_user_id(websocket)
+    user = await load_session_user(user_id) if user_id else None
+    if user is None:
+        await websocket.close(code=POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    
+    connection = services.push_hub.connect(user_id, greeting={
+        "type": "hello",
+        "coins": user["coins"],
+        "total_earned": user["total_earned"],
+        "active_ship": user.get("active_ship", "basic"),
+        "owned_ships": user.get("owned_ships", ["basic"]),
+        "active_boosts": user.get("active_boosts", []),
+        "rank": await services.leaderboard.rank(services.db.users, user_id, user["total_earned"]),
+    })
+    await services.push_hub.serve(websocket, connection)
+
+# ============ METRICS ============
+
+async def get_metrics():
+    return PlainTextResponse(services.metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# ============ APP ============
 
 logging.basicConfig(
     level=logging.INFO,
@@ -679,6 +1579,102 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def liveness():
+    return {"status": "ok"}
+
+async def readiness(request: Request):
+    if not request.app.state.ready:
+        return ORJSONResponse({"status": "starting"}, status_code=503)
+    try:
+        await asyncio.wait_for(services.db.command("ping"), 2)
+    except Exception:
+        return ORJSONResponse({"status": "mongo unavailable"}, status_code=503)
+    return {"status": "ready"}
+
+async def prime_caches() -> None:
+    """Do the lazy first-request work up front: bcrypt, JWT and the leaderboard body."""
+    await services.leaderboard.seed(services.db.users)
+    services.leaderboard.snapshot()
+    # Loads the bcrypt backend and starts a hashing thread
+    await services.password_hasher.hash(uuid.uuid4().hex)
+    decode_user_id(create_access_token({"user_id": "warm-up"}))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if services.slow_request_profiler is not None:
+        services.slow_request_profiler.start()
+    services.connect_mongo()
+    await warm_mongo_pool(MONGO_WARM_CONNECTIONS)
+    await ensure_indexes(services.db)
+    await services.coordinator.start()
+    await prime_caches()
+    services.push_hub.start(services.leaderboard)
+    services.boost_sweeper.start(services.db.users)
+    services.ledger.start(services.db.ledger)
+    services.game_result_log.start(services.db.game_results)
+    services.ledger_compactor.start(services.db)
+    services.analytics_rollup.start(services.db)
+    services.referral_stats.start(services.db.users)
+    if services.game_result_ingestor is not None:
+        services.game_result_ingestor.start(services.db.users)
+    if services.payment_verifier is not None:
+        services.payment_verifier.start(services.db, services.client, services.ledger)
+    app.state.ready = True
+    
+    yield
+    
+    app.state.ready = False
+    await services.push_hub.stop()
+    await services.boost_sweeper.stop()
+    if services.payment_verifier is not None:
+        await services.payment_verifier.stop()
+    await services.ledger_compactor.stop()
+    await services.analytics_rollup.stop()
+    if services.game_result_ingestor is not None:
+        await services.game_result_ingestor.stop()
+    await services.ledger.stop()
+    await services.game_result_log.stop()
+    await services.referral_stats.stop()
+    await services.coordinator.stop()
+    if services.client is not None:
+        services.client.close()
+    services.password_hasher.shutdown()
+    if services.slow_request_profiler is not None:
+        services.slow_request_profiler.stop()
+
+def create_app() -> FastAPI:
+    """A new API application with its own AppServices in ``app.state.services``.
+
+    Mongo and the background tasks start with its lifespan; /readyz answers
+    503 until the pool is warm and the caches are primed.
+    """
+    app_services = AppServices()
+    app = FastAPI(title="Cosmic Miner API", default_response_class=ORJSONResponse, lifespan=lifespan)
+    app.state.ready = False
+    app.state.services = app_services
+    app.include_router(api_router)
+    app.add_api_route("/metrics", get_metrics, include_in_schema=False)
+    app.add_api_route("/healthz", liveness, include_in_schema=False)
+    app.add_api_route("/readyz", readiness, include_in_schema=False)
+    
+    app.add_middleware(
+        MetricsMiddleware, registry=app_services.metrics_registry, profiler=app_services.slow_request_profiler
+    )
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # Outermost, so everything below runs with this app's services
+    app.add_middleware(ServicesMiddleware, app_services=app_services)
+    return app
+
+def __getattr__(name: str):
+    # ``server:app`` is built on first access rather than on import
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
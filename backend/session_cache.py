@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Fields handlers actually read from ``current_user``; password_hash and _id stay in Mongo.
+USER_SESSION_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "email": 1,
+    "username": 1,
+    "coins": 1,
+    "total_earned": 1,
+    "ship_level": 1,
+    "owned_ships": 1,
+    "active_ship": 1,
+    "ship_changes": 1,
+    "active_boosts": 1,
+    "boost_multiplier": 1,
+    "boost_until": 1,
+    "is_admin": 1,
+    "referral_code": 1,
+    "referred_by": 1,
+    "referral_count": 1,
+    "referral_bonus_earned": 1,
+    "referral_network_earned": 1,
+}
+
+
+class UserSessionCache:
+    """In-process LRU cache of user projections with a per-entry TTL.
+
+    ``on_change(user_id)`` is called after every ``update``/``invalidate`` so
+    other workers can drop their copy; ``discard`` is the local-only variant
+    they apply it with.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 30.0,
+                 on_change: Optional[Callable[[str], None]] = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.on_change = on_change
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def put(self, user_id: str, user: dict) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, user_id: str, fields: dict) -> None:
+        """Merge freshly written fields into a cached entry, keeping its TTL."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1].update(fields)
+        if self.on_change is not None:
+            self.on_change(user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+        if self.on_change is not None:
+            self.on_change(user_id)
+
+    def discard(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
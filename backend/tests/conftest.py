@@ -0,0 +1,89 @@
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["cosmic_miner_test"]
+
+
+class RecordingLedger:
+    """Stands in for LedgerWriter; keeps what would have been written."""
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, user_id, coins, kind, earned=0, ref=None):
+        self.entries.append((user_id, coins, kind, earned, ref))
+
+    def stats(self):
+        return {"queued": 0}
+
+
+@pytest.fixture
+def ledger():
+    return RecordingLedger()
+
+
+class RecordingLog:
+    """Stands in for the game_results BatchInserter."""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+
+    def stats(self):
+        return {"queued": 0}
+
+
+@pytest.fixture
+def app(db, ledger):
+    """An app on the test database, with in-process rate limits and recorders for its write-behind logs."""
+    import server
+    from coordination import create_coordinator
+    from rate_limit import RateLimiter
+
+    app = server.create_app()
+    services = app.state.services
+    services.client = db.client
+    services.db = db
+    services.ledger = ledger
+    services.game_result_log = RecordingLog()
+    services.rate_limiter = RateLimiter(create_coordinator(None))
+    return app
+
+
+@pytest.fixture
+def api(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.fixture
+def add_player(db):
+    """Insert a user and return the auth headers of their token."""
+    import server
+
+    async def add(user_id="u1", **fields):
+        await db.users.insert_one({
+            "id": user_id, "email": f"{user_id}@example.com", "username": user_id, "coins": 100,
+            "total_earned": 0, "owned_ships": ["basic"], "active_ship": "basic", "active_boosts": [],
+            "is_admin": False, **fields,
+        })
+        return {"Authorization": f"Bearer {server.create_access_token({'user_id': user_id})}"}
+
+    return add
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import ROLLUP_LAG, rollup
+from ledger import DAY, GAME, OPENING, PURCHASE, day_start
+
+pytestmark = pytest.mark.anyio
+
+DAY_ONE = datetime(2024, 3, 1)
+
+
+def entry(kind, coins, at, earned=0, user_id="u1"):
+    return {"u": user_id, "d": coins, "e": earned, "k": kind, "t": at}
+
+
+async def test_rerunning_the_rollup_never_counts_a_slice_twice(db):
+    await db.ledger.insert_many([
+        entry(OPENING, 100, DAY_ONE),
+        entry(GAME, 50, DAY_ONE + timedelta(hours=1), earned=50),
+        entry(PURCHASE, -30, DAY_ONE + DAY + timedelta(hours=2)),
+    ])
+    now = DAY_ONE + DAY + timedelta(hours=3)
+
+    assert await rollup(db, now) == 2
+    assert await rollup(db, now) == 0
+    # Recorded before the watermark moved past it, so it counts exactly once
+    await db.ledger.insert_one(entry(GAME, 20, now - ROLLUP_LAG + timedelta(minutes=1), earned=20))
+    assert await rollup(db, now + timedelta(hours=1)) == 1
+    assert await rollup(db, now + timedelta(hours=1)) == 0
+
+    first, second = await db.analytics_daily.find({}).sort("_id", 1).to_list(None)
+    assert (first["_id"], first["until"]) == (DAY_ONE, DAY_ONE + DAY)
+    assert (first["coins"], first["earned"], first["outstanding_coins"]) == ({OPENING: 100, GAME: 50}, 50, 150)
+    assert second["coins"] == {PURCHASE: -30, GAME: 20}
+    assert (second["net_coins"], second["outstanding_coins"]) == (-10, 140)
+    assert second["until"] == now + timedelta(hours=1) - ROLLUP_LAG
+
+
+async def test_pending_withdrawals_carry_over_until_processed(db):
+    await db.withdrawals.insert_many([
+        {"id": "w1", "usdt_amount": 5.0, "status": "approved", "created_at": DAY_ONE + timedelta(hours=1),
+         "processed_at": DAY_ONE + DAY + timedelta(hours=1)},
+        {"id": "w2", "usdt_amount": 2.0, "status": "pending", "created_at": DAY_ONE + timedelta(hours=2)},
+    ])
+    await db.payments.insert_one({"id": "p1", "status": "approved", "amount_usdt": 10.0,
+                                  "created_at": DAY_ONE, "processed_at": DAY_ONE + timedelta(hours=3)})
+
+    await rollup(db, DAY_ONE + 2 * DAY + timedelta(hours=1))
+
+    days = await db.analytics_daily.find({}).sort("_id", 1).to_list(None)
+    assert [day["pending_withdrawal_usdt"] for day in days] == [7.0, 2.0, 2.0]
+    assert [day.get("withdrawals_approved_usdt") for day in days] == [0, 5.0, 0]
+    assert (days[0]["payments_approved"], days[0]["revenue_usdt"]) == (1, 10.0)
+
+
+async def test_rollup_without_activity_writes_nothing(db):
+    assert await rollup(db, DAY_ONE) == 0
+    assert await db.analytics_daily.count_documents({}) == 0
+
+
+async def test_admin_stats_sum_the_rolled_up_days(api, db, add_player):
+    admin = await add_player("admin", is_admin=True)
+    player = await add_player("u1")
+    today = day_start(datetime.utcnow())
+    await db.ledger.insert_many([
+        entry(OPENING, 1000, today - DAY),
+        entry(GAME, 500, today - DAY + timedelta(hours=1), earned=500),
+        entry(PURCHASE, -200, today - DAY + timedelta(hours=2)),
+    ])
+    await rollup(db, today + timedelta(minutes=10))
+
+    async with api:
+        assert (await api.get("/api/admin/stats", headers=player)).status_code == 403
+        stats = (await api.get("/api/admin/stats?days=2", headers=admin)).json()
+        daily = (await api.get("/api/admin/stats/daily?days=2", headers=admin)).json()["days"]
+
+    assert (stats["days"], stats["coins_minted"], stats["coins_spent"], stats["net_coins"]) == (2, 500, 200, 1300)
+    assert (stats["outstanding_coins"], stats["liability_usdt"]) == (1300, 1.3)
+    assert [day["coins_minted"] for day in daily] == [500, 0]
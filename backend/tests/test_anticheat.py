@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from anticheat import (
+    COINS_PER_CRYSTAL, CRYSTAL_DENSITY, OUTLIER, Bounds, PlausibilityChecker, bounds_from_env, scan, score_results,
+)
+
+
+def client_payload(score: int, distance: int = 0) -> dict:
+    # What frontend/index.js posts at the end of a game: 10 points per crystal
+    return {"coins": score, "distance": distance, "crystals": score // 10}
+
+
+def test_client_payload_without_distance_is_accepted():
+    checker = PlausibilityChecker(Bounds())
+    for score in (60, 300, 1200):
+        assert checker.check("u1", **client_payload(score)) == []
+    assert checker.stats()["rejected"] == 0
+
+
+def test_crystal_density_is_checked_when_distance_is_reported():
+    checker = PlausibilityChecker(Bounds())
+    # 40 distance per second of play, as the app reports it
+    assert checker.check("u1", **client_payload(300, distance=40 * 30)) == []
+    assert checker.check("u2", **client_payload(300, distance=40)) == [CRYSTAL_DENSITY]
+    assert checker.check("u3", coins=300, distance=0, crystals=6) == [COINS_PER_CRYSTAL]
+
+
+def test_bounds_are_read_from_the_environment():
+    bounds = bounds_from_env({"ANTICHEAT_MAX_COINS_PER_CRYSTAL": "5", "ANTICHEAT_OUTLIER_Z": "2.5"})
+    assert (bounds.max_coins_per_crystal, bounds.outlier_z, bounds.max_speed) == (5.0, 2.5, 50.0)
+    checker = PlausibilityChecker(bounds)
+    assert checker.check("u1", coins=60, distance=0, crystals=6) == [COINS_PER_CRYSTAL]
+    assert checker.check("u1", coins=-10, distance=0, crystals=0) == [COINS_PER_CRYSTAL]
+
+
+def test_outliers_are_flagged_only_after_enough_history():
+    checker = PlausibilityChecker(Bounds(min_history=4))
+    for _ in range(3):
+        checker.check("new", **client_payload(100))
+        checker.check("u1", **client_payload(100))
+    assert checker.check("new", **client_payload(2000)) == []
+    checker.check("u1", **client_payload(100))
+    assert checker.check("u1", **client_payload(2000)) == [OUTLIER]
+    # A good run within the spread floor is not an outlier
+    assert checker.check("u1", **client_payload(400)) == []
+    assert checker.stats()["outliers"] == 1
+
+
+def test_windows_of_least_recent_users_are_evicted():
+    checker = PlausibilityChecker(Bounds(min_history=2), max_users=2)
+    for user in ("a", "b", "a", "c"):
+        checker.check(user, **client_payload(100))
+    assert list(checker._windows) == ["a", "c"]
+    # "b" starts over, so its big score is not compared with anything
+    checker.check("b", **client_payload(100))
+    assert checker.check("b", **client_payload(5000)) == []
+    assert checker.stats()["users"] == 2
+
+
+def test_score_results_does_not_flag_client_payloads():
+    games = [client_payload(score) for score in (60, 80, 70, 90, 60, 100, 80, 70, 60, 90)]
+    [user] = score_results(
+        ["u1"] * len(games),
+        ["basic"] * len(games),
+        [game["coins"] for game in games],
+        [game["distance"] for game in games],
+        [game["crystals"] for game in games],
+        [i * 300.0 for i in range(len(games))],
+        Bounds(),
+    )
+    assert (user["hard"], user["outliers"], user["flagged"]) == (0, 0, False)
+
+
+def test_back_to_back_results_are_only_speed_checked_offline():
+    checker = PlausibilityChecker(Bounds())
+    # The online check keeps no timing, so two 60s games a second apart both pass
+    assert checker.check("u1", **client_payload(300, distance=40 * 60)) == []
+    assert checker.check("u1", **client_payload(300, distance=40 * 60)) == []
+
+    [user] = score_results(["u1", "u1"], ["basic", "basic"], [300, 300], [2400, 2400], [30, 30], [0.0, 1.0], Bounds())
+    assert (user["hard"], user["flagged"]) == (1, True)
+    [user] = score_results(["u1", "u1"], ["basic", "basic"], [300, 300], [2400, 2400], [30, 30], [0.0, 61.0], Bounds())
+    assert (user["hard"], user["flagged"]) == (0, False)
+
+
+@pytest.mark.anyio
+async def test_scan_flags_speed_from_stored_results(db):
+    start = datetime(2026, 1, 1)
+    await db.users.insert_many([{"id": "fast"}, {"id": "fair"}])
+    await db.game_results.insert_many([
+        {"u": user, "s": "basic", "c": 300, "x": 2400, "n": 30, "p": 300, "t": start + timedelta(seconds=at)}
+        for user, gap in (("fast", 5), ("fair", 90))
+        for at in (0, gap, 2 * gap)
+    ])
+
+    scored = {user["user_id"]: user for user in await scan(db, Bounds())}
+
+    assert (scored["fast"]["hard"], scored["fast"]["flagged"]) == (2, True)
+    assert (scored["fair"]["hard"], scored["fair"]["flagged"]) == (0, False)
+    flags = {user["id"]: user["cheat_flagged"] async for user in db.users.find({}, {"_id": 0})}
+    assert flags == {"fast": True, "fair": False}
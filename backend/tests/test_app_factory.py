@@ -0,0 +1,33 @@
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def client_for(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def test_apps_built_by_the_factory_do_not_share_state():
+    first, second = server.create_app(), server.create_app()
+    first.state.services.db = AsyncMongoMockClient()["first"]
+    second.state.services.db = AsyncMongoMockClient()["second"]
+    assert first.state.services.session_cache is not second.state.services.session_cache
+
+    register = {"email": "pilot@example.com", "username": "pilot", "password": "secret123"}
+    async with client_for(first) as client:
+        assert (await client.post("/api/auth/register", json=register)).status_code == 200
+    async with client_for(second) as client:
+        assert (await client.post("/api/auth/register", json=register)).status_code == 200
+
+    assert await first.state.services.db.users.count_documents({}) == 1
+    assert await second.state.services.db.users.count_documents({}) == 1
+    assert first.state.services.metrics_registry is not second.state.services.metrics_registry
+
+
+def test_leaderboard_schema_lists_the_entries():
+    schema = server.create_app().openapi()["components"]["schemas"]["LeaderboardResponse"]
+    assert schema["required"] == ["leaderboard"]
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from background import PeriodicTask, WriteBehindQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class Ticks(PeriodicTask):
+    description = "Test task"
+
+    def __init__(self, outcomes):
+        super().__init__(interval=60)
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.done = asyncio.Event()
+
+    async def tick(self, *args):
+        self.calls.append(args)
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if not self.outcomes:
+            self.done.set()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+async def test_a_tick_asking_for_more_runs_again_without_waiting():
+    task = Ticks([True, True, None])
+    task.start("db")
+    await asyncio.wait_for(task.done.wait(), 1)
+    await task.stop()
+    assert task.calls == [("db",)] * 3
+
+
+async def test_a_failing_tick_waits_for_the_next_interval(caplog):
+    task = Ticks([RuntimeError("down"), None])
+    task.interval = 0
+    task.start()
+    await asyncio.wait_for(task.done.wait(), 1)
+    await task.stop()
+    assert len(task.calls) >= 2
+    assert "Test task failed" in caplog.text
+
+
+class Recorder(WriteBehindQueue):
+    def __init__(self):
+        super().__init__(flush_interval=60, max_batch=2)
+        self.batches = []
+
+    async def _flush(self, batch):
+        self.batches.append(batch)
+
+
+async def test_write_behind_queue_flushes_full_batches_and_the_rest_on_stop():
+    queue = Recorder()
+    queue.start(None)
+    for item in range(5):
+        queue._enqueue(item)
+    # A full batch wakes the task before the flush interval
+    for _ in range(100):
+        if queue.batches:
+            break
+        await asyncio.sleep(0)
+    assert queue.batches == [[0, 1], [2, 3]]
+    await queue.stop()
+    assert queue.batches == [[0, 1], [2, 3], [4]]
+
+
+class SlowRecorder(Recorder):
+    """Items keep arriving while each batch is written."""
+
+    def __init__(self, arrivals):
+        super().__init__()
+        self.arrivals = arrivals
+
+    async def _flush(self, batch):
+        await asyncio.sleep(0)
+        for _ in range(3):
+            if self.arrivals:
+                self._enqueue(self.arrivals.pop(0))
+        await super()._flush(batch)
+
+
+async def test_a_backlogged_queue_drains_without_waiting_for_the_interval():
+    queue = SlowRecorder(list(range(2, 30)))
+    queue.start(None)
+    queue._enqueue(0)
+    queue._enqueue(1)
+    # Three items arrive per flush of two; only the last partial batch waits for the interval
+    for _ in range(1000):
+        if not queue.arrivals and queue._queue.qsize() < queue.max_batch:
+            break
+        await asyncio.sleep(0)
+    assert queue._queue.qsize() < queue.max_batch
+    assert sum(len(batch) for batch in queue.batches) >= 28
+    await queue.stop()
+    assert [item for batch in queue.batches for item in batch] == list(range(30))
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from balances import claim, credit_coins, debit_coins, transition
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_debits_never_overdraw(db):
+    await db.users.insert_one({"id": "u1", "coins": 250, "owned_ships": ["basic"]})
+
+    results = await asyncio.gather(*(debit_coins(db.users, "u1", 100) for _ in range(5)))
+
+    assert [r["coins"] for r in results if r is not None] in ([250, 150], [150, 250])
+    assert results.count(None) == 3
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 50
+
+
+async def test_debit_checks_the_extra_filter_with_the_balance(db):
+    await db.users.insert_one({"id": "u1", "coins": 500, "owned_ships": ["basic"]})
+    buy_ship = {
+        "extra_filter": {"owned_ships": {"$ne": "ship_gold"}},
+        "extra_update": {"$push": {"owned_ships": "ship_gold"}},
+    }
+
+    assert await debit_coins(db.users, "u1", 200, **buy_ship) is not None
+    assert await debit_coins(db.users, "u1", 200, **buy_ship) is None
+    assert await debit_coins(db.users, "missing", 1) is None
+
+    user = await db.users.find_one({"id": "u1"})
+    assert (user["coins"], user["owned_ships"]) == (300, ["basic", "ship_gold"])
+    assert await credit_coins(db.users, "u1", 25)
+    assert not await credit_coins(db.users, "missing", 25)
+
+
+async def test_a_status_moves_once(db):
+    now = datetime.utcnow()
+    await db.withdrawals.insert_one({"id": "w1", "status": "pending"})
+
+    first, second = await asyncio.gather(
+        transition(db.withdrawals, "w1", "approved", now),
+        transition(db.withdrawals, "w1", "rejected", now),
+    )
+
+    assert [first, second].count(None) == 1
+    assert (await db.withdrawals.find_one({"id": "w1"}))["status"] in ("approved", "rejected")
+
+
+async def test_concurrent_claims_split_the_documents(db):
+    now = datetime.utcnow()
+    await db.payments.insert_many([{"id": f"p{i}", "status": "pending"} for i in range(4)])
+    await db.payments.update_one({"id": "p3"}, {"$set": {"status": "rejected"}})
+
+    first, second = await asyncio.gather(
+        claim(db.payments, ["p0", "p1", "p3"], "approved", now),
+        claim(db.payments, ["p1", "p2"], "rejected", now),
+    )
+
+    claimed = [p["id"] for p in first] + [p["id"] for p in second]
+    assert sorted(claimed) == ["p0", "p1", "p2"]
+    assert await claim(db.payments, [], "approved", now) == []
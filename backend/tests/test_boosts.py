@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from boosts import BoostSweeper, boost_multiplier_at, effective_boost
+
+pytestmark = pytest.mark.anyio
+
+
+def boost(multiplier, activated_at, expires_at):
+    return {
+        "id": f"boost_{multiplier}x", "multiplier": multiplier, "activated_at": activated_at, "expires_at": expires_at,
+    }
+
+
+async def test_the_sweeper_prunes_expired_boosts_and_recomputes_the_summary(db):
+    now = datetime.utcnow()
+    hour = timedelta(hours=1)
+    await db.users.insert_many([
+        # One of two boosts ran out
+        {"id": "mixed", "active_boosts": [boost(2.0, now - 2 * hour, now - hour), boost(5.0, now - hour, now + hour)],
+         "boost_multiplier": 10.0, "boost_until": now - hour},
+        {"id": "expired", "active_boosts": [boost(2.0, now - 2 * hour, now - hour)],
+         "boost_multiplier": 2.0, "boost_until": now - hour},
+        {"id": "running", "active_boosts": [boost(3.0, now, now + hour)],
+         "boost_multiplier": 3.0, "boost_until": now + hour},
+        # Written before the summary fields, with ISO string expiries
+        {"id": "legacy", "active_boosts": [boost(2.0, None, (now + 2 * hour).isoformat())]},
+    ])
+    swept = []
+    sweeper = BoostSweeper(on_swept=swept.extend)
+
+    await sweeper.tick(db.users)
+
+    users = {u["id"]: u async for u in db.users.find({}, {"_id": 0})}
+    def summary(user_id):
+        user = users[user_id]
+        return [b["multiplier"] for b in user["active_boosts"]], user["boost_multiplier"]
+
+    assert summary("mixed") == ([5.0], 5.0)
+    assert abs(users["mixed"]["boost_until"] - (now + hour)) < timedelta(milliseconds=1)
+    assert (summary("expired"), users["expired"]["boost_until"]) == (([], 1.0), None)
+    assert summary("running") == ([3.0], 3.0)
+    assert summary("legacy") == ([2.0], 2.0)
+    assert isinstance(users["legacy"]["active_boosts"][0]["expires_at"], datetime)
+    assert sorted(swept) == ["expired", "legacy", "mixed"]
+    # Nothing is left for the next pass
+    assert await sweeper.sweep(db.users, {"boost_until": {"$lte": datetime.utcnow()}}) == 0
+
+
+def test_effective_boost_repairs_a_stale_summary():
+    now = datetime(2026, 1, 1, 12)
+    running = boost(2.0, now - timedelta(minutes=10), now + timedelta(minutes=10))
+    ended = boost(5.0, now - timedelta(hours=1), now - timedelta(minutes=1))
+
+    assert effective_boost({"boost_multiplier": 10.0, "boost_until": now + timedelta(minutes=1)}, now) == (10.0, None)
+    multiplier, refresh = effective_boost({"active_boosts": [running, ended], "boost_until": now}, now)
+    assert (multiplier, refresh["active_boosts"], refresh["boost_until"]) == (2.0, [running], running["expires_at"])
+    assert effective_boost({"active_boosts": []}, now) == (1.0, None)
+
+
+def test_boost_multiplier_at_uses_the_boosts_running_at_that_time():
+    now = datetime(2026, 1, 1, 12)
+    end = now + timedelta(hours=1)
+    boosts = [boost(2.0, now, end), boost(5.0, now + timedelta(minutes=30), end)]
+    assert boost_multiplier_at(boosts, now - timedelta(minutes=1)) == 1.0
+    assert boost_multiplier_at(boosts, now + timedelta(minutes=10)) == 2.0
+    assert boost_multiplier_at(boosts, now + timedelta(minutes=45)) == 10.0
+    assert boost_multiplier_at(boosts, now + timedelta(hours=1)) == 1.0
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from catalog import (
+    BASIC_SHIP, BOOST_DURATION_MINUTES, COIN_PACKAGE_AMOUNTS, ITEMS_BY_ID, SHIP_DATA, SHOP_ITEMS, etag_matches,
+    render_shop_body,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_every_item_the_shop_sells_can_be_credited():
+    assert BASIC_SHIP.id not in ITEMS_BY_ID and BASIC_SHIP.id in SHIP_DATA
+    for item in SHOP_ITEMS:
+        assert ITEMS_BY_ID[item.id] is item
+        assert (item.price_coins is None) != (item.price_usdt is None)
+        if item.type == "ship":
+            assert SHIP_DATA[item.id]["multiplier"] == item.coin_multiplier
+        elif item.type == "boost":
+            assert item.id in BOOST_DURATION_MINUTES
+        elif item.type == "coins":
+            assert item.id in COIN_PACKAGE_AMOUNTS
+
+
+def test_the_shop_body_and_its_etag_are_stable():
+    body, etag = render_shop_body("TAddress")
+    assert render_shop_body("TAddress") == (body, etag)
+    assert render_shop_body("TOther")[1] != etag
+    decoded = json.loads(body)
+    assert decoded["trc20_address"] == "TAddress"
+    assert [item["id"] for item in decoded["items"]] == [item.id for item in SHOP_ITEMS]
+
+
+def test_etag_matching_follows_if_none_match():
+    assert etag_matches(None, '"a"') is False
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+
+
+async def test_shop_items_answers_a_matching_etag_with_304(api):
+    async with api:
+        first = await api.get("/api/shop/items")
+        again = await api.get("/api/shop/items", headers={"If-None-Match": first.headers["etag"]})
+
+    assert first.status_code == 200
+    assert len(first.json()["items"]) == len(SHOP_ITEMS)
+    assert (again.status_code, again.content) == (304, b"")
+    assert again.headers["etag"] == first.headers["etag"]
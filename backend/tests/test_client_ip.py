@@ -0,0 +1,33 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def whoami(request):
+    return PlainTextResponse(server.client_ip(request))
+
+
+def client_from(peer: str) -> httpx.AsyncClient:
+    # What serve.py configures: X-Forwarded-For is only trusted from the load balancer
+    app = ProxyHeadersMiddleware(Starlette(routes=[Route("/", whoami)]), trusted_hosts="10.0.0.1")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(peer, 1234)), base_url="http://test")
+
+
+async def test_client_ip_is_the_forwarded_address_behind_a_trusted_proxy():
+    async with client_from("10.0.0.1") as client:
+        first = await client.get("/", headers={"X-Forwarded-For": "203.0.113.7"})
+        second = await client.get("/", headers={"X-Forwarded-For": "198.51.100.2"})
+    assert (first.text, second.text) == ("203.0.113.7", "198.51.100.2")
+
+
+async def test_client_ip_ignores_forwarded_for_from_other_peers():
+    async with client_from("192.0.2.50") as client:
+        response = await client.get("/", headers={"X-Forwarded-For": "203.0.113.7"})
+    assert response.text == "192.0.2.50"
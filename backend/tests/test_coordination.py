@@ -0,0 +1,64 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from coordination import InMemoryCoordinator, RedisCoordinator
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+def worker(redis_server) -> RedisCoordinator:
+    return RedisCoordinator(client=fakeredis.FakeAsyncRedis(server=redis_server), flush_interval=0)
+
+
+async def wait_for(condition, timeout=2.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def test_peers_receive_messages_and_the_publisher_does_not(redis_server):
+    first, second = worker(redis_server), worker(redis_server)
+    received = {"first": [], "second": []}
+    first.subscribe("session", received["first"].append)
+    second.subscribe("session", received["second"].append)
+    await first.start()
+    await second.start()
+    try:
+        first.publish("session", "u1")
+        first.publish("session", ["u2", {"coins": 5}])
+        await wait_for(lambda: len(received["second"]) == 2)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert received == {"first": [], "second": ["u1", ["u2", {"coins": 5}]]}
+    assert (first.published, second.received) == (2, 2)
+
+
+async def test_token_buckets_are_shared_between_workers(redis_server):
+    first, second = worker(redis_server), worker(redis_server)
+    try:
+        assert (await first.take_token("login:1.2.3.4", rate=1, burst=2))[0]
+        assert (await second.take_token("login:1.2.3.4", rate=1, burst=2))[0]
+        allowed, retry_after = await first.take_token("login:1.2.3.4", rate=1, burst=2)
+        assert not allowed and 0 < retry_after <= 1
+        assert (await second.take_token("login:5.6.7.8", rate=1, burst=2))[0]
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+async def test_in_memory_buckets_refill_at_the_rate():
+    coordinator = InMemoryCoordinator()
+    assert (await coordinator.take_token("k", rate=1000, burst=1))[0]
+    assert not (await coordinator.take_token("k", rate=1000, burst=1))[0]
+    await asyncio.sleep(0.01)
+    assert (await coordinator.take_token("k", rate=1000, burst=1))[0]
@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def game(result_id, played_at, coins=50):
+    return {
+        "id": result_id, "coins_earned": coins, "distance": 0, "crystals_collected": coins // 10,
+        "played_at": played_at.isoformat(),
+    }
+
+
+async def test_batch_is_settled_in_play_order_with_the_boost_of_the_time(app, api, db, ledger, add_player):
+    now = datetime.utcnow().replace(microsecond=0)
+    boost = {
+        "id": "boost_2x_1h", "name": "2x", "multiplier": 2.0,
+        "activated_at": now - timedelta(minutes=30), "expires_at": now + timedelta(minutes=30),
+    }
+    headers = await add_player(active_boosts=[boost], boost_multiplier=2.0, boost_until=boost["expires_at"])
+    batch = [game("late", now - timedelta(minutes=5)), game("early", now - timedelta(hours=2)),
+             game("cheat", now - timedelta(hours=1), coins=500) | {"crystals_collected": 5}]
+
+    async with api:
+        response = await api.post("/api/game/results:batch", json={"results": batch}, headers=headers)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(r["id"], r["status"], r["coins_earned"]) for r in body["results"]] == [
+        ("late", "credited", 100), ("early", "credited", 50), ("cheat", "rejected", 0)
+    ]
+    assert (body["coins_earned"], body["total_coins"], body["total_earned"]) == (150, 250, 150)
+    logged = app.state.services.game_result_log.entries
+    assert [entry["t"] for entry in logged] == sorted(entry["t"] for entry in logged)
+    assert [entry[4] for entry in ledger.entries] == ["early", "late"]
+    user = await db.users.find_one({"id": "u1"})
+    assert (user["coins"], user["game_result_ids"]) == (250, ["early", "cheat", "late"])
+
+
+async def test_retried_batches_are_credited_once(api, db, ledger, add_player):
+    now = datetime.utcnow()
+    headers = await add_player()
+    batch = {"results": [game("a", now - timedelta(minutes=2)), game("b", now - timedelta(minutes=1))]}
+
+    async with api:
+        first, second = await asyncio.gather(
+            api.post("/api/game/results:batch", json=batch, headers=headers),
+            api.post("/api/game/results:batch", json=batch, headers=headers),
+        )
+        partial = await api.post("/api/game/results:batch", headers=headers, json={
+            "results": [game("b", now - timedelta(minutes=1)), game("c", now)]
+        })
+
+    assert (first.status_code, second.status_code, partial.status_code) == (200, 200, 200)
+    assert sorted([first.json()["coins_earned"], second.json()["coins_earned"]]) == [0, 100]
+    assert [r["status"] for r in partial.json()["results"]] == ["duplicate", "credited"]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 250
+    assert sorted(entry[4] for entry in ledger.entries) == ["a", "b", "c"]
+
+
+async def test_rate_limited_batch_is_refused_before_reading_the_user(app, api, db, monkeypatch, add_player):
+    now = datetime.utcnow()
+    headers = await add_player()
+    monkeypatch.setattr(server, "GAME_RESULT_RATE_LIMIT", (0.001, 2))
+    batch = {"results": [game(f"g{i}", now) for i in range(3)]}
+
+    async with api:
+        assert (await api.post("/api/game/results:batch", json=batch, headers=headers)).status_code == 200
+
+        class Unreachable:
+            def __getattr__(self, name):
+                raise AssertionError(f"db.{name} used by a rate limited request")
+
+        app.state.services.session_cache.clear()
+        app.state.services.db = Unreachable()
+        response = await api.post("/api/game/results:batch", json=batch, headers=headers)
+
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+
+async def test_each_result_is_priced_with_the_ship_it_was_played_with(app, api, db, add_player):
+    now = datetime.utcnow()
+    headers = await add_player(owned_ships=["basic", "ship_gold"])
+    batch = {"results": [game("before", now - timedelta(minutes=5)), game("stale", now - timedelta(days=30))]}
+
+    async with api:
+        assert (await api.post("/api/game/select-ship/ship_gold", headers=headers)).status_code == 200
+        batch["results"].append(game("after", datetime.utcnow()))
+        response = await api.post("/api/game/results:batch", json=batch, headers=headers)
+
+    assert [(r["id"], r["status"], r["coins_earned"]) for r in response.json()["results"]] == [
+        ("before", "credited", 50), ("stale", "rejected", 0), ("after", "credited", 100)
+    ]
+    assert [(e["s"], e["p"]) for e in app.state.services.game_result_log.entries] == [("basic", 50), ("ship_gold", 100)]
+    assert (await db.users.find_one({"id": "u1"}))["game_result_ids"] == ["before", "after"]
+
+
+def test_ship_at_falls_back_to_the_basic_ship_before_dropped_changes():
+    start = datetime(2026, 1, 1)
+    changes = [{"ship": "ship_gold", "from": "ship_silver", "at": start}]
+    assert server.ship_at({"active_ship": "ship_gold"}, start) == "ship_gold"
+    assert server.ship_at({"ship_changes": changes}, start - timedelta(seconds=1)) == "ship_silver"
+    assert server.ship_at({"ship_changes": changes}, start) == "ship_gold"
+
+    full = [{"ship": "ship_gold", "from": "ship_cosmic", "at": start + timedelta(minutes=i)}
+            for i in range(server.SHIP_CHANGES_KEPT)]
+    assert server.ship_at({"ship_changes": full}, start - timedelta(seconds=1)) == "basic"
@@ -0,0 +1,23 @@
+import logging
+
+import pytest
+
+from indexes import ensure_indexes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_an_index_over_duplicates_is_logged_and_the_rest_are_built(db, caplog):
+    # mongomock ignores partialFilterExpression, so pending duplicates stand in for approved ones
+    await db.payments.insert_many([
+        {"id": "p1", "user_id": "u1", "tx_hash": "a" * 64, "status": "pending"},
+        {"id": "p2", "user_id": "u2", "tx_hash": "a" * 64, "status": "pending"},
+    ])
+
+    with caplog.at_level(logging.ERROR, logger="indexes"):
+        await ensure_indexes(db)
+
+    assert "payments.tx_hash_approved_unique" in caplog.text
+    names = await db.payments.index_information()
+    assert {"tx_hash", "processed_at", "user_id_idempotency_key_unique"} <= set(names)
+    assert "email_unique" in await db.users.index_information()
@@ -0,0 +1,61 @@
+import pytest
+
+from leaderboard import Leaderboard
+
+pytestmark = pytest.mark.anyio
+
+
+def board(size=3, on_change=None):
+    return Leaderboard(ship_image=lambda ship_id: f"{ship_id}.png", size=size, on_change=on_change)
+
+
+def names(leaderboard):
+    return [(entry["username"], entry["total_earned"]) for entry in leaderboard.top()]
+
+
+async def test_only_the_top_list_is_kept():
+    leaderboard = board()
+    for i, total in enumerate((50, 10, 40, 30, 20)):
+        leaderboard.upsert(f"u{i}", total, f"p{i}")
+
+    assert names(leaderboard) == [("p0", 50), ("p2", 40), ("p3", 30)]
+    assert set(leaderboard._users) == {"u0", "u2", "u3"}
+
+    version = leaderboard.version
+    leaderboard.upsert("u1", 25, "p1")
+    assert leaderboard.version == version
+    leaderboard.upsert("u1", 45, "p1")
+    assert names(leaderboard) == [("p0", 50), ("p1", 45), ("p2", 40)]
+
+
+async def test_broadcast_totals_converge_in_any_order():
+    changes = []
+    first = board(on_change=changes.append)
+    first.upsert("u1", 10, "p1")
+    first.upsert("u1", 30, "p1")
+    first.upsert("u2", 20, "p2")
+
+    second = board()
+    for change in reversed(changes):
+        second.apply(change)
+    assert names(second) == names(first) == [("p1", 30), ("p2", 20)]
+
+
+async def test_seed_reads_only_the_top_list(db):
+    await db.users.insert_many([
+        {"id": f"u{i}", "username": f"p{i}", "total_earned": total} for i, total in enumerate((5, 50, 20, 50, 1))
+    ])
+    leaderboard = board()
+    await leaderboard.seed(db.users)
+    assert names(leaderboard) == [("p1", 50), ("p3", 50), ("p2", 20)]
+
+
+async def test_rank_past_the_top_list_is_counted_in_mongo(db):
+    totals = {"u0": 90, "u1": 70, "u2": 70, "u3": 40, "u4": 10}
+    await db.users.insert_many([{"id": user_id, "username": user_id, "total_earned": total}
+                                for user_id, total in totals.items()])
+    leaderboard = board(size=2)
+    await leaderboard.seed(db.users)
+
+    ranks = [await leaderboard.rank(db.users, user_id, total) for user_id, total in totals.items()]
+    assert ranks == [1, 2, 3, 4, 5]
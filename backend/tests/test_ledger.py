@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from ledger import (
+    GAME, OPENING, WITHDRAW, balance_at, compact, find_mismatches, ledger_balances, rebuild_balances,
+    seed_opening_balances,
+)
+
+pytestmark = pytest.mark.anyio
+
+DAY_ONE = datetime(2026, 3, 1)
+
+
+def entry(user_id, coins, kind, at, earned=0):
+    return {"u": user_id, "d": coins, "e": earned, "k": kind, "t": at}
+
+
+async def test_seeding_opening_balances_makes_every_user_agree(db):
+    await db.users.insert_many([
+        {"id": "old", "coins": 500, "total_earned": 800},
+        {"id": "new", "coins": 40, "total_earned": 40},
+    ])
+    await db.ledger.insert_one(entry("new", 40, GAME, DAY_ONE, earned=40))
+
+    assert await seed_opening_balances(db) == 1
+    opening = await db.ledger.find_one({"k": OPENING}, {"_id": 0})
+    assert (opening["u"], opening["d"], opening["e"]) == ("old", 500, 800)
+    assert await find_mismatches(db) == []
+    with pytest.raises(RuntimeError):
+        await seed_opening_balances(db)
+
+
+async def test_rebuild_lists_drift_and_rewrites_it_only_when_applied(db):
+    await db.users.insert_one({"id": "u1", "coins": 100, "total_earned": 100})
+    with pytest.raises(RuntimeError):
+        await rebuild_balances(db)
+    await seed_opening_balances(db)
+    await db.ledger.insert_one(entry("u1", -30, WITHDRAW, DAY_ONE))
+    # The withdrawal's user update never landed
+    [mismatch] = await find_mismatches(db)
+    assert (mismatch["coins"], mismatch["ledger_coins"]) == (100, 70)
+
+    # Only listed until applied
+    assert await rebuild_balances(db) == [mismatch]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 100
+    assert await rebuild_balances(db, apply=True, user_ids=["u2"]) == []
+    assert await rebuild_balances(db, apply=True, user_ids=["u1"]) == [mismatch]
+    assert await find_mismatches(db) == []
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 70
+
+
+async def test_compaction_keeps_balances_and_history(db):
+    await db.ledger.insert_many([
+        entry("u1", 100, GAME, DAY_ONE + timedelta(hours=1), earned=100),
+        entry("u1", -40, WITHDRAW, DAY_ONE + timedelta(hours=2)),
+        entry("u1", 10, GAME, DAY_ONE + timedelta(days=1, hours=1), earned=10),
+        entry("u1", 5, GAME, DAY_ONE + timedelta(days=2, hours=1), earned=5),
+    ])
+    before = await ledger_balances(db)
+
+    assert await compact(db, now=DAY_ONE + timedelta(days=2, hours=2), retention_days=1) == 2
+    assert await ledger_balances(db) == before == {"u1": (75, 115)}
+    assert await db.ledger.count_documents({}) == 2
+    assert await balance_at(db, "u1", DAY_ONE + timedelta(days=1, hours=12)) == {"coins": 70, "total_earned": 110}
+    assert await balance_at(db, "u1", DAY_ONE + timedelta(days=3)) == {"coins": 75, "total_earned": 115}
+    # A second compactor finds nothing left to do
+    assert await compact(db, now=DAY_ONE + timedelta(days=2, hours=2)) == 0
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import MetricsRegistry, MongoCommandListener
+
+pytestmark = pytest.mark.anyio
+
+
+class ListenedUsers:
+    """Reports each read to the command listener the way Motor's monitoring would."""
+
+    def __init__(self, users, listener):
+        self.users = users
+        self.listener = listener
+
+    async def find_one(self, *args, **kwargs):
+        self.listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+        return await self.users.find_one(*args, **kwargs)
+
+
+async def test_requests_are_counted_by_route_with_their_mongo_calls(app, api, db, add_player):
+    headers = await add_player()
+    services = app.state.services
+    services.db = SimpleNamespace(users=ListenedUsers(db.users, MongoCommandListener(services.metrics_registry)))
+
+    async with api:
+        for _ in range(2):
+            assert (await api.get("/api/auth/me", headers=headers)).status_code == 200
+        body = (await api.get("/metrics")).text
+
+    route = 'method="GET",route="/api/auth/me"'
+    assert f'cosmic_http_requests_total{{{route},status="200"}} 2' in body
+    assert f'cosmic_http_request_mongo_calls_bucket{{{route},le="0"}} 1' in body
+    assert f'cosmic_http_request_mongo_calls_bucket{{{route},le="1"}} 2' in body
+    assert 'cosmic_mongo_commands_total{route="/api/auth/me",command="find"} 1' in body
+    assert 'cosmic_auth_lookups_total{route="/api/auth/me",source="cache"} 1' in body
+    assert 'cosmic_auth_lookups_total{route="/api/auth/me",source="mongo"} 1' in body
+    assert "cosmic_session_cache_hits_total 1" in body
+
+
+def test_commands_outside_a_request_are_attributed_to_background():
+    registry = MetricsRegistry()
+    registry.record_mongo_command("update", 0.25)
+    registry.register_callback("cosmic_example", "gauge", "Example.", lambda: 3)
+
+    body = registry.render()
+    assert 'cosmic_mongo_commands_total{route="background",command="update"} 1' in body
+    assert 'cosmic_mongo_command_seconds_total{route="background"} 0.25' in body
+    assert "# TYPE cosmic_example gauge\ncosmic_example 3" in body
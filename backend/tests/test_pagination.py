@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor, keyset_page
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 2, 1)
+PROJECTION = {"_id": 0, "id": 1, "created_at": 1}
+
+
+async def add_payments(db, count, status="pending"):
+    # Pairs share a created_at, so pages have to break ties by id
+    await db.payments.insert_many([
+        {"id": f"p{i:02d}", "user_id": "u1", "status": status, "created_at": START + timedelta(seconds=i // 2)}
+        for i in range(count)
+    ])
+
+
+def test_cursor_round_trip_and_garbage():
+    doc = {"created_at": START, "id": "p01"}
+    assert decode_cursor(encode_cursor(doc)) == (START, "p01")
+    for cursor in ("", "not-base64!", encode_cursor(doc)[:-3]):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+
+async def test_pages_continue_from_the_cursor_without_gaps_or_repeats(db):
+    await add_payments(db, 11)
+    seen = []
+    cursor = None
+    while True:
+        docs, cursor = await keyset_page(db.payments, {"status": "pending"}, PROJECTION, 3, cursor)
+        seen.append([doc["id"] for doc in docs])
+        if cursor is None:
+            break
+        # Written behind the cursor while paging: not revisited
+        await db.payments.insert_one({"id": f"late{len(seen)}", "status": "pending", "created_at": START})
+
+    assert [doc_id for page in seen for doc_id in page] == [f"p{i:02d}" for i in range(11)]
+    assert [len(page) for page in seen] == [3, 3, 3, 2]
+
+
+async def test_admin_queue_pages_and_export(api, db, add_player):
+    admin = await add_player("admin", is_admin=True)
+    await add_payments(db, 5)
+    await db.payments.insert_one({"id": "done", "status": "approved", "created_at": START})
+
+    async with api:
+        first = (await api.get("/api/admin/payments", params={"limit": 3}, headers=admin)).json()
+        second = (await api.get("/api/admin/payments", params={"limit": 3, "cursor": first["next_cursor"]},
+                                headers=admin)).json()
+        invalid = await api.get("/api/admin/payments", params={"cursor": "bogus"}, headers=admin)
+        export = await api.get("/api/admin/payments/export", headers=admin)
+
+    assert [p["id"] for p in first["payments"] + second["payments"]] == [f"p{i:02d}" for i in range(5)]
+    assert second["next_cursor"] is None
+    assert (invalid.status_code, invalid.json()["detail"]) == (400, "Geçersiz cursor")
+    assert export.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in export.text.splitlines()]
+    assert [line["id"] for line in lines] == [f"p{i:02d}" for i in range(5)]
+    assert lines[0]["created_at"] == START.isoformat()
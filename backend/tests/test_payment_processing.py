@@ -0,0 +1,150 @@
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import payment_processing
+from boosts import BoostSweeper
+from catalog import ITEMS_BY_ID
+from payment_processing import (
+    ALREADY_PROCESSED, APPROVED, NOT_FOUND, TX_HASH_USED, approve_payments, build_credit_update, process_withdrawals
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_user(db, user_id, **fields):
+    await db.users.insert_one({"id": user_id, "coins": 0, "owned_ships": ["basic"], "active_boosts": [], **fields})
+
+
+async def add_payment(db, payment_id, user_id, item_id="coins_1000", status="pending", **fields):
+    await db.payments.insert_one({"id": payment_id, "user_id": user_id, "item_id": item_id, "status": status, **fields})
+
+
+async def test_approve_payments_credits_once_and_records_ledger(db, ledger):
+    await add_user(db, "u1")
+    await add_payment(db, "p1", "u1")
+    await add_payment(db, "p2", "u1", status="approved")
+
+    results, credited = await approve_payments(db, db.client, ["p1", "p2", "p3", "p1"], ledger)
+
+    assert results == [
+        {"id": "p1", "status": APPROVED},
+        {"id": "p2", "status": ALREADY_PROCESSED},
+        {"id": "p3", "status": NOT_FOUND},
+        {"id": "p1", "status": ALREADY_PROCESSED},
+    ]
+    assert credited == ["u1"]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 1000
+    assert [entry[:3] for entry in ledger.entries] == [("u1", 1000, "payment")]
+
+
+async def test_only_one_payment_per_tx_hash_is_approved(db, ledger):
+    await add_user(db, "u1")
+    await add_user(db, "u2")
+    await add_payment(db, "p1", "u1", tx_hash="a" * 64)
+    await add_payment(db, "p2", "u2", tx_hash="a" * 64)
+    await add_payment(db, "p3", "u2", tx_hash="b" * 64)
+
+    results, _ = await approve_payments(db, db.client, ["p1", "p2"], ledger)
+    assert [r["status"] for r in results] == [APPROVED, TX_HASH_USED]
+    results, _ = await approve_payments(db, db.client, ["p2", "p3"], ledger)
+    assert [r["status"] for r in results] == [TX_HASH_USED, APPROVED]
+    assert [(await db.users.find_one({"id": u}))["coins"] for u in ("u1", "u2")] == [1000, 1000]
+
+
+async def test_approve_payments_reports_payments_claimed_concurrently(db, ledger, monkeypatch):
+    await add_user(db, "u1")
+    await add_payment(db, "p1", "u1")
+    await add_payment(db, "p2", "u1")
+    real_claim = payment_processing.claim
+
+    async def racing_claim(collection, doc_ids, *args, **kwargs):
+        # Another approver takes p2 between the read and this call's claim
+        await collection.update_one({"id": "p2"}, {"$set": {"status": "approved"}})
+        return await real_claim(collection, doc_ids, *args, **kwargs)
+
+    monkeypatch.setattr(payment_processing, "claim", racing_claim)
+    results, credited = await approve_payments(db, db.client, ["p1", "p2"], ledger)
+
+    assert results == [{"id": "p1", "status": APPROVED}, {"id": "p2", "status": ALREADY_PROCESSED}]
+    assert credited == ["u1"]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 1000
+    assert [entry[4] for entry in ledger.entries] == ["p1"]
+
+
+async def test_rejected_withdrawals_are_refunded(db, ledger):
+    await add_user(db, "u1")
+    await db.withdrawals.insert_one({"id": "w1", "user_id": "u1", "coins_amount": 10000, "status": "pending"})
+
+    results, refunded = await process_withdrawals(db, db.client, ["w1", "w1"], False, ledger)
+
+    assert [r["status"] for r in results] == ["rejected", ALREADY_PROCESSED]
+    assert refunded == ["u1"]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 10000
+    assert [entry[:3] for entry in ledger.entries] == [("u1", 10000, "refund")]
+
+
+async def test_boost_credit_sets_a_bound_for_users_without_one(db):
+    now = datetime.utcnow().replace(microsecond=0)
+    await add_user(db, "u1", boost_multiplier=1.0, boost_until=None)
+
+    await db.users.update_one({"id": "u1"}, build_credit_update([ITEMS_BY_ID["boost_2x_1h"]], now))
+
+    user = await db.users.find_one({"id": "u1"})
+    assert user["boost_multiplier"] == 2.0
+    assert user["boost_until"] == now + timedelta(minutes=60)
+    assert [boost["id"] for boost in user["active_boosts"]] == ["boost_2x_1h"]
+
+
+async def test_boost_credit_folds_into_a_current_summary(db):
+    now = datetime.utcnow().replace(microsecond=0)
+    await add_user(db, "u1")
+    await db.users.update_one({"id": "u1"}, build_credit_update([ITEMS_BY_ID["boost_2x_1h"]], now))
+    await db.users.update_one({"id": "u1"}, build_credit_update([ITEMS_BY_ID["boost_10x_30m"]], now))
+
+    user = await db.users.find_one({"id": "u1"})
+    assert user["boost_multiplier"] == 20.0
+    assert user["boost_until"] == now + timedelta(minutes=30)
+
+
+async def test_boost_credit_keeps_a_stale_bound_in_the_past(db):
+    now = datetime.utcnow().replace(microsecond=0)
+    stale = now - timedelta(minutes=1)
+    await add_user(db, "u1", boost_multiplier=5.0, boost_until=stale)
+
+    await db.users.update_one({"id": "u1"}, build_credit_update([ITEMS_BY_ID["boost_2x_1h"]], now))
+
+    assert (await db.users.find_one({"id": "u1"}))["boost_until"] == stale
+
+
+async def test_credited_boost_is_swept_once_it_expires(db):
+    then = datetime.utcnow().replace(microsecond=0) - timedelta(hours=2)
+    await add_user(db, "u1", boost_multiplier=1.0, boost_until=None)
+    await db.users.update_one({"id": "u1"}, build_credit_update([ITEMS_BY_ID["boost_2x_1h"]], then))
+
+    swept = await BoostSweeper().sweep(db.users, {"boost_until": {"$lte": datetime.utcnow()}})
+
+    user = await db.users.find_one({"id": "u1"})
+    assert swept == 1
+    assert (user["active_boosts"], user["boost_multiplier"], user["boost_until"]) == ([], 1.0, None)
+
+
+async def test_ship_credit_skips_owned_ships(db):
+    await add_user(db, "u1", owned_ships=["basic", "ship_silver"])
+    items = [ITEMS_BY_ID["ship_silver"], ITEMS_BY_ID["ship_silver"], ITEMS_BY_ID["coins_1000"]]
+
+    await db.users.update_one({"id": "u1"}, build_credit_update(items, datetime.utcnow()))
+
+    user = await db.users.find_one({"id": "u1"})
+    assert user["owned_ships"] == ["basic", "ship_silver"]
+    assert user["coins"] == 1000
+
+
+async def test_ship_credit_appends_new_ships_once(db):
+    await add_user(db, "u1", owned_ships=["basic", "ship_silver"])
+    items = [ITEMS_BY_ID["ship_diamond"], ITEMS_BY_ID["ship_silver"], ITEMS_BY_ID["ship_diamond"]]
+
+    await db.users.update_one({"id": "u1"}, build_credit_update(items, datetime.utcnow()))
+
+    assert (await db.users.find_one({"id": "u1"}))["owned_ships"] == ["basic", "ship_silver", "ship_diamond"]
@@ -0,0 +1,174 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from catalog import ITEMS_BY_ID
+from payment_processing import TX_HASH_USED
+from payment_verification import (
+    AMOUNT_TOO_LOW, NO_PAYER_WALLET, NO_TRANSFER, PAYER_MISMATCH, TRANSFER_TOPIC, TX_TOO_OLD, USDT_CONTRACT,
+    USDT_DECIMALS, WALLET_REGISTERED_LATER, PaymentVerifier, address_hex, base58_address, check_transfer,
+    find_duplicate_tx_hashes, normalize_stored_tx_hashes
+)
+
+pytestmark = pytest.mark.anyio
+
+RECIPIENT = "TP92d2cyjwXNdFuJN9P8WeQ2jDWW7rvJMA"
+ITEM = ITEMS_BY_ID["coins_1000"]
+
+
+def epoch_ms(at: datetime) -> int:
+    return int((at - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def transfer_info(sender: str, usdt: float = ITEM.price_usdt, to: str = RECIPIENT, at: datetime = None) -> dict:
+    return {
+        "blockTimeStamp": epoch_ms(at or datetime.utcnow()),
+        "receipt": {"result": "SUCCESS"},
+        "log": [{
+            "address": address_hex(USDT_CONTRACT),
+            "topics": [TRANSFER_TOPIC, "0" * 24 + address_hex(sender), "0" * 24 + address_hex(to)],
+            "data": format(round(usdt * 10 ** USDT_DECIMALS), "064x"),
+        }],
+    }
+
+
+class StubNode:
+    def __init__(self):
+        self.transactions = {}
+
+    async def transaction_info(self, tx_hash):
+        return self.transactions.get(tx_hash)
+
+    async def aclose(self):
+        pass
+
+
+def new_wallet() -> str:
+    return base58_address(os.urandom(20).hex())
+
+
+async def add_payer(db, user_id, wallet=None, since=None):
+    await db.users.insert_one({
+        "id": user_id, "coins": 0, "owned_ships": ["basic"], "active_boosts": [],
+        "tron_wallet": wallet, "tron_wallet_since": since,
+    })
+
+
+async def submit(db, payment_id, user_id, tx_hash):
+    now = datetime.utcnow()
+    await db.payments.insert_one({
+        "id": payment_id, "user_id": user_id, "tx_hash": tx_hash, "item_id": ITEM.id,
+        "status": "pending", "created_at": now, "verify_next_at": now,
+    })
+
+
+def test_address_round_trip():
+    assert base58_address(address_hex(RECIPIENT)) == RECIPIENT
+    with pytest.raises(ValueError):
+        address_hex(RECIPIENT[:-1] + "N")
+    with pytest.raises(ValueError):
+        address_hex("0" + RECIPIENT[1:])
+
+
+def test_check_transfer_requires_the_payer_as_sender():
+    payer, other = new_wallet(), new_wallet()
+    recipient, contract = address_hex(RECIPIENT), address_hex(USDT_CONTRACT)
+    min_units = round(ITEM.price_usdt * 10 ** USDT_DECIMALS)
+    not_before = epoch_ms(datetime.utcnow() - timedelta(hours=1))
+
+    def check(info):
+        return check_transfer(info, recipient, contract, address_hex(payer), min_units, not_before)
+
+    assert check(transfer_info(payer)) is None
+    assert check(transfer_info(other)) == PAYER_MISMATCH
+    assert check(transfer_info(payer, to=new_wallet())) == NO_TRANSFER
+    assert check(transfer_info(payer, usdt=ITEM.price_usdt / 2)) == AMOUNT_TOO_LOW
+    assert check(transfer_info(payer, at=datetime.utcnow() - timedelta(hours=2))) == TX_TOO_OLD
+
+
+async def test_verifier_only_approves_transfers_from_the_payers_wallet(db, ledger):
+    node = StubNode()
+    verifier = PaymentVerifier(node, RECIPIENT)
+    registered = datetime.utcnow() - timedelta(minutes=10)
+    alice, bob = new_wallet(), new_wallet()
+    await add_payer(db, "alice", alice, registered)
+    await add_payer(db, "bob", bob, registered)
+    await add_payer(db, "carol")
+
+    node.transactions["a" * 64] = transfer_info(alice)
+    await submit(db, "paid", "alice", "a" * 64)
+    # Bob copies Alice's tx_hash from the chain, and Carol pays without a registered wallet
+    node.transactions["b" * 64] = transfer_info(alice)
+    await submit(db, "stolen", "bob", "b" * 64)
+    node.transactions["c" * 64] = transfer_info(new_wallet())
+    await submit(db, "no-wallet", "carol", "c" * 64)
+    # Made before Bob registered the wallet it came from
+    node.transactions["d" * 64] = transfer_info(bob, at=registered - timedelta(minutes=1))
+    await submit(db, "before-wallet", "bob", "d" * 64)
+
+    assert await verifier.run_once(db, db.client, ledger) == 4
+
+    payments = {p["id"]: p async for p in db.payments.find({}, {"_id": 0})}
+    assert payments["paid"]["status"] == "approved"
+    assert {pid: (p["status"], p.get("verification")) for pid, p in payments.items() if pid != "paid"} == {
+        "stolen": ("pending", PAYER_MISMATCH),
+        "no-wallet": ("pending", NO_PAYER_WALLET),
+        "before-wallet": ("pending", WALLET_REGISTERED_LATER),
+    }
+    assert (await db.users.find_one({"id": "alice"}))["coins"] == 1000
+    assert (await db.users.find_one({"id": "bob"}))["coins"] == 0
+    assert verifier.stats() == {"approved": 1, "flagged": 3}
+
+
+async def test_verifier_retries_unconfirmed_transactions(db, ledger):
+    node = StubNode()
+    verifier = PaymentVerifier(node, RECIPIENT, interval=1.0)
+    wallet = new_wallet()
+    await add_payer(db, "alice", wallet, datetime.utcnow() - timedelta(minutes=10))
+    await submit(db, "p1", "alice", "e" * 64)
+
+    await verifier.run_once(db, db.client, ledger)
+    payment = await db.payments.find_one({"id": "p1"})
+    assert payment["status"] == "pending" and payment["verify_attempts"] == 1
+    assert "verification" not in payment and payment["verify_next_at"] > datetime.utcnow()
+
+    node.transactions["e" * 64] = transfer_info(wallet)
+    await db.payments.update_one({"id": "p1"}, {"$set": {"verify_next_at": datetime.utcnow()}})
+    await verifier.run_once(db, db.client, ledger)
+    assert (await db.payments.find_one({"id": "p1"}))["status"] == "approved"
+
+
+async def test_a_tx_hash_claimed_by_a_stranger_is_still_approved_for_its_payer(db, ledger):
+    node = StubNode()
+    verifier = PaymentVerifier(node, RECIPIENT)
+    alice = new_wallet()
+    await add_payer(db, "alice", alice, datetime.utcnow() - timedelta(minutes=10))
+    await add_payer(db, "mallory")
+    node.transactions["a" * 64] = transfer_info(alice)
+    # Mallory copies the hash from the chain before Alice reports her payment
+    await submit(db, "claimed", "mallory", "a" * 64)
+    await submit(db, "paid", "alice", "a" * 64)
+
+    await verifier.run_once(db, db.client, ledger)
+    await submit(db, "late", "alice", "a" * 64)
+    await verifier.run_once(db, db.client, ledger)
+
+    payments = {p["id"]: (p["status"], p.get("verification")) async for p in db.payments.find({}, {"_id": 0})}
+    assert payments == {
+        "claimed": ("pending", NO_PAYER_WALLET), "paid": ("approved", None), "late": ("pending", TX_HASH_USED),
+    }
+    assert (await db.users.find_one({"id": "alice"}))["coins"] == 1000
+
+
+async def test_stored_tx_hashes_are_normalized_before_finding_duplicates(db):
+    await db.payments.insert_many([
+        {"id": "p1", "tx_hash": "0x" + "AB" * 32, "status": "approved"},
+        {"id": "p2", "tx_hash": "ab" * 32 + " ", "status": "approved"},
+        {"id": "p3", "tx_hash": "ab" * 32, "status": "rejected"},
+        {"id": "p4", "tx_hash": "cd" * 32, "status": "approved"},
+    ])
+
+    assert await find_duplicate_tx_hashes(db) == []
+    assert await normalize_stored_tx_hashes(db, batch_size=1) == 2
+    assert [(d["_id"], sorted(d["ids"])) for d in await find_duplicate_tx_hashes(db)] == [("ab" * 32, ["p1", "p2"])]
@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+from leaderboard import Leaderboard
+from push import NORMAL_CLOSURE, POLICY_VIOLATION, TRY_AGAIN_LATER, PushHub
+
+pytestmark = pytest.mark.anyio
+
+
+def drain(connection):
+    messages = []
+    while not connection.queue.empty():
+        message = connection.queue.get_nowait()
+        messages.append(None if message is None else json.loads(message))
+    return messages
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+        self.left = asyncio.Event()
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code):
+        self.closed = code
+
+    async def receive(self):
+        await self.left.wait()
+        return {"type": "websocket.disconnect"}
+
+
+async def test_a_slow_consumer_is_dropped_instead_of_buffered():
+    hub = PushHub(queue_size=2)
+    slow = hub.connect("u1", greeting={"type": "hello"})
+    fast = hub.connect("u1")
+    socket = FakeSocket()
+
+    for coins in range(3):
+        hub.send("u1", {"type": "balance", "coins": coins})
+        drain(fast)
+
+    assert slow.dropped and not fast.dropped
+    # Only the close sign is left; the sender closes with "try again later"
+    assert drain(slow) == [None] and len(hub) == 1
+    slow.queue.put_nowait(None)
+    await hub.serve(socket, slow)
+    assert (socket.closed, socket.sent, hub.stats()["dropped"]) == (TRY_AGAIN_LATER, [], 1)
+
+
+async def test_the_oldest_connection_is_closed_past_the_per_user_limit():
+    hub = PushHub(max_connections_per_user=2)
+    first, second, third = (hub.connect("u1") for _ in range(3))
+
+    assert drain(first) == [None]
+    hub.send("u1", {"type": "refresh"})
+    assert drain(second) == drain(third) == [{"type": "refresh"}]
+    assert hub.stats()["connections"] == 2
+
+
+async def test_the_leaderboard_is_broadcast_once_per_change():
+    hub = PushHub()
+    board = Leaderboard(ship_image=lambda ship: ship, size=3)
+    hub.start(board)
+    await hub.stop()
+    connection = hub.connect("u1")
+
+    await hub.tick(board)
+    board.upsert("a", 10, "alice")
+    board.upsert("b", 20, "bob")
+    await hub.tick(board)
+    await hub.tick(board)
+
+    [message] = drain(connection)
+    assert [(entry["username"], entry["rank"]) for entry in message["leaderboard"]] == [("bob", 1), ("alice", 2)]
+
+
+async def websocket_session(app, query):
+    incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+    scope = {
+        "type": "websocket", "path": "/api/ws", "raw_path": b"/api/ws", "query_string": query.encode(),
+        "headers": [], "scheme": "ws", "server": ("test", 80), "client": ("127.0.0.1", 1), "root_path": "",
+        "subprotocols": [],
+    }
+    incoming.put_nowait({"type": "websocket.connect"})
+    task = asyncio.create_task(app(scope, incoming.get, outgoing.put))
+    return task, incoming, outgoing
+
+
+async def test_ws_greets_the_user_and_pushes_their_balance(app, api, db, add_player):
+    headers = await add_player(total_earned=40)
+    token = headers["Authorization"].split()[1]
+    task, incoming, outgoing = await websocket_session(app, f"token={token}")
+
+    assert (await outgoing.get())["type"] == "websocket.accept"
+    hello = json.loads((await outgoing.get())["text"])
+    assert (hello["type"], hello["coins"], hello["rank"]) == ("hello", 100, 1)
+    async with api:
+        await api.post("/api/game/result", headers=headers,
+                       json={"coins_earned": 50, "distance": 0, "crystals_collected": 5})
+    pushed = json.loads((await asyncio.wait_for(outgoing.get(), 1))["text"])
+    assert (pushed["type"], pushed["coins"], pushed["total_earned"]) == ("balance", 150, 90)
+
+    incoming.put_nowait({"type": "websocket.disconnect", "code": NORMAL_CLOSURE})
+    await asyncio.wait_for(task, 1)
+    assert len(app.state.services.push_hub) == 0
+
+
+async def test_ws_refuses_a_bad_token(app):
+    task, _, outgoing = await websocket_session(app, "token=garbage")
+    await asyncio.wait_for(task, 1)
+    assert await outgoing.get() == {"type": "websocket.close", "code": POLICY_VIOLATION, "reason": ""}
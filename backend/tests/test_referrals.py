@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from referrals import ReferralStats
+
+pytestmark = pytest.mark.anyio
+
+
+class AppliedThenFailed:
+    """A collection whose first bulk_write is applied but reported as failed, like a timeout."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.writes = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writes += 1
+        result = await self.collection.bulk_write(operations, ordered=ordered)
+        if self.writes == 1:
+            raise TimeoutError("reply lost")
+        return result
+
+
+class Gated:
+    """A collection whose writes wait for ``release``."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.release = asyncio.Event()
+        self.writing = asyncio.Event()
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writing.set()
+        await self.release.wait()
+        return await self.collection.bulk_write(operations, ordered=ordered)
+
+
+async def earned(db, user_id):
+    return (await db.users.find_one({"id": user_id}))["referral_network_earned"]
+
+
+async def test_a_retried_batch_is_counted_once(db):
+    await db.users.insert_many([{"id": "a", "referral_network_earned": 0}, {"id": "b", "referral_network_earned": 0}])
+    flushed = []
+    stats = ReferralStats(flush_interval=0.01, on_flushed=flushed.extend)
+    collection = AppliedThenFailed(db.users)
+    stats.start(collection)
+    stats.add("a", 100)
+    stats.add("b", 5)
+
+    for _ in range(100):
+        if flushed:
+            break
+        await asyncio.sleep(0.01)
+    stats.add("a", 1)
+    await stats.stop()
+
+    assert (await earned(db, "a"), await earned(db, "b")) == (101, 5)
+    assert sorted(flushed) == ["a", "a", "b"]
+    assert (collection.writes, stats.stats()["queued"]) == (3, 0)
+
+
+async def test_cancelling_stop_does_not_cut_the_final_flush_short(db):
+    await db.users.insert_one({"id": "a", "referral_network_earned": 0})
+    stats = ReferralStats(flush_interval=60)
+    gated = Gated(db.users)
+    stats.start(gated)
+    stats.add("a", 100)
+
+    stopping = asyncio.create_task(stats.stop())
+    await gated.writing.wait()
+    # Added while the flush that stop() woke up is writing
+    stats.add("a", 7)
+    stopping.cancel()
+    gated.release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await stopping
+    await stats._task
+
+    assert await earned(db, "a") == 107
@@ -0,0 +1,45 @@
+import pytest
+
+from ledger import REFERRAL, SIGNUP
+
+pytestmark = pytest.mark.anyio
+
+
+def signup(name, **fields):
+    return {"email": f"{name}@example.com", "username": name, "password": "secret123", **fields}
+
+
+async def test_referral_code_credits_the_inviter_after_the_response(app, api, db, ledger, add_player):
+    await add_player("grandparent")
+    await add_player("inviter", referral_code="INVITE01", referred_by="grandparent")
+    services = app.state.services
+
+    async with api:
+        response = await api.post("/api/auth/register", json=signup("newbie", referral_code="invite01"))
+
+    assert response.status_code == 200
+    user = response.json()["user"]
+    assert (user["coins"], user["total_earned"]) == (150, 150)
+    inviter = await db.users.find_one({"id": "inviter"})
+    assert (inviter["coins"], inviter["total_earned"], inviter["referral_count"]) == (300, 200, 1)
+    assert [entry[2] for entry in ledger.entries] == [SIGNUP, REFERRAL]
+    assert ledger.entries[1] == ("inviter", 200, REFERRAL, 200, user["id"])
+    assert await services.leaderboard.rank(db.users, "inviter", 200) == 1
+    services.referral_stats.start(db.users)
+    await services.referral_stats.stop()
+    network = {u["id"]: u.get("referral_network_earned") async for u in db.users.find({}, {"_id": 0})}
+    assert (network["inviter"], network["grandparent"]) == (150, 200)
+
+
+async def test_taken_email_and_username_are_refused(app, api, db):
+    await db.users.create_index("email", unique=True)
+    await db.users.create_index("username", unique=True)
+
+    async with api:
+        assert (await api.post("/api/auth/register", json=signup("taken"))).status_code == 200
+        same_email = await api.post("/api/auth/register", json=signup("taken") | {"username": "other"})
+        same_name = await api.post("/api/auth/register", json=signup("taken") | {"email": "other@example.com"})
+
+    assert (same_email.status_code, same_email.json()["detail"]) == (400, "Email zaten kayıtlı")
+    assert (same_name.status_code, same_name.json()["detail"]) == (400, "Kullanıcı adı zaten alınmış")
+    assert await db.users.count_documents({}) == 1
@@ -0,0 +1,58 @@
+import pytest
+
+import server
+from game_ingest import GameResultIngestor
+
+pytestmark = pytest.mark.anyio
+
+
+class FlushDuringRead:
+    """A users collection whose next read returns a document from before a flush."""
+
+    def __init__(self, users, ingestor):
+        self.users = self
+        self._users = users
+        self._ingestor = ingestor
+        self.reads = 0
+
+    async def find_one(self, *args, **kwargs):
+        self.reads += 1
+        user = await self._users.find_one(*args, **kwargs)
+        if self.reads == 1:
+            await self._ingestor.stop()
+        return user
+
+
+@pytest.fixture
+def app_services(db):
+    app_services = server.create_app().state.services
+    server.use_services(app_services)
+    return app_services
+
+
+async def test_a_read_spanning_a_flush_is_not_cached_stale(app_services, db):
+    await db.users.insert_one({"id": "u1", "coins": 100, "total_earned": 100})
+    ingestor = GameResultIngestor(flush_interval=60)
+    ingestor.start(db.users)
+    ingestor.submit("u1", 50)
+    app_services.game_result_ingestor = ingestor
+    app_services.db = FlushDuringRead(db.users, ingestor)
+
+    user = await server.load_session_user("u1")
+
+    assert app_services.db.reads == 2
+    assert (user["coins"], user["total_earned"]) == (150, 150)
+    assert app_services.session_cache.get("u1")["coins"] == 150
+
+
+async def test_a_read_with_pending_credits_is_cached_with_them(app_services, db):
+    await db.users.insert_one({"id": "u1", "coins": 100, "total_earned": 100})
+    ingestor = GameResultIngestor(flush_interval=60)
+    ingestor.start(db.users)
+    ingestor.submit("u1", 50)
+    app_services.game_result_ingestor = ingestor
+    app_services.db = db
+
+    assert (await server.load_session_user("u1"))["coins"] == 150
+    assert app_services.session_cache.get("u1")["coins"] == 150
+    await ingestor.stop()
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def unique_indexes(db):
+    # The ones the endpoints rely on; mongomock ignores partialFilterExpression, so every request sends a key
+    await db.payments.create_index([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True)
+    await db.withdrawals.create_index([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True)
+
+
+def submit(api, headers, key, tx_hash="ab" * 32):
+    return api.post("/api/shop/submit-payment", headers={**headers, "Idempotency-Key": key},
+                    json={"tx_hash": tx_hash, "amount_usdt": 2.0, "item_id": "coins_1000"})
+
+
+async def test_retried_payment_submissions_create_one_payment(api, db, add_player, unique_indexes):
+    headers = await add_player()
+
+    async with api:
+        responses = await asyncio.gather(*(submit(api, headers, "k1") for _ in range(3)))
+
+    assert [r.status_code for r in responses] == [200] * 3
+    assert len({r.json()["payment_id"] for r in responses}) == 1
+    assert await db.payments.count_documents({}) == 1
+
+
+async def test_a_transfer_is_reported_once_per_user_until_approved(app, api, db, add_player, unique_indexes):
+    first = await add_player("u1")
+    second = await add_player("u2")
+    admin = await add_player("admin", is_admin=True)
+
+    async with api:
+        assert (await submit(api, first, "k1", tx_hash="0x" + "AB" * 32)).status_code == 200
+        again = await submit(api, first, "k2")
+        assert (await submit(api, second, "k1", tx_hash=" " + "ab" * 32)).status_code == 200
+        [payment] = await db.payments.find({"user_id": "u2"}).to_list(None)
+        assert (await api.post(f"/api/admin/approve-payment/{payment['id']}", headers=admin)).status_code == 200
+        after_approval = await submit(api, first, "k3")
+
+    assert (again.status_code, after_approval.status_code) == (409, 409)
+    assert again.json()["detail"] == "Bu işlem zaten bildirilmiş"
+    assert await db.payments.count_documents({"tx_hash": "ab" * 32}) == 2
+
+
+async def test_a_strangers_pending_claim_does_not_block_the_payer(api, db, add_player, unique_indexes):
+    stranger = await add_player("stranger")
+    payer = await add_player("payer")
+
+    async with api:
+        claimed = await submit(api, stranger, "k1")
+        paid = await submit(api, payer, "k1")
+
+    assert (claimed.status_code, paid.status_code) == (200, 200)
+    assert claimed.json()["payment_id"] != paid.json()["payment_id"]
+
+
+def test_duplicate_key_field_falls_back_to_the_index_name():
+    error = DuplicateKeyError("E11000 duplicate key error collection: cosmic_miner.users index: email_unique")
+    assert server.duplicate_key_field(error) == "email"
+
+
+async def test_retried_withdrawals_debit_once(api, db, ledger, add_player, unique_indexes):
+    headers = {**await add_player(coins=25000), "Idempotency-Key": "w1"}
+    body = {"coins_amount": 10000, "wallet_address": "T" + "x" * 33}
+
+    async with api:
+        first, second = await asyncio.gather(
+            api.post("/api/withdraw/request", headers=headers, json=body),
+            api.post("/api/withdraw/request", headers=headers, json=body),
+        )
+
+    assert (first.status_code, second.status_code) == (200, 200)
+    assert first.json()["withdraw_id"] == second.json()["withdraw_id"]
+    assert (await db.users.find_one({"id": "u1"}))["coins"] == 15000
+    assert await db.withdrawals.count_documents({}) == 1
+    assert [entry[1] for entry in ledger.entries] == [-10000]
@@ -0,0 +1,37 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+class Unreachable:
+    def __getattr__(self, name):
+        raise AssertionError(f"game_results.{name} read while approving a withdrawal")
+
+
+async def add_withdrawal(db, withdrawal_id, user_id):
+    await db.withdrawals.insert_one({
+        "id": withdrawal_id, "user_id": user_id, "coins_amount": 10000, "status": "pending",
+    })
+
+
+async def test_approval_refuses_users_the_last_scan_flagged(app, api, db, add_player):
+    admin = await add_player("admin", is_admin=True)
+    await add_player("cheater", cheat_flagged=True)
+    await add_player("fair", cheat_flagged=False)
+    for withdrawal_id, user_id in (("w1", "cheater"), ("w2", "fair"), ("w3", "cheater"), ("w4", "cheater")):
+        await add_withdrawal(db, withdrawal_id, user_id)
+    # The scan runs offline; approving only reads its verdict
+    db.game_results = Unreachable()
+
+    async with api:
+        refused = await api.post("/api/admin/process-withdrawal/w1", params={"approve": True}, headers=admin)
+        batch = await api.post("/api/admin/process-withdrawals", params={"approve": True},
+                               json={"ids": ["w2", "w3"]}, headers=admin)
+        forced = await api.post("/api/admin/process-withdrawal/w4", params={"approve": True, "force": True},
+                                headers=admin)
+
+    assert (refused.status_code, refused.json()["detail"]) == (409, "Kullanıcı hile şüphesiyle işaretli")
+    assert batch.json()["results"] == [{"id": "w2", "status": "approved"}, {"id": "w3", "status": "flagged"}]
+    assert forced.status_code == 200
+    statuses = {w["id"]: w["status"] async for w in db.withdrawals.find({}, {"_id": 0})}
+    assert statuses == {"w1": "pending", "w2": "approved", "w3": "pending", "w4": "approved"}
@@ -18,6 +18,8 @@ const { width, height } = Dimensions.get('window');
 const GAME_HEIGHT = height - 300;
 const SHIP_SIZE = 50;
 const CRYSTAL_SIZE = 30;
+// Mesafe oyun süresinden hesaplanır; backend hile kontrol sınırları içinde kalmalı
+const DISTANCE_PER_SECOND = 40;
 
 // API URL - Production'da değiştir
 const API_URL = "https://6d0699a9-cb44-4212-8039-3822d47fb0c1.preview.emergentagent.com";
@@ -43,6 +45,7 @@ export default function App() {
   const [score, setScore] = useState(0);
   const [crystals, setCrystals] = useState([]);
   const [gameRunning, setGameRunning] = useState(false);
+  const [gameStartedAt, setGameStartedAt] = useState(0);
   const [highScore, setHighScore] = useState(0);
   
   // Referral state
@@ -199,6 +202,7 @@ export default function App() {
     setScore(0);
     setCrystals([]);
     setShipX(width / 2);
+    setGameStartedAt(Date.now());
     setGameRunning(true);
   };
 
@@ -209,7 +213,7 @@ export default function App() {
       try {
         const response = await axios.post(`${API_URL}/api/game/result`, {
           coins_earned: score,
-          distance: 0,
+          distance: Math.floor((Date.now() - gameStartedAt) / 1000 * DISTANCE_PER_SECOND),
           crystals_collected: Math.floor(score / 10)
         }, {
           headers: { Authorization: `Bearer ${token}` }